@@ -1,7 +1,116 @@
-def registrar_auditoria(cursor, tabla, registro_id, accion, usuario, detalles, ip_address=None):
+import io
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from psycopg2.extras import execute_values
+from config import AUDITORIA_CONFIG
+from database import Database
+
+# Instancia compartida: usa el pool único del proceso
+db = Database()
+
+COLUMNAS_COPY = ('tabla', 'registro_id', 'accion', 'usuario', 'fecha', 'ip_address', 'detalles')
+
+# Eventos diferidos de la transacción en curso de cada hilo. El ejecutor
+# de transacciones los entrega al sink solo si la transacción confirma.
+_captura = threading.local()
+
+
+def iniciar_captura():
+    """Empezar a acumular los eventos diferidos de una transacción"""
+    _captura.eventos = []
+
+
+def confirmar_captura():
+    """La transacción confirmó: enviar sus eventos al sink"""
+    eventos = getattr(_captura, 'eventos', None)
+    _captura.eventos = None
+    if eventos:
+        obtener_sink().encolar(eventos)
+
+
+def descartar_captura():
+    """La transacción se revirtió: sus eventos no ocurrieron"""
+    _captura.eventos = None
+
+
+# Tablas con trigger trg_auditar_* (ver clinica_lab.sql)
+TABLAS_CON_TRIGGER = frozenset({'pacientes', 'ordenes', 'resultados'})
+
+
+def _cubierto_por_trigger(tabla):
+    return AUDITORIA_CONFIG['estrategia'] == 'trigger' and tabla in TABLAS_CON_TRIGGER
+
+
+def establecer_contexto_auditoria(cursor, usuario, ip_address=None, tabla=None,
+                                  accion=None, detalles=None, detalles_por_id=None,
+                                  estrategia=None):
     """
-    REQUISITO 4: Gestionar trazabilidad completa con auditoría de accesos
+    REQUISITO 4: Pasar al trigger de auditoría el usuario y la IP de la
+    aplicación y, para `tabla`, la acción y los detalles de los cambios que
+    siguen (detalles_por_id: {registro_id: detalles} para sentencias
+    multi-fila). Equivale a SET LOCAL: solo dura la transacción actual.
+    Llamar antes del INSERT/UPDATE/DELETE. Los procesos en segundo plano
+    usan un usuario de sistema fijo (por ejemplo 'rotacion_claves').
+    estrategia: por defecto la de AUDITORIA_CONFIG; 'aplicacion' desactiva
+    el trigger para quien escribe su propia auditoría.
     """
+    ajustes = [
+        ('clinica.usuario', usuario),
+        ('clinica.ip', ip_address or ''),
+        ('clinica.estrategia', estrategia or AUDITORIA_CONFIG['estrategia'])
+    ]
+    if tabla:
+        ajustes += [
+            (f'clinica.{tabla}_accion', accion or ''),
+            (f'clinica.{tabla}_detalles', detalles or ''),
+            (f'clinica.{tabla}_detalles_por_id',
+             json.dumps({str(k): v for k, v in detalles_por_id.items()}) if detalles_por_id else '')
+        ]
+    
+    cursor.execute(
+        "SELECT " + ", ".join(["set_config(%s, %s, true)"] * len(ajustes)),
+        [valor for ajuste in ajustes for valor in ajuste]
+    )
+
+
+def _diferir(tabla, accion, estricto):
+    """
+    Modo estricto: INSERT síncrono dentro de la transacción de negocio.
+    Se usa si se pide explícitamente, si la acción está regulada
+    (AUDITORIA_ACCIONES_ESTRICTAS), en modo 'sincrono' o fuera del ejecutor.
+    """
+    if estricto or AUDITORIA_CONFIG['modo'] != 'diferido':
+        return False
+    if getattr(_captura, 'eventos', None) is None:
+        return False
+    if estricto is None and (tabla, accion) in AUDITORIA_CONFIG['acciones_estrictas']:
+        return False
+    return True
+
+
+def registrar_auditoria(cursor, tabla, registro_id, accion, usuario, detalles,
+                        ip_address=None, estricto=None):
+    """
+    REQUISITO 4: Gestionar trazabilidad completa con auditoría de accesos.
+    Con la estrategia 'trigger', los cambios en tablas con trigger ya quedan
+    auditados (con el contexto de establecer_contexto_auditoria) y aquí no
+    se escribe nada.
+    """
+    if _cubierto_por_trigger(tabla):
+        return
+    
+    if _diferir(tabla, accion, estricto):
+        _captura.eventos.append(
+            (tabla, registro_id, accion, usuario, datetime.now(), ip_address, detalles)
+        )
+        return
+    
     cursor.execute("""
         INSERT INTO auditoria_accesos 
         (tabla, registro_id, accion, usuario, detalles, ip_address)
@@ -9,45 +118,512 @@ def registrar_auditoria(cursor, tabla, registro_id, accion, usuario, detalles, i
     """, (tabla, registro_id, accion, usuario, detalles, ip_address))
 
 
-def consultar_auditoria_resultado(resultado_id):
+def registrar_auditoria_lote(cursor, eventos, estricto=None):
     """
-    Consultar historial completo de accesos a un resultado
+    REQUISITO 4: Registrar varios eventos de auditoría en un solo INSERT
+    eventos: tuplas (tabla, registro_id, accion, usuario, detalles, ip_address)
     """
-    from database import Database
-    db = Database()
-    conn = db.get_connection()
+    eventos = [e for e in eventos if not _cubierto_por_trigger(e[0])]
+    if not eventos:
+        return
     
+    diferidos = [e for e in eventos if _diferir(e[0], e[2], estricto)]
+    if diferidos:
+        ahora = datetime.now()
+        _captura.eventos.extend(
+            (tabla, registro_id, accion, usuario, ahora, ip_address, detalles)
+            for tabla, registro_id, accion, usuario, detalles, ip_address in diferidos
+        )
+        if len(diferidos) == len(eventos):
+            return
+        eventos = [e for e in eventos if not _diferir(e[0], e[2], estricto)]
+    
+    execute_values(cursor, """
+        INSERT INTO auditoria_accesos 
+        (tabla, registro_id, accion, usuario, detalles, ip_address)
+        VALUES %s
+    """, eventos, page_size=1000)
+
+
+def _campo_copy(valor):
+    """Valor en el formato de texto de COPY"""
+    if valor is None:
+        return '\\N'
+    return (str(valor).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _proceso_vivo(pid):
+    """Si otro proceso con este PID sigue usando su spool"""
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # Sin señal 0 en Windows: el spool ajeno se considera abandonado
+        return False
     try:
-        with conn.cursor() as cursor:
-            # REQUISITO 2: Consulta optimizada con índices
-            cursor.execute("""
-                SELECT fecha, accion, usuario, detalles, ip_address
-                FROM auditoria_accesos
-                WHERE tabla = 'resultados' AND registro_id = %s
-                ORDER BY fecha DESC
-            """, (resultado_id,))
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SinkAuditoria:
+    """
+    Auditoría diferida (write-behind): los eventos se acumulan en memoria y
+    se vuelcan con COPY auditoria_accesos FROM STDIN al llegar a max_eventos
+    o cada `intervalo` segundos, desde un hilo en segundo plano.
+    
+    Antes de quedar en memoria cada evento se escribe en el spool local
+    (un JSON por línea). Al volcar, el archivo activo pasa a ser un
+    segmento que se borra tras el COPY; si el COPY falla se reintenta, y
+    los segmentos de un proceso caído se envían al arrancar el siguiente.
+    La entrega es "al menos una vez": una caída entre el COPY y el borrado
+    del segmento lo reenvía.
+    """
+    
+    _PATRON_ARCHIVO = re.compile(r'^(activo|segmento)-(\d+)(-\d+)?\.jsonl$')
+    
+    def __init__(self, spool, max_eventos=500, intervalo=1.0, fsync=True):
+        self._spool = spool
+        self._max_eventos = max_eventos
+        self._intervalo = intervalo
+        self._fsync = fsync
+        self._lock = threading.Lock()
+        self._lock_envio = threading.Lock()
+        self._buffer = []
+        self._archivo = None
+        # Segmentos pendientes de COPY: (ruta, eventos)
+        self._segmentos = []
+        self._pendiente = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        
+        os.makedirs(spool, exist_ok=True)
+        self._ruta_activo = os.path.join(spool, f'activo-{os.getpid()}.jsonl')
+        self._recuperar()
+    
+    def _nuevo_segmento(self):
+        return os.path.join(self._spool, f'segmento-{os.getpid()}-{time.time_ns()}.jsonl')
+    
+    def _recuperar(self):
+        """Adoptar los spools de procesos que ya no existen"""
+        for nombre in sorted(os.listdir(self._spool)):
+            coincidencia = self._PATRON_ARCHIVO.match(nombre)
+            if not coincidencia:
+                continue
+            pid = int(coincidencia.group(2))
+            ruta = os.path.join(self._spool, nombre)
+            if pid != os.getpid() and _proceso_vivo(pid):
+                continue
             
-            return cursor.fetchall()
-    finally:
-        db.release_connection(conn)
+            destino = self._nuevo_segmento()
+            try:
+                os.replace(ruta, destino)
+            except OSError:
+                continue
+            with open(destino, encoding='utf-8') as f:
+                eventos = [tuple(json.loads(linea)) for linea in f if linea.strip()]
+            if eventos:
+                self._segmentos.append((destino, eventos))
+            else:
+                os.remove(destino)
+        
+        if self._segmentos:
+            print(f"Auditoría: {sum(len(e) for _, e in self._segmentos)} eventos recuperados del spool")
+            self._asegurar_hilo()
+            self._pendiente.set()
+    
+    def _asegurar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name='sink-auditoria', daemon=True)
+            self._hilo.start()
+    
+    def encolar(self, eventos):
+        """
+        Registrar eventos (tabla, registro_id, accion, usuario, fecha,
+        ip_address, detalles): primero en el spool, luego en memoria
+        """
+        with self._lock:
+            if self._archivo is None:
+                self._archivo = open(self._ruta_activo, 'a', encoding='utf-8')
+            for evento in eventos:
+                self._archivo.write(json.dumps(evento, default=str) + '\n')
+            self._archivo.flush()
+            if self._fsync:
+                os.fsync(self._archivo.fileno())
+            self._buffer.extend(eventos)
+            lleno = len(self._buffer) >= self._max_eventos
+            self._asegurar_hilo()
+        
+        if lleno:
+            self._pendiente.set()
+    
+    def _copiar(self, eventos):
+        datos = io.StringIO()
+        for evento in eventos:
+            datos.write('\t'.join(_campo_copy(v) for v in evento) + '\n')
+        datos.seek(0)
+        
+        conn = db.get_connection()
+        try:
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY auditoria_accesos ({', '.join(COLUMNAS_COPY)}) FROM STDIN",
+                        datos
+                    )
+        finally:
+            db.release_connection(conn)
+    
+    def vaciar(self):
+        """Volcar ahora todo lo pendiente; retorna cuántos eventos se enviaron"""
+        with self._lock_envio:
+            with self._lock:
+                if self._buffer:
+                    self._archivo.close()
+                    self._archivo = None
+                    segmento = self._nuevo_segmento()
+                    os.replace(self._ruta_activo, segmento)
+                    self._segmentos.append((segmento, self._buffer))
+                    self._buffer = []
+                segmentos, self._segmentos = self._segmentos, []
+            
+            enviados = 0
+            for posicion, (ruta, eventos) in enumerate(segmentos):
+                try:
+                    self._copiar(eventos)
+                except Exception as e:
+                    print(f"Error al volcar auditoría (se reintentará): {e}")
+                    with self._lock:
+                        self._segmentos = segmentos[posicion:] + self._segmentos
+                    break
+                os.remove(ruta)
+                enviados += len(eventos)
+            return enviados
+    
+    def pendientes(self):
+        """Eventos aún no volcados a la base de datos"""
+        with self._lock:
+            return len(self._buffer) + sum(len(e) for _, e in self._segmentos)
+    
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._pendiente.wait(self._intervalo)
+            self._pendiente.clear()
+            self.vaciar()
     
-def consultar_auditoria_tabla(tabla, registro_id):
+    def detener(self):
+        """Detener el hilo y volcar lo pendiente"""
+        self._detener.set()
+        self._pendiente.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self._intervalo * 2)
+        self.vaciar()
+
+
+# Un sink por proceso (el hilo no sobrevive a un fork)
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def obtener_sink():
+    """Devuelve el sink de auditoría del proceso actual"""
+    with _sinks_lock:
+        sink = _sinks.get(os.getpid())
+        if sink is None:
+            sink = _sinks[os.getpid()] = SinkAuditoria(
+                AUDITORIA_CONFIG['spool'],
+                max_eventos=AUDITORIA_CONFIG['max_eventos'],
+                intervalo=AUDITORIA_CONFIG['intervalo'],
+                fsync=AUDITORIA_CONFIG['fsync']
+            )
+        return sink
+
+
+def vaciar_auditoria():
+    """Volcar los eventos diferidos del proceso (antes de consultar la auditoría)"""
+    with _sinks_lock:
+        sink = _sinks.get(os.getpid())
+    return sink.vaciar() if sink is not None else 0
+
+
+def cerrar_sink():
+    with _sinks_lock:
+        sink = _sinks.pop(os.getpid(), None)
+    if sink is not None:
+        sink.detener()
+
+
+atexit.register(cerrar_sink)
+
+
+class AuditoriaLecturas:
     """
-    Consultar historial completo de accesos a cualquier tabla
+    Auditoría de lecturas de datos desencriptados (acción 'READ') fuera
+    del camino de la consulta.
+    
+    registrar() solo deja el evento en una cola acotada. Un hilo agrupa
+    las lecturas por (usuario, tabla, registro, ventana de tiempo) y al
+    cerrarse la ventana entrega una fila por grupo al sink (spool + COPY):
+    las lecturas repetidas dentro de la ventana solo suman al contador.
+    
+    Contrapresión: si el sink acumula más de max_pendientes eventos sin
+    volcar, el hilo espera, la cola se llena y registrar() bloquea al
+    lector hasta `espera` segundos. Pasado ese tiempo el evento va directo
+    al sink sin agrupar: una lectura no se pierde por saturación.
     """
-    from database import Database
-    db = Database()
-    conn = db.get_connection()
     
+    def __init__(self, sink, ventana=60.0, max_cola=10000, espera=5.0, max_pendientes=50000):
+        self._sink = sink
+        self._ventana = ventana
+        self._espera = espera
+        self._max_pendientes = max_pendientes
+        self._cola = queue.Queue(maxsize=max_cola)
+        self._lock = threading.Lock()
+        # (usuario, tabla, registro_id, ventana) -> [primera fecha, lecturas, ip, detalles]
+        self._grupos = {}
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, name='auditoria-lecturas', daemon=True)
+        self._hilo.start()
+    
+    def registrar(self, tabla, registro_ids, usuario, detalles=None, ip_address=None):
+        """Encolar la lectura de uno o varios registros (no escribe en la base)"""
+        evento = (tabla, tuple(registro_ids), usuario, datetime.now(), ip_address, detalles)
+        try:
+            self._cola.put(evento, timeout=self._espera)
+        except queue.Full:
+            self._sink.encolar([
+                (tabla, registro_id, 'READ', usuario, evento[3], ip_address, detalles)
+                for registro_id in evento[1]
+            ])
+    
+    def _agrupar(self, evento):
+        tabla, registro_ids, usuario, fecha, ip_address, detalles = evento
+        ventana = int(fecha.timestamp() // self._ventana)
+        with self._lock:
+            for registro_id in registro_ids:
+                grupo = self._grupos.get((usuario, tabla, registro_id, ventana))
+                if grupo is None:
+                    self._grupos[(usuario, tabla, registro_id, ventana)] = [fecha, 1, ip_address, detalles]
+                else:
+                    grupo[1] += 1
+    
+    def _drenar(self):
+        while True:
+            try:
+                self._agrupar(self._cola.get_nowait())
+            except queue.Empty:
+                return
+    
+    def vaciar(self, todas=True):
+        """
+        Entregar al sink los grupos de ventanas cerradas, o todos (incluida
+        la cola) con todas=True; retorna cuántas filas se generaron
+        """
+        if todas:
+            self._drenar()
+        actual = int(time.time() // self._ventana)
+        with self._lock:
+            cerrados = [clave for clave in self._grupos if todas or clave[3] < actual]
+            grupos = [(clave, self._grupos.pop(clave)) for clave in cerrados]
+        if not grupos:
+            return 0
+        
+        self._sink.encolar([
+            (tabla, registro_id, 'READ', usuario, fecha, ip_address,
+             f"{detalles or 'Lectura'} ({lecturas} lecturas)" if lecturas > 1 else detalles)
+            for (usuario, tabla, registro_id, _), (fecha, lecturas, ip_address, detalles) in grupos
+        ])
+        return len(grupos)
+    
+    def _bucle(self):
+        intervalo = min(1.0, self._ventana)
+        while not self._detener.is_set():
+            # Si el volcado a la base se atrasa, dejar de consumir la cola
+            if self._sink.pendientes() > self._max_pendientes:
+                self._detener.wait(0.1)
+                continue
+            try:
+                self._agrupar(self._cola.get(timeout=intervalo))
+            except queue.Empty:
+                pass
+            self._drenar()
+            self.vaciar(todas=False)
+    
+    def detener(self):
+        """Detener el hilo y entregar al sink todas las lecturas pendientes"""
+        self._detener.set()
+        self._hilo.join(timeout=2.0)
+        self.vaciar()
+
+
+_lecturas = {}
+
+
+def obtener_auditoria_lecturas():
+    """Devuelve la auditoría de lecturas del proceso actual"""
+    with _sinks_lock:
+        lecturas = _lecturas.get(os.getpid())
+    if lecturas is None:
+        sink = obtener_sink()
+        with _sinks_lock:
+            lecturas = _lecturas.get(os.getpid())
+            if lecturas is None:
+                lecturas = _lecturas[os.getpid()] = AuditoriaLecturas(
+                    sink,
+                    ventana=AUDITORIA_CONFIG['ventana_lecturas'],
+                    max_cola=AUDITORIA_CONFIG['max_cola_lecturas'],
+                    espera=AUDITORIA_CONFIG['espera_lecturas'],
+                    max_pendientes=AUDITORIA_CONFIG['max_pendientes']
+                )
+    return lecturas
+
+
+def registrar_lectura(tabla, registro_ids, usuario, detalles=None, ip_address=None):
+    """
+    REQUISITO 4: Auditar la lectura de datos desencriptados de forma
+    asíncrona. registro_ids: un ID o una lista de IDs.
+    """
+    if not AUDITORIA_CONFIG['lecturas']:
+        return
+    if isinstance(registro_ids, int):
+        registro_ids = (registro_ids,)
+    if registro_ids:
+        obtener_auditoria_lecturas().registrar(
+            tabla, registro_ids, usuario or 'desconocido', detalles, ip_address
+        )
+
+
+def vaciar_lecturas():
+    """Escribir ya las lecturas agrupadas, incluso las de la ventana en curso"""
+    with _sinks_lock:
+        lecturas = _lecturas.get(os.getpid())
+    if lecturas is None:
+        return 0
+    return lecturas.vaciar()
+
+
+def cerrar_auditoria_lecturas():
+    with _sinks_lock:
+        lecturas = _lecturas.pop(os.getpid(), None)
+    if lecturas is not None:
+        lecturas.detener()
+
+
+# Se registra después de cerrar_sink: atexit lo ejecuta antes, mientras
+# el sink todavía puede volcar
+atexit.register(cerrar_auditoria_lecturas)
+
+
+def _filtros_auditoria(tabla=None, registro_id=None, usuario=None, accion=None,
+                       desde=None, hasta=None):
+    """
+    Condiciones WHERE y parámetros de una consulta de auditoría. Con un
+    rango de fechas el planificador solo lee las particiones mensuales que
+    lo intersectan.
+    """
+    condiciones, parametros = [], []
+    for columna, operador, valor in (
+        ('tabla', '=', tabla),
+        ('registro_id', '=', registro_id),
+        ('usuario', '=', usuario),
+        ('accion', '=', accion),
+        ('fecha', '>=', desde),
+        ('fecha', '<', hasta),
+    ):
+        if valor is not None:
+            condiciones.append(f"{columna} {operador} %s")
+            parametros.append(valor)
+    return condiciones, parametros
+
+
+def _sql_auditoria(condiciones, ascendente=False):
+    # ORDER BY coincide con los índices (..., fecha DESC, id DESC), que
+    # también se recorren hacia atrás: cada página es un recorrido del
+    # índice que se detiene en LIMIT
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    orden = 'ASC' if ascendente else 'DESC'
+    return f"""
+        SELECT id, fecha, tabla, registro_id, accion, usuario, detalles, ip_address
+        FROM auditoria_accesos
+        {where}
+        ORDER BY fecha {orden}, id {orden}
+    """
+
+
+def consultar_auditoria_pagina(limite=200, despues=None, **filtros):
+    """
+    Página de auditoría paginada por clave (fecha, id), de la más reciente
+    a la más antigua. Filtros: tabla, registro_id, usuario, accion, desde
+    (inclusive) y hasta (exclusive).
+    
+    Args:
+        limite: filas por página
+        despues: cursor devuelto por la página anterior (None = primera)
+    
+    Returns:
+        tuple: (filas, cursor de la página siguiente o None si no hay más)
+        Cada fila: (id, fecha, tabla, registro_id, accion, usuario, detalles, ip_address)
+    """
+    vaciar_auditoria()
+    condiciones, parametros = _filtros_auditoria(**filtros)
+    if despues is not None:
+        # A diferencia de OFFSET, el costo no crece con el número de página
+        condiciones.append("(fecha, id) < (%s, %s)")
+        parametros.extend(despues)
+
+    conn = db.get_connection()
     try:
         with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT fecha, accion, usuario, detalles, ip_address
-                FROM auditoria_accesos
-                WHERE tabla = %s AND registro_id = %s
-                ORDER BY fecha DESC
-            """, (tabla, registro_id))
-            
-            return cursor.fetchall()
+            # Una fila extra indica si existe otra página
+            cursor.execute(_sql_auditoria(condiciones) + " LIMIT %s",
+                           (*parametros, limite + 1))
+            filas = cursor.fetchall()
     finally:
-        db.release_connection(conn)
\ No newline at end of file
+        db.release_connection(conn)
+
+    if len(filas) > limite:
+        filas = filas[:limite]
+        return filas, (filas[-1][1], filas[-1][0])
+    return filas, None
+
+
+def iterar_auditoria(tamano_lote=2000, ascendente=False, **filtros):
+    """
+    Recorrer todo el historial que cumple los filtros con un cursor del
+    servidor: la memoria usada es la de un lote, no la del historial.
+    Mismos filtros y formato de fila que consultar_auditoria_pagina();
+    con ascendente=True, de la más antigua a la más reciente.
+    La conexión queda ocupada hasta agotar o cerrar el generador.
+    """
+    vaciar_auditoria()
+    condiciones, parametros = _filtros_auditoria(**filtros)
+    # Tuplas simples: las exportaciones recorren millones de filas
+    yield from db.iterar_consulta(_sql_auditoria(condiciones, ascendente), parametros,
+                                  itersize=tamano_lote, nombre='auditoria_historial',
+                                  con_nombres=False)
+
+
+def consultar_auditoria_resultado(resultado_id, desde=None, hasta=None):
+    """
+    Consultar historial completo de accesos a un resultado
+    (opcionalmente entre desde, inclusive, y hasta, exclusive)
+    """
+    return consultar_auditoria_tabla('resultados', resultado_id, desde, hasta)
+    
+def consultar_auditoria_tabla(tabla, registro_id, desde=None, hasta=None):
+    """
+    Consultar historial completo de accesos a cualquier tabla
+    (opcionalmente entre desde, inclusive, y hasta, exclusive).
+    Para historiales grandes usar consultar_auditoria_pagina() o
+    iterar_auditoria().
+    """
+    return [
+        (fecha, accion, usuario, detalles, ip_address)
+        for _, fecha, _, _, accion, usuario, detalles, ip_address in iterar_auditoria(
+            tabla=tabla, registro_id=registro_id, desde=desde, hasta=hasta
+        )
+    ]
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Caché en memoria LRU con expiración (TTL) y límite de memoria
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+
+def tamano_aproximado(valor):
+    """Bytes aproximados de un valor y de su contenido inmediato"""
+    tamano = sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        tamano += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in valor.items())
+    elif isinstance(valor, (list, tuple)):
+        tamano += sum(sys.getsizeof(v) for v in valor)
+    return tamano
+
+
+class CacheLRU:
+    """
+    Caché thread-safe con política LRU, TTL por entrada y tope de memoria.
+    
+    Con copiar (por ejemplo dict) obtener() devuelve copiar(valor) hecha
+    con el lock tomado: quien llama nunca comparte el objeto guardado.
+    """
+    
+    def __init__(self, max_entradas=1000, ttl=None, max_bytes=None, copiar=None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.copiar = copiar
+        
+        self._lock = threading.Lock()
+        self._datos = OrderedDict()   # clave -> (valor, expira, tamano)
+        self._bytes = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.expulsiones = 0
+    
+    def _quitar(self, clave):
+        """Eliminar una entrada (llamar con el lock tomado)"""
+        _, _, tamano = self._datos.pop(clave)
+        self._bytes -= tamano
+    
+    def obtener(self, clave, defecto=None):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return defecto
+            
+            valor, expira, _ = entrada
+            if expira is not None and time.monotonic() >= expira:
+                self._quitar(clave)
+                self.misses += 1
+                return defecto
+            
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return self.copiar(valor) if self.copiar else valor
+    
+    def guardar(self, clave, valor, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expira = time.monotonic() + ttl if ttl is not None else None
+        tamano = tamano_aproximado(valor)
+        
+        with self._lock:
+            if clave in self._datos:
+                self._quitar(clave)
+            
+            self._datos[clave] = (valor, expira, tamano)
+            self._bytes += tamano
+            
+            # Expulsar las menos usadas hasta respetar los límites
+            while self._datos and (
+                len(self._datos) > self.max_entradas or
+                (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._quitar(next(iter(self._datos)))
+                self.expulsiones += 1
+    
+    def invalidar(self, clave):
+        with self._lock:
+            if clave in self._datos:
+                self._quitar(clave)
+    
+    def invalidar_si(self, predicado):
+        """Invalidar todas las entradas cuya clave cumpla el predicado"""
+        with self._lock:
+            for clave in [c for c in self._datos if predicado(c)]:
+                self._quitar(clave)
+    
+    def limpiar(self):
+        with self._lock:
+            for clave in list(self._datos):
+                self._quitar(clave)
+    
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'entradas': len(self._datos),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expulsiones': self.expulsiones,
+                'tasa_aciertos': self.hits / consultas if consultas else 0.0
+            }
\ No newline at end of file
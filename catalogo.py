@@ -0,0 +1,114 @@
+"""
+Catálogo de tipos de análisis en memoria, compartido por el proceso.
+
+Los rangos normales, unidades y nombres casi nunca cambian: se cargan una
+vez y se invalidan con LISTEN/NOTIFY cuando otro proceso (o este) confirma
+un cambio. El TTL es una red de seguridad si la escucha no está disponible.
+"""
+
+import time
+import threading
+from database import Database
+from config import CATALOGO_CONFIG
+from notificaciones import obtener_escucha, notificar
+
+db = Database()
+
+CANAL_TIPOS_ANALISIS = 'tipos_analisis_cambios'
+
+
+class CatalogoAnalisis:
+    """Caché thread-safe de tipos_analisis indexada por ID"""
+
+    def __init__(self, ttl=None, escuchar=True):
+        self._ttl = ttl
+        self._escuchar = escuchar
+        self._lock = threading.Lock()
+        self._tipos = None
+        self._ordenados = None
+        self._cargado = 0
+        # Se incrementa en cada invalidación: una carga que empezó antes
+        # de invalidar no debe guardar datos posiblemente viejos
+        self._generacion = 0
+        self._suscrito = False
+
+    def _asegurar_escucha(self):
+        if not self._escuchar or self._suscrito:
+            return
+        with self._lock:
+            if self._suscrito:
+                return
+            self._suscrito = True
+        obtener_escucha().suscribir(CANAL_TIPOS_ANALISIS, self._al_notificar)
+
+    def _al_notificar(self, payload):
+        self.invalidar()
+
+    def invalidar(self):
+        """Descartar el catálogo; se recarga en el próximo acceso"""
+        with self._lock:
+            self._generacion += 1
+            self._tipos = None
+            self._ordenados = None
+
+    def _cargar(self):
+        conn = db.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, codigo, nombre, valor_min, valor_max, unidad
+                    FROM tipos_analisis
+                    ORDER BY nombre
+                """)
+                return cursor.fetchall()
+        finally:
+            db.release_connection(conn)
+
+    def _vigente(self, forzar=False):
+        """Devuelve (dict por ID, lista ordenada por nombre)"""
+        self._asegurar_escucha()
+        with self._lock:
+            expirado = self._ttl is not None and time.monotonic() - self._cargado > self._ttl
+            if self._tipos is not None and not expirado and not forzar:
+                return self._tipos, self._ordenados
+            generacion = self._generacion
+
+        filas = self._cargar()
+        tipos = {fila[0]: fila for fila in filas}
+
+        with self._lock:
+            if generacion == self._generacion:
+                self._tipos, self._ordenados = tipos, filas
+                self._cargado = time.monotonic()
+        return tipos, filas
+
+    def listar(self):
+        """Tuplas (id, codigo, nombre, valor_min, valor_max, unidad) ordenadas por nombre"""
+        return list(self._vigente()[1])
+
+    def obtener(self, tipo_id):
+        """Tupla del tipo de análisis o None si no existe"""
+        tipos = self._vigente()[0]
+        if tipo_id not in tipos:
+            # Puede ser un tipo recién creado cuyo aviso aún no llegó
+            tipos = self._vigente(forzar=True)[0]
+        return tipos.get(tipo_id)
+
+    def fuera_de_rango(self, tipo_id, valor):
+        """REQUISITO 5: Validar el valor contra el rango normal del tipo"""
+        tipo = self.obtener(tipo_id)
+        if tipo is None:
+            raise ValueError(f"Tipo de análisis {tipo_id} no encontrado")
+
+        _, _, _, valor_min, valor_max, _ = tipo
+        if valor_min is not None and valor_max is not None:
+            return valor < valor_min or valor > valor_max
+        return False
+
+
+def notificar_cambio_catalogo(cursor, tipo_id):
+    """Avisar a todos los procesos al confirmar la transacción del cursor"""
+    notificar(cursor, CANAL_TIPOS_ANALISIS, tipo_id)
+
+
+catalogo_analisis = CatalogoAnalisis(**CATALOGO_CONFIG)
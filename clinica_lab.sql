@@ -11,6 +11,7 @@ CREATE TABLE pacientes (
     id SERIAL PRIMARY KEY,
     nombre_enc BYTEA NOT NULL,
     dni_enc BYTEA UNIQUE NOT NULL,
+    dni_hash BYTEA,                 -- Índice ciego HMAC-SHA256 del DNI
     fecha_nacimiento DATE,
     telefono_enc BYTEA,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -21,6 +22,23 @@ CREATE TABLE pacientes (
 
 -- Índices
 CREATE INDEX idx_pacientes_created ON pacientes(created_at DESC);
+-- Búsqueda exacta por DNI y detección real de duplicados
+CREATE UNIQUE INDEX idx_pacientes_dni_hash ON pacientes(dni_hash);
+
+
+-- ============================================
+-- TABLA: TOKENS DE BÚSQUEDA POR NOMBRE
+-- ============================================
+-- HMAC truncado de cada trigrama normalizado del nombre del paciente.
+-- Permite búsquedas parciales sin desencriptar toda la tabla.
+CREATE TABLE pacientes_nombre_tokens (
+    paciente_id INTEGER NOT NULL REFERENCES pacientes(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    token_hash BYTEA NOT NULL,
+    PRIMARY KEY (token_hash, paciente_id)
+);
+
+CREATE INDEX idx_nombre_tokens_paciente ON pacientes_nombre_tokens(paciente_id);
 
 
 -- ============================================
@@ -83,40 +101,242 @@ CREATE INDEX idx_resultados_tipo ON resultados(tipo_analisis_id);
 CREATE INDEX idx_resultados_fecha ON resultados(fecha_resultado DESC);
 
 
+-- ============================================
+-- TABLA: ESTADÍSTICAS DIARIAS (ROLLUP)
+-- ============================================
+-- Agregados por día y tipo de análisis de los resultados con valor. Los
+-- mantienen los triggers de resultados en la misma transacción; las
+-- estadísticas por período suman días completos desde aquí y solo leen
+-- resultados de los días parciales de los extremos.
+CREATE TABLE estadisticas_diarias (
+    dia DATE NOT NULL,
+    tipo_analisis_id INTEGER NOT NULL REFERENCES tipos_analisis(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    cantidad BIGINT NOT NULL DEFAULT 0,
+    suma NUMERIC NOT NULL DEFAULT 0,
+    suma_cuadrados NUMERIC NOT NULL DEFAULT 0,
+    minimo NUMERIC(10,2),
+    maximo NUMERIC(10,2),
+    fuera_rango BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (dia, tipo_analisis_id)
+);
+
+
+-- ============================================
+-- TABLA: SKETCHES DIARIOS DE CUANTILES
+-- ============================================
+-- Distribución de valores por día y tipo de análisis en cubetas
+-- logarítmicas (ver sketches.py). Binario: cabecera de 3 bytes (versión,
+-- alfa en diezmilésimos) y un registro de 6 bytes por cubeta no vacía
+-- (índice int16, cantidad int32, big-endian) ordenado por índice.
+CREATE TABLE sketches_diarios (
+    dia DATE NOT NULL,
+    tipo_analisis_id INTEGER NOT NULL REFERENCES tipos_analisis(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    sketch BYTEA NOT NULL,
+
+    PRIMARY KEY (dia, tipo_analisis_id)
+);
+
+
 -- ============================================
 -- TABLA DE AUDITORÍA
 -- ============================================
+-- Particionada por mes sobre fecha: cada mes es una tabla con sus propios
+-- índices, las consultas con rango de fechas solo leen los meses
+-- necesarios y la retención separa meses completos (mantenimiento_auditoria.py)
 CREATE TABLE auditoria_accesos (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     tabla VARCHAR(50) NOT NULL,
     registro_id INTEGER NOT NULL,
     accion VARCHAR(20) NOT NULL,
     usuario VARCHAR(50) NOT NULL,
-    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     ip_address VARCHAR(45),
-    detalles TEXT
+    detalles TEXT,
+
+    PRIMARY KEY (id, fecha)
+) PARTITION BY RANGE (fecha);
+
+-- Índices compuestos terminados en (fecha DESC, id DESC): cada filtro se
+-- resuelve en el orden de la paginación por clave, sin ordenar en memoria
+CREATE INDEX idx_auditoria_fecha ON auditoria_accesos(fecha DESC, id DESC);
+CREATE INDEX idx_auditoria_usuario ON auditoria_accesos(usuario, fecha DESC, id DESC);
+CREATE INDEX idx_auditoria_tabla ON auditoria_accesos(tabla, registro_id, fecha DESC, id DESC);
+CREATE INDEX idx_auditoria_accion ON auditoria_accesos(tabla, accion, fecha DESC, id DESC);
+
+-- Red de seguridad para fechas sin partición (meses aún no creados)
+CREATE TABLE auditoria_accesos_default PARTITION OF auditoria_accesos DEFAULT;
+
+-- Crea (si falta) la partición mensual que contiene p_mes. Las filas de
+-- ese mes que hubieran caído en la partición por defecto se mueven a ella.
+CREATE OR REPLACE FUNCTION crear_particion_auditoria(p_mes DATE)
+RETURNS TEXT AS $$
+DECLARE
+    v_inicio DATE := date_trunc('month', p_mes)::date;
+    v_fin DATE := (date_trunc('month', p_mes) + INTERVAL '1 month')::date;
+    v_nombre TEXT := 'auditoria_accesos_' || to_char(date_trunc('month', p_mes), 'YYYY_MM');
+BEGIN
+    IF to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN v_nombre;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE auditoria_accesos INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        v_nombre
+    );
+    -- El CHECK evita que ATTACH recorra la tabla para validar el rango
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I CHECK (fecha >= %L AND fecha < %L)',
+        v_nombre, v_nombre || '_rango', v_inicio, v_fin
+    );
+    EXECUTE format(
+        'WITH movidas AS (
+             DELETE FROM auditoria_accesos_default
+             WHERE fecha >= %L AND fecha < %L
+             RETURNING *
+         )
+         INSERT INTO %I SELECT * FROM movidas',
+        v_inicio, v_fin, v_nombre
+    );
+    EXECUTE format(
+        'ALTER TABLE auditoria_accesos ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_nombre, v_inicio, v_fin
+    );
+    RETURN v_nombre;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Particiones de todos los meses entre p_desde y p_hasta (inclusive)
+CREATE OR REPLACE FUNCTION crear_particiones_auditoria(p_desde DATE, p_hasta DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    v_mes DATE := date_trunc('month', p_desde)::date;
+    v_creadas INTEGER := 0;
+BEGIN
+    WHILE v_mes <= p_hasta LOOP
+        IF to_regclass('auditoria_accesos_' || to_char(v_mes, 'YYYY_MM')) IS NULL THEN
+            PERFORM crear_particion_auditoria(v_mes);
+            v_creadas := v_creadas + 1;
+        END IF;
+        v_mes := (v_mes + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN v_creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Mes actual y los tres siguientes
+SELECT crear_particiones_auditoria(CURRENT_DATE, (CURRENT_DATE + INTERVAL '3 months')::date);
+
+
+-- ============================================
+-- PROGRESO DE ROTACIÓN DE CLAVES
+-- ============================================
+-- Checkpoint de la re-encriptación por lotes (permite reanudarla)
+CREATE TABLE rotacion_claves_progreso (
+    trabajo VARCHAR(64) PRIMARY KEY,
+    ultimo_id INTEGER NOT NULL DEFAULT 0,
+    filas_rotadas INTEGER NOT NULL DEFAULT 0,
+    completado BOOLEAN NOT NULL DEFAULT FALSE,
+    iniciado TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+
+-- ============================================
+-- SOLICITUDES IDEMPOTENTES
+-- ============================================
+-- Respuesta de cada solicitud con clave del cliente: un reintento
+-- devuelve los IDs originales en lugar de duplicar órdenes o resultados
+CREATE TABLE solicitudes_idempotentes (
+    clave VARCHAR(100) PRIMARY KEY,
+    operacion VARCHAR(50) NOT NULL,
+    huella BYTEA NOT NULL,
+    respuesta JSONB,
+    creada TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expira TIMESTAMP NOT NULL
 );
 
-CREATE INDEX idx_auditoria_fecha ON auditoria_accesos(fecha DESC);
-CREATE INDEX idx_auditoria_usuario ON auditoria_accesos(usuario);
-CREATE INDEX idx_auditoria_tabla ON auditoria_accesos(tabla, registro_id);
+CREATE INDEX idx_solicitudes_expira ON solicitudes_idempotentes(expira);
 
 
 -- ============================================
 -- FUNCION DE AUDITORIA   
 -- ============================================
+-- Usuario, IP, acción y detalles llegan de la aplicación como ajustes
+-- locales a la transacción (ver auditoria.establecer_contexto_auditoria)
 CREATE OR REPLACE FUNCTION registrar_auditoria()
 RETURNS TRIGGER AS $$
+DECLARE
+    v_id INTEGER;
 BEGIN
-    INSERT INTO auditoria_accesos(tabla, registro_id, accion, usuario, detalles)
+    -- Con la estrategia 'aplicacion' la auditoría la escribe la aplicación
+    IF current_setting('clinica.estrategia', true) = 'aplicacion' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        v_id := OLD.id;
+    ELSE
+        v_id := NEW.id;
+    END IF;
+
+    INSERT INTO auditoria_accesos(tabla, registro_id, accion, usuario, detalles, ip_address)
     VALUES (
         TG_TABLE_NAME,
-        COALESCE(NEW.id, OLD.id),
-        TG_OP,
-        CURRENT_USER,
-        'Cambio automático por trigger'
+        v_id,
+        COALESCE(NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_accion', true), ''), TG_OP),
+        COALESCE(NULLIF(current_setting('clinica.usuario', true), ''), CURRENT_USER),
+        COALESCE(
+            NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles_por_id', true), '')::jsonb ->> v_id::text,
+            NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles', true), ''),
+            'Cambio automático por trigger'
+        ),
+        NULLIF(current_setting('clinica.ip', true), '')
     );
-    RETURN NEW;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Versión por sentencia (la que usan los triggers): todas las filas de
+-- un INSERT/UPDATE/DELETE se auditan en un solo INSERT ... SELECT sobre
+-- las tablas de transición. La función por fila se conserva como referencia.
+CREATE OR REPLACE FUNCTION registrar_auditoria_sentencia()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_accion TEXT;
+    v_usuario TEXT;
+    v_ip TEXT;
+    v_detalles TEXT;
+    v_detalles_por_id JSONB;
+BEGIN
+    -- Con la estrategia 'aplicacion' la auditoría la escribe la aplicación
+    IF current_setting('clinica.estrategia', true) = 'aplicacion' THEN
+        RETURN NULL;
+    END IF;
+
+    -- El contexto de la aplicación se lee una vez por sentencia
+    v_accion := COALESCE(NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_accion', true), ''), TG_OP);
+    v_usuario := COALESCE(NULLIF(current_setting('clinica.usuario', true), ''), CURRENT_USER);
+    v_ip := NULLIF(current_setting('clinica.ip', true), '');
+    v_detalles := COALESCE(NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles', true), ''),
+                           'Cambio automático por trigger');
+    v_detalles_por_id := NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles_por_id', true), '')::jsonb;
+
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO auditoria_accesos(tabla, registro_id, accion, usuario, detalles, ip_address)
+        SELECT TG_TABLE_NAME, f.id, v_accion, v_usuario,
+               COALESCE(v_detalles_por_id ->> f.id::text, v_detalles), v_ip
+        FROM filas_viejas f;
+    ELSE
+        INSERT INTO auditoria_accesos(tabla, registro_id, accion, usuario, detalles, ip_address)
+        SELECT TG_TABLE_NAME, f.id, v_accion, v_usuario,
+               COALESCE(v_detalles_por_id ->> f.id::text, v_detalles), v_ip
+        FROM filas_nuevas f;
+    END IF;
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -125,17 +345,297 @@ $$ LANGUAGE plpgsql;
 -- TRIGGERS (opcionales pero recomendados)
 -- ============================================
 
-CREATE TRIGGER trg_auditar_pacientes
-AFTER INSERT OR UPDATE OR DELETE ON pacientes
-FOR EACH ROW EXECUTE FUNCTION registrar_auditoria();
+-- Las tablas de transición exigen un trigger por evento
+CREATE TRIGGER trg_auditar_pacientes_insert
+AFTER INSERT ON pacientes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_pacientes_update
+AFTER UPDATE ON pacientes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_pacientes_delete
+AFTER DELETE ON pacientes REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_ordenes_insert
+AFTER INSERT ON ordenes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_ordenes_update
+AFTER UPDATE ON ordenes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_ordenes_delete
+AFTER DELETE ON ordenes REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_resultados_insert
+AFTER INSERT ON resultados REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_resultados_update
+AFTER UPDATE ON resultados REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_resultados_delete
+AFTER DELETE ON resultados REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+
+-- ============================================
+-- MANTENIMIENTO DE ESTADÍSTICAS DIARIAS
+-- ============================================
+-- Un cambio en resultados: +1 por cada fila que entra en un (día, tipo)
+-- y -1 por cada fila que sale
+CREATE TYPE cambio_estadistica AS (
+    dia DATE,
+    tipo_analisis_id INTEGER,
+    valor NUMERIC,
+    fuera_rango BOOLEAN,
+    signo INTEGER
+);
+
+-- Cubeta de un valor con error relativo alfa = 0.01, gamma = 1.01 / 0.99.
+-- Positivos: ceil(log_gamma(v)); cero: -32768; negativos: -16384 - ceil(log_gamma(|v|)).
+-- Con NUMERIC(10,2) los índices van de -232 a 931 (sin solaparse entre signos).
+-- indice_sketch y sketch_cubetas no son STRICT para que el planificador
+-- pueda expandirlas dentro de la consulta (NULL da NULL / ninguna cubeta).
+CREATE OR REPLACE FUNCTION indice_sketch(p_valor NUMERIC)
+RETURNS SMALLINT AS $$
+    SELECT CASE
+        WHEN p_valor = 0 THEN -32768
+        WHEN p_valor > 0 THEN ceil(ln(p_valor::float8) / ln(1.01::float8 / 0.99))
+        ELSE -16384 - ceil(ln(-p_valor::float8) / ln(1.01::float8 / 0.99))
+    END::smallint
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION sketch_codificar(p_indices SMALLINT[], p_cantidades INTEGER[])
+RETURNS BYTEA AS $$
+    SELECT '\x010064'::bytea
+        || COALESCE(string_agg(int2send(i) || int4send(c), ''::bytea ORDER BY i), ''::bytea)
+    FROM unnest(p_indices, p_cantidades) AS t(i, c)
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION sketch_cubetas(p_sketch BYTEA)
+RETURNS TABLE(indice SMALLINT, cantidad INTEGER) AS $$
+    SELECT
+        (CASE WHEN x >= 32768 THEN x - 65536 ELSE x END)::smallint,
+        (get_byte(p_sketch, o + 2) << 24) | (get_byte(p_sketch, o + 3) << 16)
+            | (get_byte(p_sketch, o + 4) << 8) | get_byte(p_sketch, o + 5)
+    FROM generate_series(3, length(p_sketch) - 6, 6) AS o
+    CROSS JOIN LATERAL (SELECT (get_byte(p_sketch, o) << 8) | get_byte(p_sketch, o + 1) AS x) b
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION aplicar_cambios_estadisticas(p_cambios cambio_estadistica[])
+RETURNS VOID AS $$
+DECLARE
+    v_clave RECORD;
+BEGIN
+    IF cardinality(p_cambios) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Un cerrojo por (día, tipo), siempre en el mismo orden para no caer
+    -- en deadlocks. Con READ COMMITTED cada sentencia siguiente toma una
+    -- foto nueva: el recálculo de mínimos y máximos ve lo que confirmó
+    -- la transacción que tenía el cerrojo.
+    FOR v_clave IN
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        ORDER BY 1, 2
+    LOOP
+        PERFORM pg_advisory_xact_lock(v_clave.tipo_analisis_id, v_clave.dia - DATE '2000-01-01');
+    END LOOP;
+
+    INSERT INTO estadisticas_diarias AS e
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        c.dia,
+        c.tipo_analisis_id,
+        SUM(c.signo),
+        SUM(c.signo * c.valor),
+        SUM(c.signo * c.valor * c.valor),
+        MIN(c.valor) FILTER (WHERE c.signo > 0),
+        MAX(c.valor) FILTER (WHERE c.signo > 0),
+        COALESCE(SUM(c.signo) FILTER (WHERE c.fuera_rango), 0)
+    FROM unnest(p_cambios) c
+    GROUP BY c.dia, c.tipo_analisis_id
+    ORDER BY c.dia, c.tipo_analisis_id
+    ON CONFLICT (dia, tipo_analisis_id) DO UPDATE
+    SET cantidad = e.cantidad + EXCLUDED.cantidad,
+        suma = e.suma + EXCLUDED.suma,
+        suma_cuadrados = e.suma_cuadrados + EXCLUDED.suma_cuadrados,
+        minimo = LEAST(e.minimo, EXCLUDED.minimo),
+        maximo = GREATEST(e.maximo, EXCLUDED.maximo),
+        fuera_rango = e.fuera_rango + EXCLUDED.fuera_rango;
+
+    -- Si salieron filas, el mínimo o el máximo pueden haber cambiado:
+    -- se recalculan desde los resultados de ese día
+    UPDATE estadisticas_diarias e
+    SET minimo = r.minimo,
+        maximo = r.maximo
+    FROM (
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        WHERE c.signo < 0
+    ) k
+    CROSS JOIN LATERAL (
+        SELECT MIN(valor) AS minimo, MAX(valor) AS maximo
+        FROM resultados
+        WHERE tipo_analisis_id = k.tipo_analisis_id
+          AND fecha_resultado >= k.dia
+          AND fecha_resultado < k.dia + 1
+          AND valor IS NOT NULL
+    ) r
+    WHERE e.dia = k.dia AND e.tipo_analisis_id = k.tipo_analisis_id;
+
+    DELETE FROM estadisticas_diarias
+    WHERE cantidad = 0
+      AND (dia, tipo_analisis_id) IN (
+          SELECT c.dia, c.tipo_analisis_id FROM unnest(p_cambios) c WHERE c.signo < 0
+      );
+
+    -- Sketch de cuantiles: cubetas guardadas más los cambios
+    WITH cambios AS (
+        SELECT c.dia, c.tipo_analisis_id, indice_sketch(c.valor) AS indice, SUM(c.signo) AS cantidad
+        FROM unnest(p_cambios) c
+        GROUP BY 1, 2, 3
+    ),
+    cubetas AS (
+        SELECT s.dia, s.tipo_analisis_id, b.indice, b.cantidad::bigint AS cantidad
+        FROM sketches_diarios s
+        JOIN (SELECT DISTINCT dia, tipo_analisis_id FROM cambios) k
+            ON k.dia = s.dia AND k.tipo_analisis_id = s.tipo_analisis_id
+        CROSS JOIN LATERAL sketch_cubetas(s.sketch) b
+        UNION ALL
+        SELECT dia, tipo_analisis_id, indice, cantidad FROM cambios
+    ),
+    nuevas AS (
+        SELECT dia, tipo_analisis_id, indice, SUM(cantidad)::int AS cantidad
+        FROM cubetas
+        GROUP BY 1, 2, 3
+        HAVING SUM(cantidad) <> 0
+    )
+    INSERT INTO sketches_diarios (dia, tipo_analisis_id, sketch)
+    SELECT dia, tipo_analisis_id,
+           sketch_codificar(array_agg(indice ORDER BY indice), array_agg(cantidad ORDER BY indice))
+    FROM nuevas
+    GROUP BY dia, tipo_analisis_id
+    ORDER BY dia, tipo_analisis_id
+    ON CONFLICT (dia, tipo_analisis_id) DO UPDATE
+    SET sketch = EXCLUDED.sketch;
+
+    DELETE FROM sketches_diarios s
+    WHERE (s.dia, s.tipo_analisis_id) IN (
+          SELECT c.dia, c.tipo_analisis_id FROM unnest(p_cambios) c WHERE c.signo < 0
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM estadisticas_diarias e
+          WHERE e.dia = s.dia AND e.tipo_analisis_id = s.tipo_analisis_id
+      );
+
+    -- Días afectados ('desde,hasta') para las cachés de estadísticas; se
+    -- entrega solo si la transacción confirma
+    PERFORM pg_notify('estadisticas_cambios', MIN(c.dia)::text || ',' || MAX(c.dia)::text)
+    FROM unnest(p_cambios) c;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION actualizar_estadisticas_diarias()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_cambios cambio_estadistica[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        v_cambios := ARRAY(
+            SELECT ROW(n.fecha_resultado::date, n.tipo_analisis_id, n.valor, n.fuera_rango, 1)::cambio_estadistica
+            FROM filas_nuevas n
+            WHERE n.valor IS NOT NULL AND n.fecha_resultado IS NOT NULL
+        );
+    ELSIF TG_OP = 'DELETE' THEN
+        v_cambios := ARRAY(
+            SELECT ROW(v.fecha_resultado::date, v.tipo_analisis_id, v.valor, v.fuera_rango, -1)::cambio_estadistica
+            FROM filas_viejas v
+            WHERE v.valor IS NOT NULL AND v.fecha_resultado IS NOT NULL
+        );
+    ELSE
+        -- Solo las filas que cambian algo de lo agregado (la carga de un
+        -- resultado pendiente entra como +1 sin fila que salga)
+        v_cambios := ARRAY(
+            SELECT c
+            FROM filas_viejas v
+            JOIN filas_nuevas n ON n.id = v.id
+            CROSS JOIN LATERAL (VALUES
+                (ROW(v.fecha_resultado::date, v.tipo_analisis_id, v.valor, v.fuera_rango, -1)::cambio_estadistica),
+                (ROW(n.fecha_resultado::date, n.tipo_analisis_id, n.valor, n.fuera_rango, 1)::cambio_estadistica)
+            ) AS x(c)
+            WHERE (v.fecha_resultado::date, v.tipo_analisis_id, v.valor, v.fuera_rango)
+                  IS DISTINCT FROM
+                  (n.fecha_resultado::date, n.tipo_analisis_id, n.valor, n.fuera_rango)
+              AND (c).valor IS NOT NULL AND (c).dia IS NOT NULL
+        );
+    END IF;
+
+    PERFORM aplicar_cambios_estadisticas(v_cambios);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruir el rollup y los sketches desde resultados (carga inicial o reparación)
+CREATE OR REPLACE FUNCTION recalcular_estadisticas_diarias()
+RETURNS BIGINT AS $$
+DECLARE
+    v_filas BIGINT;
+BEGIN
+    LOCK TABLE estadisticas_diarias, sketches_diarios IN EXCLUSIVE MODE;
+    DELETE FROM estadisticas_diarias;
+    INSERT INTO estadisticas_diarias
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        fecha_resultado::date,
+        tipo_analisis_id,
+        COUNT(*),
+        SUM(valor),
+        SUM(valor * valor),
+        MIN(valor),
+        MAX(valor),
+        COUNT(*) FILTER (WHERE fuera_rango)
+    FROM resultados
+    WHERE valor IS NOT NULL AND fecha_resultado IS NOT NULL
+    GROUP BY 1, 2;
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+
+    DELETE FROM sketches_diarios;
+    INSERT INTO sketches_diarios (dia, tipo_analisis_id, sketch)
+    SELECT dia, tipo_analisis_id,
+           sketch_codificar(array_agg(indice ORDER BY indice), array_agg(cantidad ORDER BY indice))
+    FROM (
+        SELECT fecha_resultado::date AS dia, tipo_analisis_id,
+               indice_sketch(valor) AS indice, COUNT(*)::int AS cantidad
+        FROM resultados
+        WHERE valor IS NOT NULL AND fecha_resultado IS NOT NULL
+        GROUP BY 1, 2, 3
+    ) c
+    GROUP BY dia, tipo_analisis_id;
+
+    -- Sin días: invalida todas las cachés de estadísticas
+    PERFORM pg_notify('estadisticas_cambios', '');
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_estadisticas_resultados_insert
+AFTER INSERT ON resultados REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_diarias();
 
-CREATE TRIGGER trg_auditar_ordenes
-AFTER INSERT OR UPDATE OR DELETE ON ordenes
-FOR EACH ROW EXECUTE FUNCTION registrar_auditoria();
+CREATE TRIGGER trg_estadisticas_resultados_update
+AFTER UPDATE ON resultados REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_diarias();
 
-CREATE TRIGGER trg_auditar_resultados
-AFTER INSERT OR UPDATE OR DELETE ON resultados
-FOR EACH ROW EXECUTE FUNCTION registrar_auditoria();
+CREATE TRIGGER trg_estadisticas_resultados_delete
+AFTER DELETE ON resultados REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_diarias();
 
 
 -- ============================================
@@ -12,6 +12,122 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5433')
 }
 
+# Pool de conexiones compartido por proceso (tiempos en segundos)
+POOL_CONFIG = {
+    'minconn': int(os.getenv('DB_POOL_MIN', '1')),
+    'maxconn': int(os.getenv('DB_POOL_MAX', '10')),
+    'max_vida': float(os.getenv('DB_POOL_MAX_VIDA', '1800')),
+    'max_ocio': float(os.getenv('DB_POOL_MAX_OCIO', '300')),
+    'pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', '30'))
+}
+
+# Lecturas largas con cursor del servidor (Database.iterar_consulta):
+# filas que se traen por cada viaje a la base
+CURSOR_SERVIDOR_CONFIG = {
+    'itersize': int(os.getenv('DB_ITERSIZE', '2000'))
+}
+
+# Encriptación por lotes en paralelo (pool de procesos)
+CRYPTO_CONFIG = {
+    'workers': int(os.getenv('CRYPTO_WORKERS', str(os.cpu_count() or 1))),
+    'tamano_bloque': int(os.getenv('CRYPTO_TAMANO_BLOQUE', '1000')),
+    # Por debajo de este tamaño el lote se procesa en el proceso actual
+    'minimo_paralelo': int(os.getenv('CRYPTO_MINIMO_PARALELO', '2000'))
+}
+
+# Caché de pacientes desencriptados (TTL en segundos)
+CACHE_PACIENTES_CONFIG = {
+    'max_entradas': int(os.getenv('CACHE_PACIENTES_MAX', '500')),
+    'ttl': float(os.getenv('CACHE_PACIENTES_TTL', '300')),
+    'max_bytes': int(os.getenv('CACHE_PACIENTES_MAX_BYTES', str(2 * 1024 * 1024)))
+}
+
+# Búsqueda de pacientes por nombre: pacientes que se desencriptan como
+# máximo por llamada (la página siguiente continúa desde ahí)
+BUSQUEDA_NOMBRE_CONFIG = {
+    'max_candidatos': int(os.getenv('BUSQUEDA_NOMBRE_MAX_CANDIDATOS', '1000'))
+}
+
+# Catálogo de tipos de análisis en memoria. Se invalida con LISTEN/NOTIFY;
+# el TTL (segundos) solo protege de avisos perdidos.
+CATALOGO_CONFIG = {
+    'ttl': float(os.getenv('CATALOGO_TTL', '600')),
+    'escuchar': os.getenv('CATALOGO_ESCUCHAR', '1') == '1'
+}
+
+# Ejecutor de transacciones: aislamiento por defecto y reintentos ante
+# fallos de serialización o deadlocks (esperas en segundos)
+TRANSACCIONES_CONFIG = {
+    'aislamiento': os.getenv('TRANSACCIONES_AISLAMIENTO', 'READ COMMITTED'),
+    'max_reintentos': int(os.getenv('TRANSACCIONES_MAX_REINTENTOS', '5')),
+    'espera_base': float(os.getenv('TRANSACCIONES_ESPERA_BASE', '0.05')),
+    'espera_maxima': float(os.getenv('TRANSACCIONES_ESPERA_MAXIMA', '2.0'))
+}
+
+# Caché de resultados de estadísticas por (período, tipo). Se invalida
+# por día con LISTEN/NOTIFY; los períodos cerrados (anteriores a hoy) no
+# expiran, el TTL (segundos) solo se aplica a los que incluyen hoy.
+ESTADISTICAS_CACHE_CONFIG = {
+    'max_entradas': int(os.getenv('ESTADISTICAS_CACHE_MAX', '256')),
+    'max_bytes': int(os.getenv('ESTADISTICAS_CACHE_MAX_BYTES', str(4 * 1024 * 1024))),
+    'ttl': float(os.getenv('ESTADISTICAS_CACHE_TTL', '300')),
+    'escuchar': os.getenv('ESTADISTICAS_CACHE_ESCUCHAR', '1') == '1'
+}
+
+# Claves de idempotencia: tiempo (segundos) durante el que un reintento
+# devuelve la respuesta original
+IDEMPOTENCIA_CONFIG = {
+    'ttl': float(os.getenv('IDEMPOTENCIA_TTL', str(24 * 3600))),
+    'lote_limpieza': int(os.getenv('IDEMPOTENCIA_LOTE_LIMPIEZA', '5000'))
+}
+
+# Auditoría. Estrategia para pacientes/ordenes/resultados: 'trigger' (una
+# fila por cambio escrita por el trigger con el usuario de la aplicación)
+# o 'aplicacion' (la escribe el código; el trigger no hace nada).
+# Modo para los eventos de la aplicación: 'diferido' vuelca por lotes con
+# COPY, 'sincrono' inserta dentro de cada transacción. Las acciones
+# estrictas (tabla:ACCION) siempre se auditan de forma síncrona.
+AUDITORIA_CONFIG = {
+    'estrategia': os.getenv('AUDITORIA_ESTRATEGIA', 'trigger'),
+    'modo': os.getenv('AUDITORIA_MODO', 'diferido'),
+    'spool': os.getenv('AUDITORIA_SPOOL', 'auditoria_spool'),
+    'max_eventos': int(os.getenv('AUDITORIA_MAX_EVENTOS', '500')),
+    'intervalo': float(os.getenv('AUDITORIA_INTERVALO', '1.0')),
+    'fsync': os.getenv('AUDITORIA_FSYNC', '1') == '1',
+    'acciones_estrictas': {
+        tuple(par.strip().split(':', 1))
+        for par in os.getenv('AUDITORIA_ACCIONES_ESTRICTAS', 'resultados:UPDATE,ordenes:CANCEL').split(',')
+        if ':' in par
+    },
+    # Particiones mensuales: meses creados por adelantado, meses que se
+    # conservan en la base y carpeta donde se archivan los separados
+    'meses_adelante': int(os.getenv('AUDITORIA_MESES_ADELANTE', '3')),
+    'retencion_meses': int(os.getenv('AUDITORIA_RETENCION_MESES', '24')),
+    'archivo': os.getenv('AUDITORIA_ARCHIVO', 'archivo_auditoria'),
+    # Lecturas de datos desencriptados: asíncronas, una fila por
+    # usuario/registro/ventana (segundos). La cola acotada bloquea a los
+    # lectores (hasta espera_lecturas segundos) si el volcado se atrasa
+    # más de max_pendientes eventos.
+    'lecturas': os.getenv('AUDITORIA_LECTURAS', '1') == '1',
+    'ventana_lecturas': float(os.getenv('AUDITORIA_VENTANA_LECTURAS', '60')),
+    'max_cola_lecturas': int(os.getenv('AUDITORIA_MAX_COLA_LECTURAS', '10000')),
+    'espera_lecturas': float(os.getenv('AUDITORIA_ESPERA_LECTURAS', '5.0')),
+    'max_pendientes': int(os.getenv('AUDITORIA_MAX_PENDIENTES', '50000'))
+}
+
+# Exportación de auditoría para entes reguladores (exportar_auditoria.py).
+# formato: 'jsonl' o 'csv'; compresion: 'gzip' o 'zstd' (requiere el
+# paquete zstandard); max_bytes: tamaño comprimido a partir del cual se
+# empieza un archivo nuevo
+EXPORTACION_AUDITORIA_CONFIG = {
+    'destino': os.getenv('EXPORTACION_AUDITORIA_DESTINO', 'exportaciones_auditoria'),
+    'formato': os.getenv('EXPORTACION_AUDITORIA_FORMATO', 'jsonl'),
+    'compresion': os.getenv('EXPORTACION_AUDITORIA_COMPRESION', 'gzip'),
+    'max_bytes': int(os.getenv('EXPORTACION_AUDITORIA_MAX_BYTES', str(256 * 1024 * 1024))),
+    'tamano_lote': int(os.getenv('EXPORTACION_AUDITORIA_TAMANO_LOTE', '5000'))
+}
+
 # REQUISITO 3: Clave para encriptación (guardar de forma segura)
 # IMPORTANTE: Esta clave debe ser persistente y guardada de forma segura
 _env_key = os.getenv('ENCRYPTION_KEY')
@@ -33,4 +149,50 @@ else:
         with open(key_file, 'wb') as f:
             f.write(ENCRYPTION_KEY)
         print(f"NUEVA CLAVE DE ENCRIPTACIÓN GENERADA Y GUARDADA EN '{key_file}'")
-        print("IMPORTANTE: Guarde este archivo de forma segura. Sin él, no podrá desencriptar los datos.")
\ No newline at end of file
+        print("IMPORTANTE: Guarde este archivo de forma segura. Sin él, no podrá desencriptar los datos.")
+
+# Rotación de claves: claves anteriores que solo se usan para desencriptar.
+# Para rotar, mover la clave actual a esta lista, configurar la nueva
+# ENCRYPTION_KEY y ejecutar `python rotacion_claves.py`.
+_env_keys_anteriores = os.getenv('ENCRYPTION_KEYS_ANTERIORES')
+old_keys_file = 'encryption.key.anteriores'
+
+if _env_keys_anteriores:
+    ENCRYPTION_KEYS_ANTERIORES = [k.strip().encode() for k in _env_keys_anteriores.split(',') if k.strip()]
+elif os.path.exists(old_keys_file):
+    # Una clave por línea
+    with open(old_keys_file, 'rb') as f:
+        ENCRYPTION_KEYS_ANTERIORES = [linea.strip() for linea in f if linea.strip()]
+else:
+    ENCRYPTION_KEYS_ANTERIORES = []
+
+# Formato de las escrituras nuevas: 'fernet' (legado) o 'aesgcm'
+# (binario versionado, más compacto). Las lecturas detectan el formato.
+FORMATO_CIFRADO = os.getenv('FORMATO_CIFRADO', 'fernet')
+
+# Re-encriptación en segundo plano (pausa en segundos entre lotes)
+ROTACION_CONFIG = {
+    'tamano_lote': int(os.getenv('ROTACION_TAMANO_LOTE', '500')),
+    'pausa': float(os.getenv('ROTACION_PAUSA', '0.2')),
+    'lock_timeout_ms': int(os.getenv('ROTACION_LOCK_TIMEOUT_MS', '2000'))
+}
+
+# Clave HMAC para índices ciegos (búsquedas sobre columnas encriptadas).
+# Es independiente de ENCRYPTION_KEY para que rotar esa clave no obligue
+# a recalcular los índices.
+_env_blind_key = os.getenv('BLIND_INDEX_KEY')
+
+if _env_blind_key:
+    BLIND_INDEX_KEY = _env_blind_key.encode()
+else:
+    blind_key_file = 'blind_index.key'
+    
+    if os.path.exists(blind_key_file):
+        with open(blind_key_file, 'rb') as f:
+            BLIND_INDEX_KEY = f.read()
+    else:
+        BLIND_INDEX_KEY = Fernet.generate_key()
+        with open(blind_key_file, 'wb') as f:
+            f.write(BLIND_INDEX_KEY)
+        print(f"NUEVA CLAVE DE ÍNDICE CIEGO GENERADA Y GUARDADA EN '{blind_key_file}'")
+        print("IMPORTANTE: Sin esta clave no podrán localizarse pacientes por DNI.")
\ No newline at end of file
@@ -1,15 +1,396 @@
+import os
+import hmac
+import base64
+import time
+import hashlib
+import atexit
+import threading
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import psycopg2
 from psycopg2 import pool
-from cryptography.fernet import Fernet
-from config import DB_CONFIG, ENCRYPTION_KEY
+from psycopg2 import extensions
+from psycopg2.extras import NamedTupleCursor
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from config import (DB_CONFIG, POOL_CONFIG, CURSOR_SERVIDOR_CONFIG, CRYPTO_CONFIG, ENCRYPTION_KEY,
+                    ENCRYPTION_KEYS_ANTERIORES, FORMATO_CIFRADO, BLIND_INDEX_KEY)
+
+
+class PoolCompartido:
+    """
+    Pool de conexiones thread-safe compartido por todo el proceso.
+
+    Mantiene la misma interfaz que psycopg2.pool (getconn/putconn/closeall)
+    y agrega: tiempo de vida máximo por conexión, cierre de conexiones
+    ociosas por encima del mínimo y validación (pre-ping) antes de entregar.
+    """
+
+    def __init__(self, minconn, maxconn, max_vida, max_ocio, pre_ping, timeout, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_vida = max_vida
+        self.max_ocio = max_ocio
+        self.pre_ping = pre_ping
+        self.timeout = timeout
+        self._kwargs = kwargs
+
+        self._cond = threading.Condition()
+        self._ociosas = []      # [(conn, ultimo_uso)], LIFO
+        self._creacion = {}     # id(conn) -> instante de creación
+        self._total = 0         # conexiones abiertas (ociosas + en uso)
+        self.closed = False
+
+        for _ in range(self.minconn):
+            conn = self._conectar()
+            self._total += 1
+            self._ociosas.append((conn, time.monotonic()))
+
+    def _conectar(self):
+        conn = psycopg2.connect(**self._kwargs)
+        with self._cond:
+            self._creacion[id(conn)] = time.monotonic()
+        return conn
+
+    def _expirada(self, conn, ahora):
+        """Superó max_vida (llamar con el lock tomado)"""
+        creada = self._creacion.get(id(conn), ahora)
+        return self.max_vida and ahora - creada > self.max_vida
+
+    def _cerrar(self, conn):
+        """Cerrar físicamente una conexión (llamar con el lock tomado)"""
+        self._creacion.pop(id(conn), None)
+        self._total -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._cond.notify()
+
+    def _reciclar_ociosas(self, ahora):
+        """Cerrar ociosas expiradas o que excedan el mínimo por mucho tiempo"""
+        conservar = []
+        for conn, ultimo_uso in self._ociosas:
+            sobra = self._total > self.minconn
+            if conn.closed or self._expirada(conn, ahora) or \
+                    (sobra and self.max_ocio and ahora - ultimo_uso > self.max_ocio):
+                self._cerrar(conn)
+            else:
+                conservar.append((conn, ultimo_uso))
+        self._ociosas = conservar
+
+    def _validar(self, conn):
+        """Pre-ping: confirmar que la conexión sigue viva antes de entregarla"""
+        if conn.closed:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, key=None):
+        limite = time.monotonic() + self.timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self.closed:
+                        raise pool.PoolError("El pool de conexiones está cerrado")
+
+                    ahora = time.monotonic()
+                    self._reciclar_ociosas(ahora)
+
+                    if self._ociosas:
+                        conn, _ = self._ociosas.pop()
+                        break
+
+                    if self._total < self.maxconn:
+                        # Reservar el lugar y conectar fuera del lock
+                        self._total += 1
+                        break
+
+                    restante = limite - ahora
+                    if restante <= 0:
+                        raise pool.PoolError(
+                            f"Pool agotado: {self.maxconn} conexiones en uso"
+                        )
+                    self._cond.wait(restante)
+
+            if conn is None:
+                try:
+                    return self._conectar()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._validar(conn):
+                return conn
+
+            # Conexión rota: descartarla e intentar con otra
+            with self._cond:
+                self._cerrar(conn)
+
+    def putconn(self, conn, key=None, close=False):
+        ahora = time.monotonic()
+        with self._cond:
+            if id(conn) not in self._creacion:
+                raise pool.PoolError("La conexión no pertenece a este pool")
+            descartar = close or self.closed or conn.closed or self._expirada(conn, ahora)
+
+        if not descartar:
+            try:
+                # Nunca devolver una conexión con una transacción abierta
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                descartar = True
+
+        with self._cond:
+            if descartar:
+                self._cerrar(conn)
+            else:
+                self._ociosas.append((conn, ahora))
+                self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self.closed = True
+            for conn, _ in self._ociosas:
+                self._cerrar(conn)
+            self._ociosas = []
+
+
+# Registro de pools por proceso: una sola instancia por configuración.
+# Se indexa por PID para que un proceso hijo (fork) nunca reutilice
+# los sockets heredados del padre.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def obtener_pool(config=None):
+    """
+    Devuelve el pool compartido para la configuración dada, creándolo
+    de forma perezosa la primera vez que se solicita
+    """
+    config = config or DB_CONFIG
+    clave = tuple(sorted(config.items()))
+    pools_proceso = _pools.get(os.getpid(), {})
+
+    pool_conexiones = pools_proceso.get(clave)
+    if pool_conexiones is None:
+        with _pools_lock:
+            pools_proceso = _pools.setdefault(os.getpid(), {})
+            pool_conexiones = pools_proceso.get(clave)
+            if pool_conexiones is None:
+                pool_conexiones = PoolCompartido(**POOL_CONFIG, **config)
+                pools_proceso[clave] = pool_conexiones
+    return pool_conexiones
+
+
+def cerrar_pools():
+    """Cerrar todos los pools del proceso actual"""
+    with _pools_lock:
+        for pool_conexiones in _pools.pop(os.getpid(), {}).values():
+            pool_conexiones.closeall()
+
+
+atexit.register(cerrar_pools)
+
+
+# ========== ENCRIPTACIÓN ==========
+
+# Formato binario versionado: versión (1 byte) + nonce (12) + cifrado + tag (16).
+# Un token Fernet siempre empieza con 'g' (0x80 en base64), nunca con 0x01.
+VERSION_AESGCM = 0x01
+TAMANO_NONCE = 12
+
+
+def _derivar_clave_aead(clave_fernet):
+    """Clave AES-256 derivada (HKDF) de la clave Fernet, sin reutilizarla tal cual"""
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None,
+        info=b'clinica_lab aes-256-gcm v1'
+    ).derive(base64.urlsafe_b64decode(clave_fernet))
+
+
+class Cifrador:
+    """
+    REQUISITO 3: Encriptación con rotación de claves y dos formatos:
+    Fernet (legado) y AES-256-GCM binario versionado.
+    
+    Encripta con la primera clave en el formato configurado y desencripta
+    con cualquiera de las claves, detectando el formato por el primer byte.
+    Mantiene la interfaz de Fernet (encrypt/decrypt/rotate).
+    """
+    
+    def __init__(self, claves, formato='fernet'):
+        if formato not in ('fernet', 'aesgcm'):
+            raise ValueError(f"Formato de cifrado desconocido: {formato}")
+        self.formato = formato
+        # Material para recrear el mismo cifrador en los procesos worker
+        self.configuracion = (tuple(claves), formato)
+        self.fernet = MultiFernet([Fernet(clave) for clave in claves])
+        self.fernet_actual = Fernet(claves[0])
+        self.aead = [AESGCM(_derivar_clave_aead(clave)) for clave in claves]
+    
+    def encrypt(self, datos):
+        if self.formato == 'aesgcm':
+            nonce = os.urandom(TAMANO_NONCE)
+            return bytes((VERSION_AESGCM,)) + nonce + self.aead[0].encrypt(nonce, datos, None)
+        return self.fernet.encrypt(datos)
+    
+    def decrypt(self, token):
+        if token[0] == VERSION_AESGCM:
+            nonce, cifrado = token[1:1 + TAMANO_NONCE], token[1 + TAMANO_NONCE:]
+            for aead in self.aead:
+                try:
+                    return aead.decrypt(nonce, cifrado, None)
+                except InvalidTag:
+                    continue
+            raise InvalidToken
+        return self.fernet.decrypt(token)
+    
+    def es_actual(self, token):
+        """True si el token ya usa la clave actual y el formato configurado"""
+        if token[0] == VERSION_AESGCM:
+            if self.formato != 'aesgcm':
+                return False
+            try:
+                self.aead[0].decrypt(token[1:1 + TAMANO_NONCE], token[1 + TAMANO_NONCE:], None)
+                return True
+            except InvalidTag:
+                return False
+        
+        if self.formato != 'fernet':
+            return False
+        try:
+            self.fernet_actual.decrypt(token)
+            return True
+        except InvalidToken:
+            return False
+    
+    def rotate(self, token):
+        return self.encrypt(self.decrypt(token))
+
+
+def crear_cipher(claves, formato=FORMATO_CIFRADO):
+    return Cifrador(claves, formato)
+
+
+CLAVES_VIGENTES = [ENCRYPTION_KEY] + ENCRYPTION_KEYS_ANTERIORES
+
+
+# Cifradores de cada proceso worker por (claves, formato): cada lote usa
+# el cifrador de quien lo pidió, no uno fijo del proceso
+_ciphers_worker = {}
+_ejecutor = None
+_ejecutor_lock = threading.Lock()
+
+
+def _cipher_de_worker(configuracion):
+    cipher = _ciphers_worker.get(configuracion)
+    if cipher is None:
+        claves, formato = configuracion
+        cipher = _ciphers_worker[configuracion] = crear_cipher(list(claves), formato)
+    return cipher
+
+
+def _iniciar_worker_cifrado(claves, formato):
+    # El cifrador de las claves vigentes queda creado de antemano
+    _cipher_de_worker((tuple(claves), formato))
+
+
+def _a_bytes(datos):
+    """BYTEA llega como memoryview: una sola copia a bytes, solo si hace falta"""
+    if datos is None or isinstance(datos, bytes):
+        return datos
+    return bytes(datos)
+
+
+def _encriptar_bloque(textos, cipher):
+    return [None if t is None else cipher.encrypt(t.encode()) for t in textos]
+
+
+def _desencriptar_bloque(datos, cipher):
+    return [None if d is None else cipher.decrypt(d).decode() for d in datos]
+
+
+def _bloque_en_worker(funcion, configuracion, bloque):
+    return funcion(bloque, _cipher_de_worker(configuracion))
+
+
+def _obtener_ejecutor():
+    """Pool de procesos para encriptación, creado la primera vez que se usa"""
+    global _ejecutor
+    if _ejecutor is None:
+        with _ejecutor_lock:
+            if _ejecutor is None:
+                _ejecutor = ProcessPoolExecutor(
+                    max_workers=CRYPTO_CONFIG['workers'],
+                    initializer=_iniciar_worker_cifrado,
+                    initargs=(CLAVES_VIGENTES, FORMATO_CIFRADO)
+                )
+    return _ejecutor
+
+
+def _procesar_lote(funcion, elementos, cipher):
+    """
+    Repartir los elementos en bloques entre los procesos worker, que
+    usan un cifrador con las mismas claves y formato que `cipher`.
+    El resultado conserva el orden de entrada.
+    """
+    global _ejecutor
+    if len(elementos) < CRYPTO_CONFIG['minimo_paralelo'] or CRYPTO_CONFIG['workers'] <= 1:
+        return funcion(elementos, cipher)
+    
+    tamano = CRYPTO_CONFIG['tamano_bloque']
+    bloques = [elementos[i:i + tamano] for i in range(0, len(elementos), tamano)]
+    
+    try:
+        resultados = []
+        for bloque in _obtener_ejecutor().map(_bloque_en_worker, repeat(funcion),
+                                              repeat(cipher.configuracion), bloques):
+            resultados.extend(bloque)
+        return resultados
+    except BrokenProcessPool:
+        # Un worker murió: descartar el pool y procesar en este proceso
+        with _ejecutor_lock:
+            _ejecutor = None
+        return funcion(elementos, cipher)
+
+
+def cerrar_ejecutor():
+    global _ejecutor
+    with _ejecutor_lock:
+        if _ejecutor is not None:
+            _ejecutor.shutdown()
+            _ejecutor = None
+
+
+atexit.register(cerrar_ejecutor)
+
 
 class Database:
     def __init__(self):
-        self.connection_pool = psycopg2.pool.SimpleConnectionPool(
-            1, 10, **DB_CONFIG
-        )
-        # REQUISITO 3: Sistema de encriptación
-        self.cipher = Fernet(ENCRYPTION_KEY)
+        # REQUISITO 3: Sistema de encriptación (acepta claves anteriores)
+        self.cipher = crear_cipher(CLAVES_VIGENTES)
+    
+    @property
+    def connection_pool(self):
+        # Pool compartido y perezoso: crear instancias de Database no abre conexiones
+        return obtener_pool()
     
     def get_connection(self):
         return self.connection_pool.getconn()
@@ -17,6 +398,30 @@ class Database:
     def release_connection(self, conn):
         self.connection_pool.putconn(conn)
     
+    def iterar_consulta(self, sql, parametros=None, itersize=None, nombre='iterar_consulta',
+                        con_nombres=True):
+        """
+        Recorrer el resultado de una consulta con un cursor del servidor:
+        se traen itersize filas por viaje y la memoria usada es la de un
+        lote, no la del resultado completo.
+        
+        Con con_nombres=True cada fila es una tupla con nombre (fila.valor,
+        fila[4] y el desempaquetado funcionan igual); con False, una tupla.
+        La consulta corre en una sola transacción (foto consistente) y la
+        conexión queda ocupada hasta agotar o cerrar el generador.
+        """
+        itersize = itersize or CURSOR_SERVIDOR_CONFIG['itersize']
+        fabrica = NamedTupleCursor if con_nombres else None
+        conn = self.get_connection()
+        try:
+            with conn:
+                with conn.cursor(name=nombre, cursor_factory=fabrica) as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute(sql, parametros)
+                    yield from cursor
+        finally:
+            self.release_connection(conn)
+    
     # REQUISITO 3: Encriptación de datos sensibles
     def encriptar(self, texto):
         if texto is None:
@@ -26,4 +431,30 @@ class Database:
     def desencriptar(self, datos_enc):
         if datos_enc is None:
             return None
-        return self.cipher.decrypt(bytes(datos_enc)).decode()
\ No newline at end of file
+        return self.cipher.decrypt(_a_bytes(datos_enc)).decode()
+    
+    def rotar(self, datos_enc):
+        """
+        Re-encriptar con la clave actual y el formato configurado.
+        Devuelve None si el valor ya está así encriptado.
+        """
+        if datos_enc is None:
+            return None
+        datos_enc = _a_bytes(datos_enc)
+        if self.cipher.es_actual(datos_enc):
+            return None
+        return self.cipher.rotate(datos_enc)
+    
+    def encriptar_lote(self, textos):
+        """Encriptar una lista de textos en paralelo (mismo orden de entrada)"""
+        return _procesar_lote(_encriptar_bloque, list(textos), self.cipher)
+    
+    def desencriptar_lote(self, lista_datos):
+        """Desencriptar una lista de valores BYTEA en paralelo (mismo orden de entrada)"""
+        return _procesar_lote(_desencriptar_bloque, [_a_bytes(d) for d in lista_datos], self.cipher)
+    
+    # Índice ciego: HMAC determinista para buscar sin desencriptar
+    def indice_ciego(self, texto):
+        if texto is None:
+            return None
+        return hmac.new(BLIND_INDEX_KEY, texto.strip().encode(), hashlib.sha256).digest()
\ No newline at end of file
@@ -1,114 +1,536 @@
+import math
+import threading
+import numpy as np
+from datetime import date, datetime, timedelta
 from database import Database
+from cache import CacheLRU
+from config import ESTADISTICAS_CACHE_CONFIG
+from catalogo import CANAL_TIPOS_ANALISIS
+from notificaciones import obtener_escucha
+from sketches import SketchCuantiles
 
-def obtener_estadisticas_periodo(fecha_inicio, fecha_fin):
+# Instancia compartida: usa el pool único del proceso
+db = Database()
+
+CANAL_ESTADISTICAS = 'estadisticas_cambios'
+
+
+def _como_datetime(valor):
+    """Fecha del período ('AAAA-MM-DD', date o datetime) como datetime"""
+    if isinstance(valor, str):
+        return datetime.fromisoformat(valor.strip())
+    if not isinstance(valor, datetime):
+        return datetime.combine(valor, datetime.min.time())
+    return valor
+
+
+class CacheEstadisticas:
     """
-    REQUISITO 6: Optimizar consultas de estadísticas por período
+    Caché de estadísticas por (fecha_inicio, fecha_fin, tipo_analisis_id,
+    clase), donde clase separa el resumen de los sketches de cuantiles.
+    
+    Cada día tiene una versión en memoria que avanza cuando llega el aviso
+    'estadisticas_cambios' (el rollup diario lo emite al confirmar cambios
+    en resultados de ese día). El aviso borra las entradas cuyo período
+    incluye el día, y un cálculo que empezó antes del cambio no se guarda.
+    Los períodos cerrados no expiran: solo salen por LRU o por un cambio.
     """
-    db = Database()
+    
+    def __init__(self, max_entradas=256, max_bytes=None, ttl=300, escuchar=True):
+        self._ttl = ttl
+        self._escuchar = escuchar
+        self._cache = CacheLRU(max_entradas=max_entradas, ttl=ttl, max_bytes=max_bytes)
+        self._lock = threading.Lock()
+        self._generacion = 0
+        # día -> generación de su último cambio
+        self._versiones = {}
+        # Un aviso sin días o una reconexión invalida todo lo anterior
+        self._reinicio = 0
+        self._suscrito = False
+    
+    def _asegurar_escucha(self):
+        if not self._escuchar or self._suscrito:
+            return
+        with self._lock:
+            if self._suscrito:
+                return
+            self._suscrito = True
+        escucha = obtener_escucha()
+        escucha.suscribir(CANAL_ESTADISTICAS, self._al_notificar)
+        # Un nombre de análisis cambiado también cambia las filas guardadas
+        escucha.suscribir(CANAL_TIPOS_ANALISIS, lambda payload: self.invalidar())
+    
+    def _al_notificar(self, payload):
+        try:
+            desde, hasta = (date.fromisoformat(p) for p in payload.split(','))
+        except (AttributeError, ValueError):
+            self.invalidar()
+            return
+        
+        if (hasta - desde).days > 366:
+            self.invalidar()
+            return
+        
+        with self._lock:
+            self._generacion += 1
+            dia = desde
+            while dia <= hasta:
+                self._versiones[dia] = self._generacion
+                dia += timedelta(days=1)
+            if len(self._versiones) > 10000:
+                self._versiones.clear()
+                self._reinicio = self._generacion
+        
+        self._cache.invalidar_si(
+            lambda clave: clave[0].date() <= hasta and clave[1].date() >= desde
+        )
+    
+    def invalidar(self):
+        """Descartar todas las entradas (y los cálculos en curso)"""
+        with self._lock:
+            self._generacion += 1
+            self._reinicio = self._generacion
+            self._versiones.clear()
+        self._cache.limpiar()
+    
+    def _cambio_posterior(self, clave, generacion):
+        """Si algún día del período cambió después de `generacion`"""
+        if self._reinicio > generacion:
+            return True
+        inicio, fin = clave[0].date(), clave[1].date()
+        return any(
+            version > generacion and inicio <= dia <= fin
+            for dia, version in self._versiones.items()
+        )
+    
+    def obtener(self, fecha_inicio, fecha_fin, tipo_analisis_id, calcular, clase='resumen'):
+        """Estadísticas desde la caché o, si no están, con calcular()"""
+        self._asegurar_escucha()
+        clave = (_como_datetime(fecha_inicio), _como_datetime(fecha_fin), tipo_analisis_id, clase)
+        
+        resultado = self._cache.obtener(clave)
+        if resultado is not None:
+            return list(resultado)
+        
+        with self._lock:
+            generacion = self._generacion
+        resultado = calcular()
+        
+        # Sin escucha no hay avisos: todo expira por TTL
+        cerrado = self._escuchar and clave[1].date() < date.today()
+        with self._lock:
+            if not self._cambio_posterior(clave, generacion):
+                self._cache.guardar(clave, tuple(resultado),
+                                    ttl=math.inf if cerrado else self._ttl)
+        return resultado
+    
+    def estadisticas(self):
+        return self._cache.estadisticas()
+
+
+cache_estadisticas = CacheEstadisticas(**ESTADISTICAS_CACHE_CONFIG)
+
+# Días completos del período: desde estadisticas_diarias. Días parciales
+# de los extremos: desde resultados (índice en fecha_resultado). El
+# resultado es el mismo que agregar todas las filas con
+# fecha_resultado BETWEEN inicio AND fin.
+_LIMITES_PERIODO = """
+    WITH limites AS (
+        SELECT
+            %(inicio)s::timestamp AS inicio,
+            %(fin)s::timestamp AS fin,
+            -- Días completos: [primer_dia, dia_fin)
+            CASE WHEN %(inicio)s::timestamp = %(inicio)s::date THEN %(inicio)s::date
+                 ELSE %(inicio)s::date + 1 END AS primer_dia,
+            %(fin)s::date AS dia_fin
+    ),
+"""
+
+# Filas de resultados de los días parciales: dos rangos disjuntos del
+# índice en fecha_resultado, [inicio, primer_dia) y [dia_fin, fin], en
+# lugar de recorrer todo el período y filtrar. Los límites se escriben
+# sobre los parámetros (no sobre el CTE limites) para que el planificador
+# conozca los rangos.
+_FILAS_PARCIALES = """
+        (SELECT r.* FROM resultados r
+         WHERE r.fecha_resultado >= %(inicio)s::timestamp
+         AND r.fecha_resultado < LEAST(
+             CASE WHEN %(inicio)s::timestamp = %(inicio)s::date THEN %(inicio)s::date
+                  ELSE %(inicio)s::date + 1 END,
+             %(fin)s::date)
+         UNION ALL
+         SELECT r.* FROM resultados r
+         WHERE r.fecha_resultado >= GREATEST(%(fin)s::date, %(inicio)s::timestamp)
+         AND r.fecha_resultado <= %(fin)s::timestamp) r
+"""
+
+_CONSULTA_ESTADISTICAS = _LIMITES_PERIODO + """
+    parciales AS (
+        SELECT
+            r.tipo_analisis_id,
+            COUNT(*) AS cantidad,
+            SUM(r.valor) AS suma,
+            MIN(r.valor) AS minimo,
+            MAX(r.valor) AS maximo,
+            SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END) AS fuera_rango
+        FROM {filas_parciales}
+        WHERE r.valor IS NOT NULL
+        {filtro_resultados}
+        GROUP BY r.tipo_analisis_id
+    ),
+    completos AS (
+        SELECT
+            e.tipo_analisis_id,
+            SUM(e.cantidad) AS cantidad,
+            SUM(e.suma) AS suma,
+            MIN(e.minimo) AS minimo,
+            MAX(e.maximo) AS maximo,
+            SUM(e.fuera_rango) AS fuera_rango
+        FROM estadisticas_diarias e, limites l
+        WHERE e.dia >= l.primer_dia AND e.dia < l.dia_fin
+        {filtro_diarias}
+        GROUP BY e.tipo_analisis_id
+    ),
+    totales AS (
+        SELECT
+            tipo_analisis_id,
+            SUM(cantidad) AS cantidad,
+            SUM(suma) AS suma,
+            MIN(minimo) AS minimo,
+            MAX(maximo) AS maximo,
+            SUM(fuera_rango) AS fuera_rango
+        FROM (SELECT * FROM parciales UNION ALL SELECT * FROM completos) t
+        GROUP BY tipo_analisis_id
+    )
+    SELECT 
+        ta.nombre AS analisis,
+        t.cantidad::bigint AS total_realizados,
+        ROUND(t.suma / t.cantidad, 2) AS promedio,
+        t.minimo,
+        t.maximo,
+        t.fuera_rango::bigint AS fuera_rango_count,
+        ROUND(t.fuera_rango * 100.0 / t.cantidad, 2) AS porcentaje_fuera_rango
+    FROM totales t
+    JOIN tipos_analisis ta ON t.tipo_analisis_id = ta.id
+    ORDER BY total_realizados DESC
+"""
+
+# Sketches de cuantiles del período: el de cada día completo desde
+# sketches_diarios y uno por tipo con las filas de los días parciales.
+# Se combinan en Python (sumar cubetas binarias es más barato que
+# expandirlas en la base)
+_CONSULTA_SKETCHES = _LIMITES_PERIODO + """
+    parciales AS (
+        SELECT r.tipo_analisis_id, indice_sketch(r.valor) AS indice, COUNT(*)::int AS cantidad
+        FROM {filas_parciales}
+        WHERE r.valor IS NOT NULL
+        {filtro_resultados}
+        GROUP BY r.tipo_analisis_id, indice
+    ),
+    sketches AS (
+        SELECT s.tipo_analisis_id, s.sketch
+        FROM sketches_diarios s, limites l
+        WHERE s.dia >= l.primer_dia AND s.dia < l.dia_fin
+        {filtro_sketches}
+        UNION ALL
+        SELECT tipo_analisis_id,
+               sketch_codificar(array_agg(indice ORDER BY indice), array_agg(cantidad ORDER BY indice))
+        FROM parciales
+        GROUP BY tipo_analisis_id
+    )
+    SELECT s.tipo_analisis_id, ta.nombre, s.sketch
+    FROM sketches s
+    JOIN tipos_analisis ta ON s.tipo_analisis_id = ta.id
+    ORDER BY ta.nombre
+"""
+
+
+def _estadisticas_periodo(fecha_inicio, fecha_fin, tipo_analisis_id=None):
+    """Estadísticas por tipo de análisis combinando rollup diario y días parciales"""
+    parametros = {'inicio': fecha_inicio, 'fin': fecha_fin, 'tipo': tipo_analisis_id}
+    if tipo_analisis_id is not None:
+        consulta = _CONSULTA_ESTADISTICAS.format(
+            filas_parciales=_FILAS_PARCIALES,
+            filtro_resultados="AND r.tipo_analisis_id = %(tipo)s",
+            filtro_diarias="AND e.tipo_analisis_id = %(tipo)s"
+        )
+    else:
+        consulta = _CONSULTA_ESTADISTICAS.format(filas_parciales=_FILAS_PARCIALES,
+                                                 filtro_resultados='', filtro_diarias='')
+    
     conn = db.get_connection()
     
     try:
         with conn.cursor() as cursor:
-            # REQUISITO 2: Consulta optimizada con índices en fecha
-            cursor.execute("""
-                SELECT 
-                    ta.nombre AS analisis,
-                    COUNT(*) AS total_realizados,
-                    ROUND(AVG(r.valor), 2) AS promedio,
-                    MIN(r.valor) AS minimo,
-                    MAX(r.valor) AS maximo,
-                    SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END) AS fuera_rango_count,
-                    ROUND(
-                        SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END) * 100.0 / COUNT(*),
-                        2
-                    ) AS porcentaje_fuera_rango
-                FROM resultados r
-                JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
-                WHERE r.fecha_resultado BETWEEN %s AND %s
-                AND r.valor IS NOT NULL
-                GROUP BY ta.id, ta.nombre
-                ORDER BY total_realizados DESC
-            """, (fecha_inicio, fecha_fin))
-            
+            cursor.execute(consulta, parametros)
             return cursor.fetchall()
     finally:
         db.release_connection(conn)
 
 
-def obtener_estadisticas_paciente(paciente_id):
-    """
-    Estadísticas de un paciente específico con ID de resultado
-    """
-    db = Database()
+def _sketches_periodo(fecha_inicio, fecha_fin, tipo_analisis_id=None):
+    """(tipo_analisis_id, nombre, sketch en bytes) de cada análisis con valores en el período"""
+    parametros = {'inicio': fecha_inicio, 'fin': fecha_fin, 'tipo': tipo_analisis_id}
+    if tipo_analisis_id is not None:
+        consulta = _CONSULTA_SKETCHES.format(
+            filas_parciales=_FILAS_PARCIALES,
+            filtro_sketches="AND s.tipo_analisis_id = %(tipo)s",
+            filtro_resultados="AND r.tipo_analisis_id = %(tipo)s"
+        )
+    else:
+        consulta = _CONSULTA_SKETCHES.format(filas_parciales=_FILAS_PARCIALES,
+                                             filtro_sketches='', filtro_resultados='')
+    
     conn = db.get_connection()
     
     try:
         with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT 
-                    r.id,
-                    ta.nombre,
-                    r.valor,
-                    r.fecha_resultado,
-                    r.fuera_rango,
-                    ta.valor_min,
-                    ta.valor_max,
-                    ta.unidad
-                FROM resultados r
-                JOIN ordenes o ON r.orden_id = o.id
-                JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
-                WHERE o.paciente_id = %s
-                AND r.valor IS NOT NULL
-                ORDER BY r.fecha_resultado DESC
-                LIMIT 50
-            """, (paciente_id,))
-            
-            return cursor.fetchall()
+            cursor.execute(consulta, parametros)
+            # Filas ordenadas por nombre: un sketch combinado por tipo
+            combinados = {}
+            for tipo, nombre, sketch in cursor.fetchall():
+                if tipo not in combinados:
+                    combinados[tipo] = (nombre, SketchCuantiles())
+                combinados[tipo][1].combinar(SketchCuantiles.desde_bytes(sketch))
+            return [(tipo, nombre, sketch.a_bytes()) for tipo, (nombre, sketch) in combinados.items()]
     finally:
         db.release_connection(conn)
 
-def obtener_estadisticas_periodo_filtradas(fecha_inicio, fecha_fin, tipo_analisis_id=None):
+
+def obtener_sketches_periodo(fecha_inicio, fecha_fin, tipo_analisis_id=None, usar_cache=True):
+    """
+    Sketch de cuantiles de cada análisis en el período (ver sketches.py).
+    La caché guarda el formato binario (unos bytes por cubeta).
+
+    Returns:
+        list: (tipo_analisis_id, nombre, SketchCuantiles)
+    """
+    if usar_cache:
+        filas = cache_estadisticas.obtener(
+            fecha_inicio, fecha_fin, tipo_analisis_id,
+            lambda: _sketches_periodo(fecha_inicio, fecha_fin, tipo_analisis_id),
+            clase='sketch'
+        )
+    else:
+        filas = _sketches_periodo(fecha_inicio, fecha_fin, tipo_analisis_id)
+    return [(tipo, nombre, SketchCuantiles.desde_bytes(sketch)) for tipo, nombre, sketch in filas]
+
+
+def obtener_percentiles_periodo(fecha_inicio, fecha_fin, tipo_analisis_id=None,
+                                cuantiles=(0.05, 0.5, 0.95), usar_cache=True):
+    """
+    Percentiles aproximados por tipo de análisis (por defecto p5, mediana
+    y p95). Error relativo máximo: sketches.ALFA (1 %) del valor real.
+
+    Returns:
+        list: (analisis, cantidad, valor de cada cuantil)
+    """
+    return [
+        (nombre, sketch.cantidad) + tuple(sketch.cuantiles(cuantiles))
+        for _, nombre, sketch in obtener_sketches_periodo(fecha_inicio, fecha_fin,
+                                                          tipo_analisis_id, usar_cache)
+    ]
+
+
+def obtener_histograma_periodo(fecha_inicio, fecha_fin, tipo_analisis_id, intervalos=10,
+                               minimo=None, maximo=None, usar_cache=True):
+    """
+    Histograma de intervalos iguales de un análisis en el período. Sin
+    minimo/maximo se usa el rango de los valores (aproximado al 1 %).
+
+    Returns:
+        tuple: (lista de (desde, hasta, cantidad), debajo, encima) o None sin datos
+    """
+    sketches = obtener_sketches_periodo(fecha_inicio, fecha_fin, tipo_analisis_id, usar_cache)
+    if not sketches:
+        return None
+    sketch = sketches[0][2]
+    if minimo is None or maximo is None:
+        menor, mayor = sketch.cuantiles([0, 1])
+        minimo = menor if minimo is None else minimo
+        maximo = mayor if maximo is None else maximo
+    return sketch.histograma(minimo, maximo, intervalos)
+
+
+def obtener_estadisticas_periodo(fecha_inicio, fecha_fin, usar_cache=True):
+    """
+    REQUISITO 6: Optimizar consultas de estadísticas por período
+    """
+    return obtener_estadisticas_periodo_filtradas(fecha_inicio, fecha_fin, None, usar_cache)
+
+
+def iterar_estadisticas_paciente(paciente_id, limite=None, itersize=None):
+    """
+    Resultados con valor de un paciente, del más reciente al más antiguo,
+    leídos con un cursor del servidor (limite=None: historial completo).
+    Cada fila es una tupla con nombre: id, nombre, valor, fecha_resultado,
+    fuera_rango, valor_min, valor_max, unidad.
+    """
+    # LIMIT NULL equivale a sin límite
+    return db.iterar_consulta("""
+        SELECT 
+            r.id,
+            ta.nombre,
+            r.valor,
+            r.fecha_resultado,
+            r.fuera_rango,
+            ta.valor_min,
+            ta.valor_max,
+            ta.unidad
+        FROM resultados r
+        JOIN ordenes o ON r.orden_id = o.id
+        JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
+        WHERE o.paciente_id = %s
+        AND r.valor IS NOT NULL
+        ORDER BY r.fecha_resultado DESC
+        LIMIT %s
+    """, (paciente_id, limite), itersize=itersize, nombre='estadisticas_paciente')
+
+def obtener_estadisticas_paciente(paciente_id, limite=50):
+    """
+    Estadísticas de un paciente específico con ID de resultado
+    """
+    return list(iterar_estadisticas_paciente(paciente_id, limite, itersize=limite))
+
+def obtener_estadisticas_periodo_filtradas(fecha_inicio, fecha_fin, tipo_analisis_id=None,
+                                           usar_cache=True):
     """
     REQUISITO 6: Optimizar consultas de estadísticas por período y tipo de análisis
     """
-    db = Database()
+    # Filtrar por tipo de análisis si se especifica (None = "TODOS")
+    if not usar_cache:
+        return _estadisticas_periodo(fecha_inicio, fecha_fin, tipo_analisis_id)
+    return cache_estadisticas.obtener(
+        fecha_inicio, fecha_fin, tipo_analisis_id,
+        lambda: _estadisticas_periodo(fecha_inicio, fecha_fin, tipo_analisis_id)
+    )
+
+
+# Series temporales: intervalo -> unidad de datetime64
+INTERVALOS_SERIE = {'hora': 'h', 'dia': 'D', 'semana': 'D', 'mes': 'M'}
+
+# Por día desde el rollup (días completos) y desde resultados (días parciales)
+_CONSULTA_SERIE_DIARIA = _LIMITES_PERIODO + """
+    completos AS (
+        SELECT e.dia, SUM(e.cantidad) AS cantidad, SUM(e.suma) AS suma,
+               SUM(e.fuera_rango) AS fuera_rango
+        FROM estadisticas_diarias e, limites l
+        WHERE e.dia >= l.primer_dia AND e.dia < l.dia_fin
+        {filtro_diarias}
+        GROUP BY e.dia
+    ),
+    parciales AS (
+        SELECT r.fecha_resultado::date AS dia, COUNT(*) AS cantidad, SUM(r.valor) AS suma,
+               SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END) AS fuera_rango
+        FROM {filas_parciales}
+        WHERE r.valor IS NOT NULL
+        {filtro_resultados}
+        GROUP BY 1
+    )
+    SELECT (dia - DATE '1970-01-01')::bigint * 86400000000, cantidad, (suma * 100)::bigint, fuera_rango
+    FROM completos
+    UNION ALL
+    SELECT (dia - DATE '1970-01-01')::bigint * 86400000000, cantidad, (suma * 100)::bigint, fuera_rango
+    FROM parciales
+"""
+
+# Una fila por resultado (intervalos de una hora o sin rollup). Las fechas
+# van como microsegundos desde 1970 (datetime64[us] sin objetos datetime)
+_CONSULTA_SERIE_FILAS = """
+    SELECT (EXTRACT(EPOCH FROM r.fecha_resultado) * 1000000)::bigint, 1, (r.valor * 100)::bigint,
+           CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END
+    FROM resultados r
+    WHERE r.fecha_resultado BETWEEN %(inicio)s AND %(fin)s
+    AND r.valor IS NOT NULL
+    {filtro_resultados}
+"""
+
+
+def _inicios_intervalo(fechas, intervalo):
+    """Inicio del intervalo de cada fecha (array datetime64)"""
+    if intervalo == 'semana':
+        dias = fechas.astype('datetime64[D]')
+        # 1970-01-01 fue jueves: semanas de lunes a domingo
+        return dias - (dias.astype(np.int64) + 3) % 7
+    return fechas.astype(f'datetime64[{INTERVALOS_SERIE[intervalo]}]')
+
+
+def _dividir_redondeado(dividendo, divisor):
+    """dividendo / divisor redondeado al entero (mitades lejos de cero, como ROUND)"""
+    cociente = (2 * np.abs(dividendo) + divisor) // (2 * divisor)
+    return np.sign(dividendo) * cociente
+
+
+def _serie_temporal(fecha_inicio, fecha_fin, tipo_analisis_id, intervalo, usar_rollup):
+    """Series por intervalo: una consulta y agregación vectorizada con NumPy"""
+    inicio, fin = _como_datetime(fecha_inicio), _como_datetime(fecha_fin)
+    parametros = {'inicio': inicio, 'fin': fin, 'tipo': tipo_analisis_id}
+    filtro = tipo_analisis_id is not None
+    
+    if usar_rollup and intervalo != 'hora':
+        consulta = _CONSULTA_SERIE_DIARIA.format(
+            filas_parciales=_FILAS_PARCIALES,
+            filtro_diarias="AND e.tipo_analisis_id = %(tipo)s" if filtro else '',
+            filtro_resultados="AND r.tipo_analisis_id = %(tipo)s" if filtro else ''
+        )
+    else:
+        consulta = _CONSULTA_SERIE_FILAS.format(
+            filtro_resultados="AND r.tipo_analisis_id = %(tipo)s" if filtro else ''
+        )
+    
     conn = db.get_connection()
     
     try:
         with conn.cursor() as cursor:
-            # Base de la consulta
-            query = """
-                SELECT 
-                    ta.nombre AS analisis,
-                    COUNT(*) AS total_realizados,
-                    ROUND(AVG(r.valor), 2) AS promedio,
-                    MIN(r.valor) AS minimo,
-                    MAX(r.valor) AS maximo,
-                    SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END) AS fuera_rango_count,
-                    ROUND(
-                        SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END) * 100.0 / COUNT(*),
-                        2
-                    ) AS porcentaje_fuera_rango
-                FROM resultados r
-                JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
-                WHERE r.fecha_resultado BETWEEN %s AND %s
-                AND r.valor IS NOT NULL
-            """
-            
-            params = [fecha_inicio, fecha_fin]
-            
-            # Filtrar por tipo de análisis si se especifica (y no es "TODOS")
-            if tipo_analisis_id is not None:
-                query += " AND r.tipo_analisis_id = %s"
-                params.append(tipo_analisis_id)
-            
-            query += """
-                GROUP BY ta.id, ta.nombre
-                ORDER BY total_realizados DESC
-            """
-            
-            cursor.execute(query, params)
-            
-            return cursor.fetchall()
+            cursor.execute(consulta, parametros)
+            # Sumas en centésimos (valor es NUMERIC(10,2)): enteras y exactas
+            datos = np.array(cursor.fetchall(), dtype=[
+                ('fecha', 'i8'), ('cantidad', 'i8'), ('centesimos', 'i8'), ('fuera', 'i8')
+            ])
     finally:
-        db.release_connection(conn)
\ No newline at end of file
+        db.release_connection(conn)
+    
+    # Todos los intervalos del período, también los vacíos
+    limites = _inicios_intervalo(np.array([inicio, fin], dtype='datetime64[us]'), intervalo)
+    inicios = np.arange(limites[0], limites[1] + 1, 7 if intervalo == 'semana' else 1)
+    
+    fechas = datos['fecha'].view('datetime64[us]')
+    indices = np.searchsorted(inicios, _inicios_intervalo(fechas, intervalo))
+    cantidad = np.zeros(len(inicios), dtype=np.int64)
+    centesimos = np.zeros(len(inicios), dtype=np.int64)
+    fuera = np.zeros(len(inicios), dtype=np.int64)
+    np.add.at(cantidad, indices, datos['cantidad'])
+    np.add.at(centesimos, indices, datos['centesimos'])
+    np.add.at(fuera, indices, datos['fuera'])
+    
+    # Mismo redondeo a 2 decimales que las estadísticas del período
+    divisor = np.maximum(cantidad, 1)
+    promedio = _dividir_redondeado(centesimos, divisor) / 100
+    porcentaje = _dividir_redondeado(fuera * 10000, divisor) / 100
+    
+    return [
+        (momento, int(n), None if n == 0 else float(p), None if n == 0 else float(f))
+        for momento, n, p, f in zip(inicios.astype('datetime64[us]').tolist(),
+                                    cantidad, promedio, porcentaje)
+    ]
+
+
+def obtener_serie_temporal(fecha_inicio, fecha_fin, tipo_analisis_id=None, intervalo='dia',
+                           usar_rollup=True, usar_cache=True):
+    """
+    Evolución de un análisis (o de todos) por hora, día, semana o mes.
+    Día, semana y mes salen del rollup diario; hora, de las filas.
+    
+    Returns:
+        list: (inicio del intervalo, cantidad, promedio, porcentaje fuera de
+              rango) por cada intervalo del período, sin datos -> (.., 0, None, None)
+    """
+    if intervalo not in INTERVALOS_SERIE:
+        raise ValueError(f"Intervalo no soportado: {intervalo}")
+    if not usar_cache:
+        return _serie_temporal(fecha_inicio, fecha_fin, tipo_analisis_id, intervalo, usar_rollup)
+    return cache_estadisticas.obtener(
+        fecha_inicio, fecha_fin, tipo_analisis_id,
+        lambda: _serie_temporal(fecha_inicio, fecha_fin, tipo_analisis_id, intervalo, usar_rollup),
+        clase=f'serie_{intervalo}'
+    )
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""
+Exportación de auditoria_accesos por rango de fechas para entes reguladores.
+
+Recorre la auditoría con un cursor del servidor (iterar_auditoria) y
+escribe JSONL o CSV comprimidos con gzip o zstd, con memoria constante
+sea cual sea el rango. Al superar el tamaño configurado se empieza un
+archivo nuevo (siempre en un límite de fila). Al final escribe
+manifiesto.json con filas, bytes y SHA-256 de cada archivo.
+
+Todo el rango se lee en una sola transacción: el extracto es una foto
+consistente aunque se sigan registrando accesos.
+
+    python exportar_auditoria.py 2026-01-01 2026-04-01 --formato csv
+"""
+
+import io
+import os
+import csv
+import json
+import gzip
+import hashlib
+import argparse
+from datetime import datetime
+from config import EXPORTACION_AUDITORIA_CONFIG
+from auditoria import iterar_auditoria
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLUMNAS = ('id', 'fecha', 'tabla', 'registro_id', 'accion', 'usuario', 'detalles', 'ip_address')
+EXTENSIONES = {'gzip': 'gz', 'zstd': 'zst'}
+
+
+class _ArchivoSalida:
+    """
+    Archivo comprimido que cuenta los bytes escritos en disco y calcula su
+    SHA-256 al vuelo (sin releerlo). Se escribe como .tmp y se renombra al
+    cerrar: un archivo con su nombre final siempre está completo.
+    """
+
+    def __init__(self, ruta, compresion, encabezado=None):
+        self.ruta = ruta
+        self.bytes = 0
+        self.filas = 0
+        self.primera_fecha = None
+        self.ultima_fecha = None
+        self._sha256 = hashlib.sha256()
+        self._crudo = open(ruta + '.tmp', 'wb')
+
+        if compresion == 'gzip':
+            self._comprimido = gzip.GzipFile(fileobj=self, mode='wb')
+        elif compresion == 'zstd':
+            self._comprimido = zstandard.ZstdCompressor().stream_writer(self, closefd=False)
+        else:
+            raise ValueError(f"Compresión no soportada: {compresion}")
+        if encabezado:
+            self._comprimido.write(encabezado.encode('utf-8'))
+
+    # Interfaz de archivo que usa el compresor
+    def write(self, datos):
+        self._sha256.update(datos)
+        self.bytes += len(datos)
+        return self._crudo.write(datos)
+
+    def flush(self):
+        self._crudo.flush()
+
+    def escribir(self, texto, fecha):
+        self._comprimido.write(texto.encode('utf-8'))
+        self.filas += 1
+        if self.primera_fecha is None:
+            self.primera_fecha = fecha
+        self.ultima_fecha = fecha
+
+    def descartar(self):
+        """Exportación interrumpida: no dejar un archivo incompleto"""
+        self._comprimido.close()
+        self._crudo.close()
+        os.remove(self.ruta + '.tmp')
+
+    def cerrar(self):
+        """Cerrar, sincronizar y renombrar; retorna la entrada del manifiesto"""
+        self._comprimido.close()
+        self._crudo.flush()
+        os.fsync(self._crudo.fileno())
+        self._crudo.close()
+        os.replace(self.ruta + '.tmp', self.ruta)
+        return {
+            'archivo': os.path.basename(self.ruta),
+            'filas': self.filas,
+            'bytes': self.bytes,
+            'sha256': self._sha256.hexdigest(),
+            'primera_fecha': self.primera_fecha.isoformat() if self.primera_fecha else None,
+            'ultima_fecha': self.ultima_fecha.isoformat() if self.ultima_fecha else None
+        }
+
+
+def _serializador(formato):
+    """Función fila -> línea de texto (incluido el salto de línea)"""
+    if formato == 'jsonl':
+        def linea(fila):
+            registro = dict(zip(COLUMNAS, fila))
+            registro['fecha'] = registro['fecha'].isoformat()
+            return json.dumps(registro, ensure_ascii=False) + '\n'
+        return linea, None
+
+    if formato == 'csv':
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer, lineterminator='\n')
+
+        def linea(fila):
+            buffer.seek(0)
+            buffer.truncate()
+            escritor.writerow(fila[:1] + (fila[1].isoformat(),) + fila[2:])
+            return buffer.getvalue()
+        return linea, ','.join(COLUMNAS) + '\n'
+
+    raise ValueError(f"Formato no soportado: {formato}")
+
+
+def exportar_auditoria(desde, hasta, destino=None, formato=None, compresion=None,
+                       max_bytes=None, tamano_lote=None, **filtros):
+    """
+    Exportar la auditoría con desde <= fecha < hasta.
+
+    Args:
+        desde, hasta: datetime del rango (hasta exclusive)
+        destino: carpeta base; el extracto va en una subcarpeta propia
+        formato: 'jsonl' o 'csv'
+        compresion: 'gzip' o 'zstd'
+        max_bytes: tamaño comprimido aproximado de cada archivo
+        filtros: tabla, registro_id, usuario, accion (ver iterar_auditoria)
+
+    Returns:
+        tuple: (ruta del manifiesto, manifiesto)
+    """
+    config = EXPORTACION_AUDITORIA_CONFIG
+    destino = destino or config['destino']
+    formato = formato or config['formato']
+    compresion = compresion or config['compresion']
+    max_bytes = max_bytes or config['max_bytes']
+    tamano_lote = tamano_lote or config['tamano_lote']
+
+    if compresion == 'zstd' and zstandard is None:
+        raise RuntimeError("La compresión zstd requiere el paquete 'zstandard' (pip install zstandard)")
+    linea, encabezado = _serializador(formato)
+
+    prefijo = f"auditoria_{desde:%Y%m%d}_{hasta:%Y%m%d}"
+    carpeta = os.path.join(destino, f"{prefijo}_{datetime.now():%Y%m%d%H%M%S}")
+    os.makedirs(carpeta)
+    extension = f"{formato}.{EXTENSIONES.get(compresion, compresion)}"
+
+    archivos = []
+    actual = None
+    try:
+        for fila in iterar_auditoria(tamano_lote=tamano_lote, ascendente=True,
+                                     desde=desde, hasta=hasta, **filtros):
+            if actual is None:
+                ruta = os.path.join(carpeta, f"{prefijo}_{len(archivos) + 1:04d}.{extension}")
+                actual = _ArchivoSalida(ruta, compresion, encabezado)
+
+            actual.escribir(linea(fila), fila[1])
+
+            # El tamaño en disco va por detrás de lo escrito (el compresor
+            # acumula datos): los archivos quedan cerca de max_bytes
+            if actual.bytes >= max_bytes:
+                archivos.append(actual.cerrar())
+                actual = None
+        if actual is not None:
+            archivos.append(actual.cerrar())
+            actual = None
+    finally:
+        if actual is not None:
+            actual.descartar()
+
+    manifiesto = {
+        'generado': datetime.now().isoformat(),
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'filtros': {k: v for k, v in filtros.items() if v is not None},
+        'formato': formato,
+        'compresion': compresion,
+        'columnas': list(COLUMNAS),
+        'total_filas': sum(a['filas'] for a in archivos),
+        'archivos': archivos
+    }
+    ruta_manifiesto = os.path.join(carpeta, 'manifiesto.json')
+    with open(ruta_manifiesto, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    return ruta_manifiesto, manifiesto
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportar auditoría por rango de fechas")
+    parser.add_argument('desde', help="Fecha inicial AAAA-MM-DD (inclusive)")
+    parser.add_argument('hasta', help="Fecha final AAAA-MM-DD (exclusive)")
+    parser.add_argument('--formato', choices=['jsonl', 'csv'])
+    parser.add_argument('--compresion', choices=['gzip', 'zstd'])
+    parser.add_argument('--destino')
+    parser.add_argument('--max-mb', type=int, help="Tamaño aproximado de cada archivo (MB)")
+    parser.add_argument('--tabla')
+    parser.add_argument('--usuario')
+    parser.add_argument('--accion')
+    args = parser.parse_args()
+
+    ruta, manifiesto = exportar_auditoria(
+        datetime.strptime(args.desde, '%Y-%m-%d'),
+        datetime.strptime(args.hasta, '%Y-%m-%d'),
+        destino=args.destino,
+        formato=args.formato,
+        compresion=args.compresion,
+        max_bytes=args.max_mb * 1024 * 1024 if args.max_mb else None,
+        tabla=args.tabla,
+        usuario=args.usuario,
+        accion=args.accion
+    )
+    print(f"Filas exportadas: {manifiesto['total_filas']:,} en {len(manifiesto['archivos'])} archivo(s)")
+    print(f"Manifiesto: {ruta}")
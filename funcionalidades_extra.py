@@ -3,9 +3,20 @@ Funcionalidades adicionales para mayor flexibilidad del sistema
 """
 
 from database import Database
+from cache import CacheLRU
+from config import CACHE_PACIENTES_CONFIG, BUSQUEDA_NOMBRE_CONFIG
+from indices_busqueda import normalizar_texto, tokens_consulta, guardar_tokens_nombre, TAMANO_NGRAMA
+from catalogo import catalogo_analisis, notificar_cambio_catalogo
+from transacciones import ejecutar_transaccion
+from auditoria import registrar_auditoria, establecer_contexto_auditoria, registrar_lectura
 from datetime import datetime, timedelta
 import csv
 
+# Caché de pacientes desencriptados compartida por todo el proceso.
+# obtener() devuelve una copia del registro: el guardado no se comparte.
+cache_pacientes = CacheLRU(copiar=dict, **CACHE_PACIENTES_CONFIG)
+
+
 class FuncionalidadesExtra:
     def __init__(self):
         self.db = Database()
@@ -16,164 +27,240 @@ class FuncionalidadesExtra:
         """
         Permite agregar nuevos tipos de análisis dinámicamente
         """
-        conn = self.db.get_connection()
+        def unidad_trabajo(cursor):
+            cursor.execute("""
+                INSERT INTO tipos_analisis (codigo, nombre, valor_min, valor_max, unidad)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            """, (codigo, nombre, valor_min, valor_max, unidad))
+            
+            nuevo_id = cursor.fetchone()[0]
+            notificar_cambio_catalogo(cursor, nuevo_id)
+            return nuevo_id
+        
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO tipos_analisis (codigo, nombre, valor_min, valor_max, unidad)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (codigo, nombre, valor_min, valor_max, unidad))
-                
-                nuevo_id = cursor.fetchone()[0]
-                conn.commit()
-                return nuevo_id, "Tipo de análisis agregado exitosamente"
+            nuevo_id = ejecutar_transaccion(unidad_trabajo)
+            catalogo_analisis.invalidar()
+            return nuevo_id, "Tipo de análisis agregado exitosamente"
         except Exception as e:
-            conn.rollback()
             return None, f"Error: {str(e)}"
-        finally:
-            self.db.release_connection(conn)
     
     def modificar_rangos_analisis(self, tipo_id, nuevo_min, nuevo_max):
         """
         Modificar rangos normales de un tipo de análisis
         """
-        conn = self.db.get_connection()
+        def unidad_trabajo(cursor):
+            cursor.execute("""
+                UPDATE tipos_analisis
+                SET valor_min = %s, valor_max = %s
+                WHERE id = %s
+            """, (nuevo_min, nuevo_max, tipo_id))
+            
+            notificar_cambio_catalogo(cursor, tipo_id)
+        
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE tipos_analisis
-                    SET valor_min = %s, valor_max = %s
-                    WHERE id = %s
-                """, (nuevo_min, nuevo_max, tipo_id))
-                
-                conn.commit()
-                return True, "Rangos actualizados exitosamente"
+            ejecutar_transaccion(unidad_trabajo)
+            catalogo_analisis.invalidar()
+            return True, "Rangos actualizados exitosamente"
         except Exception as e:
-            conn.rollback()
             return False, f"Error: {str(e)}"
-        finally:
-            self.db.release_connection(conn)
     
     def listar_tipos_analisis(self):
         """
-        Listar todos los tipos de análisis disponibles
+        Listar todos los tipos de análisis disponibles (desde el catálogo en memoria)
         """
-        conn = self.db.get_connection()
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT id, codigo, nombre, valor_min, valor_max, unidad
-                    FROM tipos_analisis
-                    ORDER BY nombre
-                """)
-                return cursor.fetchall()
-        finally:
-            self.db.release_connection(conn)
+        return catalogo_analisis.listar()
     
     # ========== BÚSQUEDAS AVANZADAS ==========
     
-    def buscar_paciente_por_dni(self, dni):
+    def obtener_paciente(self, paciente_id, usar_cache=True, usuario=None, ip_address=None):
         """
-        Buscar paciente por DNI (requiere desencriptar)
+        Obtener los datos desencriptados de un paciente por ID.
+        Usa la caché LRU+TTL; devuelve una copia del registro o None.
+        La lectura se audita (también desde la caché).
         """
+        if usar_cache:
+            registro = cache_pacientes.obtener(paciente_id)
+            if registro is not None:
+                registrar_lectura('pacientes', paciente_id, usuario,
+                                  'Consulta de paciente', ip_address)
+                return registro
+        
         conn = self.db.get_connection()
         try:
             with conn.cursor() as cursor:
                 cursor.execute("""
-                    SELECT id, nombre_enc, dni_enc, fecha_nacimiento, telefono_enc
-                    FROM pacientes
-                """)
-                
-                pacientes = cursor.fetchall()
-                
-                # Buscar desencriptando
-                for pac in pacientes:
-                    # Convertir memoryview a bytes si es necesario
-                    dni_enc = bytes(pac[2]) if isinstance(pac[2], memoryview) else pac[2]
-                    dni_desenc = self.db.desencriptar(dni_enc)
-                    
-                    if dni_desenc == dni:
-                        nombre_enc = bytes(pac[1]) if isinstance(pac[1], memoryview) else pac[1]
-                        tel_enc = bytes(pac[4]) if pac[4] and isinstance(pac[4], memoryview) else pac[4]
-                        
-                        return {
-                            'id': pac[0],
-                            'nombre': self.db.desencriptar(nombre_enc),
-                            'dni': dni_desenc,
-                            'fecha_nacimiento': pac[3],
-                            'telefono': self.db.desencriptar(tel_enc) if tel_enc else None
-                        }
-                
-                return None
+                    SELECT nombre_enc, dni_enc, fecha_nacimiento, telefono_enc, created_at
+                    FROM pacientes WHERE id = %s
+                """, (paciente_id,))
+                pac = cursor.fetchone()
         finally:
             self.db.release_connection(conn)
+        
+        if not pac:
+            return None
+        
+        registro = {
+            'id': paciente_id,
+            'nombre': self.db.desencriptar(pac[0]),
+            'dni': self.db.desencriptar(pac[1]),
+            'fecha_nacimiento': pac[2],
+            'telefono': self.db.desencriptar(pac[3]) if pac[3] else None,
+            'created_at': pac[4]
+        }
+        
+        if usar_cache:
+            cache_pacientes.guardar(paciente_id, registro)
+        registrar_lectura('pacientes', paciente_id, usuario, 'Consulta de paciente', ip_address)
+        return dict(registro)
     
-    def buscar_paciente_por_nombre(self, nombre_parcial):
+    def buscar_paciente_por_dni(self, dni, usuario=None, ip_address=None):
         """
-        Buscar pacientes por nombre (búsqueda parcial)
+        Buscar paciente por DNI usando el índice ciego (una consulta indexada)
         """
         conn = self.db.get_connection()
         try:
             with conn.cursor() as cursor:
                 cursor.execute("""
-                    SELECT id, nombre_enc, dni_enc
+                    SELECT id, nombre_enc, fecha_nacimiento, telefono_enc
                     FROM pacientes
-                """)
-                
-                pacientes = cursor.fetchall()
-                resultados = []
-                
-                nombre_parcial = nombre_parcial.lower()
-                
-                for pac in pacientes:
-                    # Convertir memoryview a bytes si es necesario
-                    nombre_enc = bytes(pac[1]) if isinstance(pac[1], memoryview) else pac[1]
-                    dni_enc = bytes(pac[2]) if isinstance(pac[2], memoryview) else pac[2]
-                    
-                    nombre_desenc = self.db.desencriptar(nombre_enc).lower()
-                    
-                    if nombre_parcial in nombre_desenc:
-                        resultados.append({
-                            'id': pac[0],
-                            'nombre': self.db.desencriptar(nombre_enc),
-                            'dni': self.db.desencriptar(dni_enc)
-                        })
+                    WHERE dni_hash = %s
+                """, (self.db.indice_ciego(dni),))
                 
-                return resultados
+                pac = cursor.fetchone()
+                if not pac:
+                    return None
+                
+                registrar_lectura('pacientes', pac[0], usuario, 'Búsqueda por DNI', ip_address)
+                
+                # El HMAC coincide, por lo que el DNI no necesita desencriptarse
+                return {
+                    'id': pac[0],
+                    'nombre': self.db.desencriptar(pac[1]),
+                    'dni': dni.strip(),
+                    'fecha_nacimiento': pac[2],
+                    'telefono': self.db.desencriptar(pac[3]) if pac[3] else None
+                }
         finally:
             self.db.release_connection(conn)
     
-    def obtener_historial_paciente(self, paciente_id):
+    def buscar_paciente_por_nombre(self, nombre_parcial, limite=50, desde_id=0,
+                                   usuario=None, ip_address=None, max_candidatos=None):
         """
-        Obtener historial completo de análisis de un paciente
+        Buscar pacientes por nombre (búsqueda parcial, paginada por ID).
+        
+        Los candidatos se filtran en SQL con el índice de tokens y solo
+        esos se desencriptan para confirmar la coincidencia. La búsqueda
+        necesita al menos una palabra de TAMANO_NGRAMA letras (ValueError
+        si no): sin tokens habría que desencriptar toda la tabla. Cada
+        llamada desencripta como mucho max_candidatos pacientes.
+        
+        Returns:
+            tuple: (resultados, cursor) donde cursor es el desde_id de la
+            página siguiente o None si no quedan candidatos
         """
+        consulta = normalizar_texto(nombre_parcial)
+        tokens = list(tokens_consulta(nombre_parcial))
+        if not tokens:
+            raise ValueError(f"Ingrese al menos una palabra de {TAMANO_NGRAMA} letras")
+        max_candidatos = max_candidatos or BUSQUEDA_NOMBRE_CONFIG['max_candidatos']
+        
+        resultados = []
+        revisados = 0
+        cursor_siguiente = desde_id
+        
         conn = self.db.get_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT 
-                        o.id as orden_id,
-                        o.fecha_orden,
-                        o.estado,
-                        ta.nombre as analisis,
-                        r.valor,
-                        r.fecha_resultado,
-                        r.fuera_rango,
-                        ta.valor_min,
-                        ta.valor_max,
-                        ta.unidad
-                    FROM ordenes o
-                    JOIN resultados r ON o.id = r.orden_id
-                    JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
-                    WHERE o.paciente_id = %s
-                    ORDER BY o.fecha_orden DESC, ta.nombre
-                """, (paciente_id,))
-                
-                return cursor.fetchall()
+                while len(resultados) < limite and revisados < max_candidatos:
+                    pedidos = min(limite, max_candidatos - revisados)
+                    # Pacientes que contienen todos los trigramas buscados
+                    cursor.execute("""
+                        SELECT p.id, p.nombre_enc, p.dni_enc
+                        FROM pacientes p
+                        JOIN (
+                            SELECT paciente_id
+                            FROM pacientes_nombre_tokens
+                            WHERE token_hash = ANY(%s) AND paciente_id > %s
+                            GROUP BY paciente_id
+                            HAVING COUNT(*) = %s
+                        ) c ON c.paciente_id = p.id
+                        ORDER BY p.id
+                        LIMIT %s
+                    """, (tokens, cursor_siguiente, len(tokens), pedidos))
+                    
+                    candidatos = cursor.fetchall()
+                    if not candidatos:
+                        cursor_siguiente = None
+                        break
+                    
+                    nombres = self.db.desencriptar_lote([pac[1] for pac in candidatos])
+                    for pac, nombre in zip(candidatos, nombres):
+                        revisados += 1
+                        cursor_siguiente = pac[0]
+                        if consulta in normalizar_texto(nombre):
+                            resultados.append({
+                                'id': pac[0],
+                                'nombre': nombre,
+                                'dni': self.db.desencriptar(pac[2])
+                            })
+                            if len(resultados) == limite:
+                                break
+                    
+                    # Lote incompleto y revisado entero: no quedan candidatos
+                    if len(candidatos) < pedidos and cursor_siguiente == candidatos[-1][0]:
+                        cursor_siguiente = None
+                        break
+                
+                # Solo se auditan los pacientes mostrados, no los candidatos descartados
+                registrar_lectura('pacientes', [pac['id'] for pac in resultados], usuario,
+                                  'Búsqueda por nombre', ip_address)
+                return resultados, cursor_siguiente
         finally:
             self.db.release_connection(conn)
     
+    def iterar_historial_paciente(self, paciente_id, usuario=None, ip_address=None,
+                                  itersize=None):
+        """
+        Recorrer el historial completo de análisis de un paciente con un
+        cursor del servidor, sin cargarlo entero en memoria.
+        
+        Cada fila es una tupla con nombre: orden_id, fecha_orden, estado,
+        analisis, valor, fecha_resultado, fuera_rango, valor_min, valor_max,
+        unidad. La conexión queda ocupada hasta agotar o cerrar el generador.
+        """
+        leido = False
+        for fila in self.db.iterar_consulta("""
+            SELECT 
+                o.id as orden_id,
+                o.fecha_orden,
+                o.estado,
+                ta.nombre as analisis,
+                r.valor,
+                r.fecha_resultado,
+                r.fuera_rango,
+                ta.valor_min,
+                ta.valor_max,
+                ta.unidad
+            FROM ordenes o
+            JOIN resultados r ON o.id = r.orden_id
+            JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
+            WHERE o.paciente_id = %s
+            ORDER BY o.fecha_orden DESC, ta.nombre
+        """, (paciente_id,), itersize=itersize, nombre='historial_paciente'):
+            if not leido:
+                registrar_lectura('pacientes', paciente_id, usuario,
+                                  'Historial de análisis', ip_address)
+                leido = True
+            yield fila
+    
+    def obtener_historial_paciente(self, paciente_id, usuario=None, ip_address=None):
+        """
+        Obtener historial completo de análisis de un paciente (lista).
+        Para historiales grandes usar iterar_historial_paciente().
+        """
+        return list(self.iterar_historial_paciente(paciente_id, usuario, ip_address))
+    
     # ========== REPORTES Y EXPORTACIÓN ==========
     
     def exportar_resultados_csv(self, orden_id, archivo='resultados.csv'):
@@ -213,36 +300,29 @@ class FuncionalidadesExtra:
         finally:
             self.db.release_connection(conn)
     
-    def generar_reporte_paciente(self, paciente_id, archivo='reporte_paciente.txt'):
+    def generar_reporte_paciente(self, paciente_id, archivo='reporte_paciente.txt',
+                                 usuario=None, ip_address=None):
         """
         Generar reporte completo de un paciente
         """
-        conn = self.db.get_connection()
         try:
-            # Datos del paciente
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT nombre_enc, dni_enc, fecha_nacimiento, telefono_enc, created_at
-                    FROM pacientes WHERE id = %s
-                """, (paciente_id,))
-                
-                pac = cursor.fetchone()
-                if not pac:
-                    return False, "Paciente no encontrado"
-                
-                # Convertir memoryview a bytes si es necesario
-                nombre_enc = bytes(pac[0]) if isinstance(pac[0], memoryview) else pac[0]
-                dni_enc = bytes(pac[1]) if isinstance(pac[1], memoryview) else pac[1]
-                tel_enc = bytes(pac[3]) if pac[3] and isinstance(pac[3], memoryview) else pac[3]
-                
-                nombre = self.db.desencriptar(nombre_enc)
-                dni = self.db.desencriptar(dni_enc)
-                fecha_nac = pac[2]
-                telefono = self.db.desencriptar(tel_enc) if tel_enc else "N/A"
-                created = pac[4]
+            # Datos del paciente (desde la caché si ya se consultó)
+            paciente = self.obtener_paciente(paciente_id, usuario=usuario, ip_address=ip_address)
+            if not paciente:
+                return False, "Paciente no encontrado"
             
-            # Historial
-            historial = self.obtener_historial_paciente(paciente_id)
+            # Solo se audita si el paciente existe: el reporte y el historial
+            # se agrupan con la consulta anterior (mismo usuario y ventana)
+            registrar_lectura('pacientes', paciente_id, usuario, 'Reporte de paciente', ip_address)
+            
+            nombre = paciente['nombre']
+            dni = paciente['dni']
+            fecha_nac = paciente['fecha_nacimiento']
+            telefono = paciente['telefono'] or "N/A"
+            created = paciente['created_at']
+            
+            # Historial: se escribe a medida que llega, sin cargarlo entero
+            historial = self.iterar_historial_paciente(paciente_id, usuario, ip_address)
             
             # Generar reporte
             with open(archivo, 'w', encoding='utf-8') as f:
@@ -285,8 +365,6 @@ class FuncionalidadesExtra:
             
         except Exception as e:
             return False, f"Error: {str(e)}"
-        finally:
-            self.db.release_connection(conn)
     
     # ========== GESTIÓN DE USUARIOS Y ROLES ==========
     
@@ -294,36 +372,32 @@ class FuncionalidadesExtra:
         """
         Sistema básico de usuarios (expandible)
         """
-        conn = self.db.get_connection()
+        def unidad_trabajo(cursor):
+            # Crear tabla de usuarios si no existe
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS usuarios (
+                    id SERIAL PRIMARY KEY,
+                    username VARCHAR(50) UNIQUE NOT NULL,
+                    nombre_completo VARCHAR(200) NOT NULL,
+                    rol VARCHAR(50) NOT NULL,
+                    activo BOOLEAN DEFAULT TRUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            cursor.execute("""
+                INSERT INTO usuarios (username, nombre_completo, rol)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (username, nombre_completo, rol))
+            
+            return cursor.fetchone()[0]
+        
         try:
-            with conn.cursor() as cursor:
-                # Crear tabla de usuarios si no existe
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS usuarios (
-                        id SERIAL PRIMARY KEY,
-                        username VARCHAR(50) UNIQUE NOT NULL,
-                        nombre_completo VARCHAR(200) NOT NULL,
-                        rol VARCHAR(50) NOT NULL,
-                        activo BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                cursor.execute("""
-                    INSERT INTO usuarios (username, nombre_completo, rol)
-                    VALUES (%s, %s, %s)
-                    RETURNING id
-                """, (username, nombre_completo, rol))
-                
-                user_id = cursor.fetchone()[0]
-                conn.commit()
-                
-                return user_id, "Usuario registrado exitosamente"
+            user_id = ejecutar_transaccion(unidad_trabajo)
+            return user_id, "Usuario registrado exitosamente"
         except Exception as e:
-            conn.rollback()
             return None, f"Error: {str(e)}"
-        finally:
-            self.db.release_connection(conn)
     
     # ========== ALERTAS Y NOTIFICACIONES ==========
     
@@ -366,98 +440,97 @@ class FuncionalidadesExtra:
         """
         Marcar una alerta como revisada
         """
-        conn = self.db.get_connection()
+        def unidad_trabajo(cursor):
+            # Agregar tabla de alertas revisadas si no existe
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS alertas_revisadas (
+                    id SERIAL PRIMARY KEY,
+                    resultado_id INTEGER REFERENCES resultados(id),
+                    usuario VARCHAR(50),
+                    observaciones TEXT,
+                    fecha_revision TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            cursor.execute("""
+                INSERT INTO alertas_revisadas (resultado_id, usuario, observaciones)
+                VALUES (%s, %s, %s)
+            """, (resultado_id, usuario, observaciones))
+        
         try:
-            with conn.cursor() as cursor:
-                # Agregar tabla de alertas revisadas si no existe
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS alertas_revisadas (
-                        id SERIAL PRIMARY KEY,
-                        resultado_id INTEGER REFERENCES resultados(id),
-                        usuario VARCHAR(50),
-                        observaciones TEXT,
-                        fecha_revision TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                cursor.execute("""
-                    INSERT INTO alertas_revisadas (resultado_id, usuario, observaciones)
-                    VALUES (%s, %s, %s)
-                """, (resultado_id, usuario, observaciones))
-                
-                conn.commit()
-                return True, "Alerta marcada como revisada"
+            ejecutar_transaccion(unidad_trabajo)
+            return True, "Alerta marcada como revisada"
         except Exception as e:
-            conn.rollback()
             return False, f"Error: {str(e)}"
-        finally:
-            self.db.release_connection(conn)
     
     # ========== MODIFICACIÓN Y ELIMINACIÓN ==========
     
-    def modificar_paciente(self, paciente_id, nombre=None, telefono=None):
+    def modificar_paciente(self, paciente_id, nombre=None, telefono=None,
+                           usuario='sistema', ip_address=None):
         """
         Modificar datos de un paciente (mantiene encriptación)
         """
-        conn = self.db.get_connection()
+        updates = []
+        params = []
+        
+        if nombre:
+            updates.append("nombre_enc = %s")
+            params.append(self.db.encriptar(nombre))
+        
+        if telefono:
+            updates.append("telefono_enc = %s")
+            params.append(self.db.encriptar(telefono))
+        
+        if not updates:
+            return False, "No hay datos para actualizar"
+        
+        params.append(paciente_id)
+        
+        query = f"""
+            UPDATE pacientes
+            SET {', '.join(updates)}
+            WHERE id = %s
+        """
+        campos = [campo for campo, valor in (('nombre', nombre), ('telefono', telefono)) if valor]
+        detalles = f"Datos modificados: {', '.join(campos)}"
+        
+        def unidad_trabajo(cursor):
+            establecer_contexto_auditoria(cursor, usuario, ip_address, tabla='pacientes',
+                                          accion='UPDATE', detalles=detalles)
+            cursor.execute(query, params)
+            
+            # Mantener el índice de búsqueda en la misma transacción
+            if nombre:
+                guardar_tokens_nombre(cursor, paciente_id, nombre)
+            
+            registrar_auditoria(cursor, 'pacientes', paciente_id, 'UPDATE', usuario,
+                                detalles, ip_address)
+        
         try:
-            with conn.cursor() as cursor:
-                updates = []
-                params = []
-                
-                if nombre:
-                    updates.append("nombre_enc = %s")
-                    params.append(self.db.encriptar(nombre))
-                
-                if telefono:
-                    updates.append("telefono_enc = %s")
-                    params.append(self.db.encriptar(telefono))
-                
-                if not updates:
-                    return False, "No hay datos para actualizar"
-                
-                params.append(paciente_id)
-                
-                query = f"""
-                    UPDATE pacientes
-                    SET {', '.join(updates)}
-                    WHERE id = %s
-                """
-                
-                cursor.execute(query, params)
-                conn.commit()
-                
-                return True, "Paciente actualizado exitosamente"
+            ejecutar_transaccion(unidad_trabajo)
+            cache_pacientes.invalidar(paciente_id)
+            return True, "Paciente actualizado exitosamente"
         except Exception as e:
-            conn.rollback()
             return False, f"Error: {str(e)}"
-        finally:
-            self.db.release_connection(conn)
     
     def cancelar_orden(self, orden_id, usuario, motivo):
         """
         Cancelar una orden (no elimina, marca como cancelada)
         """
-        conn = self.db.get_connection()
+        def unidad_trabajo(cursor):
+            establecer_contexto_auditoria(cursor, usuario, tabla='ordenes', accion='CANCEL',
+                                          detalles=f'Motivo: {motivo}')
+            cursor.execute("""
+                UPDATE ordenes
+                SET estado = 'CANCELADO'
+                WHERE id = %s
+            """, (orden_id,))
+            
+            # Registrar en auditoría
+            registrar_auditoria(cursor, 'ordenes', orden_id, 'CANCEL', usuario, f'Motivo: {motivo}')
+        
         try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    UPDATE ordenes
-                    SET estado = 'CANCELADO'
-                    WHERE id = %s
-                """, (orden_id,))
-                
-                # Registrar en auditoría
-                cursor.execute("""
-                    INSERT INTO auditoria_accesos 
-                    (tabla, registro_id, accion, usuario, detalles)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, ('ordenes', orden_id, 'CANCEL', usuario, f'Motivo: {motivo}'))
-                
-                conn.commit()
-                return True, "Orden cancelada exitosamente"
+            ejecutar_transaccion(unidad_trabajo)
+            return True, "Orden cancelada exitosamente"
         except Exception as e:
-            conn.rollback()
             return False, f"Error: {str(e)}"
-        finally:
-            self.db.release_connection(conn)
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Claves de idempotencia para órdenes y carga de resultados.
+
+El cliente envía una clave única por solicitud (y la misma en cada
+reintento). La primera ejecución guarda su respuesta en
+solicitudes_idempotentes dentro de la misma transacción que el trabajo;
+un reintento la obtiene con una búsqueda por clave primaria.
+"""
+
+import json
+import hashlib
+from database import Database
+from config import IDEMPOTENCIA_CONFIG
+
+db = Database()
+
+
+class ErrorIdempotencia(Exception):
+    """Clave reutilizada para otra operación o con otros datos"""
+
+
+def huella_solicitud(*partes):
+    """SHA-256 de los parámetros: detecta una clave reutilizada con otros datos"""
+    contenido = json.dumps(partes, default=str, sort_keys=True)
+    return hashlib.sha256(contenido.encode()).digest()
+
+
+def _respuesta_previa(fila, operacion, huella):
+    operacion_previa, huella_previa, respuesta = fila
+    if operacion_previa != operacion or bytes(huella_previa) != huella:
+        raise ErrorIdempotencia("Clave de idempotencia reutilizada con otros datos")
+    return respuesta
+
+
+def reclamar_clave(cursor, clave, operacion, huella, ttl=None):
+    """
+    Dentro de la transacción de la operación:
+    - Si la clave ya se procesó, retorna la respuesta guardada.
+    - Si no, la registra (bloqueándola hasta el COMMIT) y retorna None:
+      el llamador hace el trabajo y luego llama a guardar_respuesta().
+    Si otra transacción procesa la misma clave en paralelo, el INSERT
+    espera a que termine y se devuelve su respuesta.
+    """
+    ttl = IDEMPOTENCIA_CONFIG['ttl'] if ttl is None else ttl
+
+    # Camino rápido para reintentos: una búsqueda por clave primaria
+    cursor.execute("""
+        SELECT operacion, huella, respuesta
+        FROM solicitudes_idempotentes
+        WHERE clave = %s AND expira > CURRENT_TIMESTAMP
+    """, (clave,))
+    fila = cursor.fetchone()
+    if fila is not None:
+        return _respuesta_previa(fila, operacion, huella)
+
+    # Una clave expirada pendiente de limpieza se reutiliza
+    cursor.execute("""
+        INSERT INTO solicitudes_idempotentes (clave, operacion, huella, expira)
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+        ON CONFLICT (clave) DO UPDATE
+        SET operacion = EXCLUDED.operacion,
+            huella = EXCLUDED.huella,
+            respuesta = NULL,
+            creada = CURRENT_TIMESTAMP,
+            expira = EXCLUDED.expira
+        WHERE solicitudes_idempotentes.expira <= CURRENT_TIMESTAMP
+        RETURNING clave
+    """, (clave, operacion, huella, ttl))
+    if cursor.fetchone() is not None:
+        return None
+
+    # La registró otra transacción que ya confirmó
+    cursor.execute("""
+        SELECT operacion, huella, respuesta
+        FROM solicitudes_idempotentes
+        WHERE clave = %s
+    """, (clave,))
+    return _respuesta_previa(cursor.fetchone(), operacion, huella)
+
+
+def guardar_respuesta(cursor, clave, respuesta):
+    """Guardar la respuesta de la operación (misma transacción que el trabajo)"""
+    cursor.execute("""
+        UPDATE solicitudes_idempotentes
+        SET respuesta = %s
+        WHERE clave = %s
+    """, (json.dumps(respuesta), clave))
+
+
+def limpiar_expiradas(lote=None):
+    """Borrar claves expiradas en lotes cortos; retorna cuántas se borraron"""
+    lote = lote or IDEMPOTENCIA_CONFIG['lote_limpieza']
+    borradas = 0
+
+    conn = db.get_connection()
+    try:
+        while True:
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        DELETE FROM solicitudes_idempotentes
+                        WHERE clave IN (
+                            SELECT clave FROM solicitudes_idempotentes
+                            WHERE expira <= CURRENT_TIMESTAMP
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                    """, (lote,))
+                    filas = cursor.rowcount
+            borradas += filas
+            if filas < lote:
+                return borradas
+    finally:
+        db.release_connection(conn)
+
+
+if __name__ == "__main__":
+    # Programar periódicamente (cron) para mantener la tabla pequeña
+    print(f"Claves de idempotencia expiradas borradas: {limpiar_expiradas()}")
@@ -0,0 +1,211 @@
+"""
+Índices ciegos para buscar pacientes sin desencriptar toda la tabla
+"""
+
+import unicodedata
+from psycopg2.extras import execute_values
+from database import Database
+from auditoria import establecer_contexto_auditoria, registrar_auditoria_lote
+
+db = Database()
+
+# Longitud de los n-gramas indexados y bytes conservados de cada HMAC.
+# Un falso positivo solo cuesta una desencriptación extra: el resultado
+# siempre se verifica contra el nombre real.
+TAMANO_NGRAMA = 3
+BYTES_TOKEN = 8
+
+
+def normalizar_texto(texto):
+    """Minúsculas, sin tildes y solo caracteres alfanuméricos y espacios"""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in texto).split())
+
+
+def _ngramas(palabra):
+    if len(palabra) < TAMANO_NGRAMA:
+        return {palabra}
+    return {palabra[i:i + TAMANO_NGRAMA] for i in range(len(palabra) - TAMANO_NGRAMA + 1)}
+
+
+def _hash_token(token):
+    return db.indice_ciego(f"nombre:{token}")[:BYTES_TOKEN]
+
+
+def tokens_nombre(nombre):
+    """Hashes de los n-gramas de cada palabra del nombre (para indexar)"""
+    tokens = set()
+    for palabra in normalizar_texto(nombre).split():
+        tokens |= _ngramas(palabra)
+    return {_hash_token(t) for t in tokens}
+
+
+def tokens_consulta(texto):
+    """
+    Hashes que debe tener todo paciente que coincida con la búsqueda.
+    Las palabras más cortas que un n-grama no restringen (se verifican
+    al desencriptar).
+    """
+    tokens = set()
+    for palabra in normalizar_texto(texto).split():
+        if len(palabra) >= TAMANO_NGRAMA:
+            tokens |= _ngramas(palabra)
+    return {_hash_token(t) for t in tokens}
+
+
+def guardar_tokens_nombre(cursor, paciente_id, nombre):
+    """
+    Reemplazar los tokens de búsqueda de un paciente.
+    Se ejecuta dentro de la transacción que inserta o modifica el nombre.
+    """
+    cursor.execute("DELETE FROM pacientes_nombre_tokens WHERE paciente_id = %s", (paciente_id,))
+    execute_values(cursor, """
+        INSERT INTO pacientes_nombre_tokens (paciente_id, token_hash)
+        VALUES %s
+    """, [(paciente_id, t) for t in tokens_nombre(nombre)])
+
+
+# Usuario de sistema con el que se auditan los backfills
+USUARIO_BACKFILL = 'indices_busqueda'
+DETALLES_BACKFILL_DNI = 'Backfill del índice ciego de DNI'
+
+
+def backfill_indice_dni(lote=500):
+    """
+    Completar dni_hash de los pacientes registrados antes del índice ciego.
+    Recorre la tabla por id (keyset) y confirma cada lote por separado.
+    
+    Returns:
+        tuple: (actualizados, ids_duplicados)
+    """
+    actualizados = 0
+    duplicados = []
+    ultimo_id = 0
+    
+    conn = db.get_connection()
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, dni_enc
+                    FROM pacientes
+                    WHERE dni_hash IS NULL AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (ultimo_id, lote))
+                
+                filas = cursor.fetchall()
+                if not filas:
+                    break
+                
+                ultimo_id = filas[-1][0]
+                
+                # El trigger audita el UPDATE con un usuario de sistema
+                establecer_contexto_auditoria(cursor, USUARIO_BACKFILL, tabla='pacientes',
+                                              accion='UPDATE', detalles=DETALLES_BACKFILL_DNI)
+                
+                # Descartar DNIs repetidos dentro del mismo lote
+                valores = []
+                vistos = set()
+                for paciente_id, dni_enc in filas:
+                    dni_hash = db.indice_ciego(db.desencriptar(dni_enc))
+                    if dni_hash in vistos:
+                        duplicados.append(paciente_id)
+                        continue
+                    vistos.add(dni_hash)
+                    valores.append((paciente_id, dni_hash))
+                
+                # Los que ya existen en la tabla se reportan como duplicados
+                filas_actualizadas = execute_values(cursor, """
+                    UPDATE pacientes p
+                    SET dni_hash = v.dni_hash
+                    FROM (VALUES %s) AS v(id, dni_hash)
+                    WHERE p.id = v.id
+                    AND NOT EXISTS (
+                        SELECT 1 FROM pacientes p2 WHERE p2.dni_hash = v.dni_hash
+                    )
+                    RETURNING p.id
+                """, valores, fetch=True)
+                
+                ids_actualizados = {fila[0] for fila in filas_actualizadas}
+                registrar_auditoria_lote(cursor, [
+                    ('pacientes', pid, 'UPDATE', USUARIO_BACKFILL, DETALLES_BACKFILL_DNI, None)
+                    for pid in sorted(ids_actualizados)
+                ])
+                duplicados.extend(pid for pid, _ in valores if pid not in ids_actualizados)
+                actualizados += len(ids_actualizados)
+            
+            conn.commit()
+        
+        return actualizados, duplicados
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_connection(conn)
+
+
+def backfill_tokens_nombre(lote=500):
+    """
+    Generar tokens de nombre para los pacientes que aún no los tienen
+    
+    Returns:
+        int: pacientes indexados
+    """
+    indexados = 0
+    ultimo_id = 0
+    
+    conn = db.get_connection()
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT p.id, p.nombre_enc
+                    FROM pacientes p
+                    WHERE p.id > %s
+                    AND NOT EXISTS (
+                        SELECT 1 FROM pacientes_nombre_tokens t WHERE t.paciente_id = p.id
+                    )
+                    ORDER BY p.id
+                    LIMIT %s
+                """, (ultimo_id, lote))
+                
+                filas = cursor.fetchall()
+                if not filas:
+                    break
+                
+                ultimo_id = filas[-1][0]
+                
+                valores = []
+                for paciente_id, nombre_enc in filas:
+                    nombre = db.desencriptar(nombre_enc)
+                    valores.extend((paciente_id, t) for t in tokens_nombre(nombre))
+                
+                execute_values(cursor, """
+                    INSERT INTO pacientes_nombre_tokens (paciente_id, token_hash)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                """, valores)
+                indexados += len(filas)
+            
+            conn.commit()
+        
+        return indexados
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        db.release_connection(conn)
+
+
+if __name__ == '__main__':
+    print("Completando índice ciego de DNI...")
+    actualizados, duplicados = backfill_indice_dni()
+    print(f"✓ Pacientes actualizados: {actualizados}")
+    if duplicados:
+        print(f"DNI duplicado en pacientes (revisar manualmente): {duplicados}")
+    
+    print("\nGenerando índice de búsqueda por nombre...")
+    indexados = backfill_tokens_nombre()
+    print(f"✓ Pacientes indexados: {indexados}")
@@ -3,11 +3,12 @@ Script para inserción masiva de datos de prueba
 Genera miles de registros para testing de optimización
 """
 
-import psycopg2
 from datetime import datetime, timedelta
 import random
+from itertools import islice
 from database import Database
-from config import DB_CONFIG
+from indices_busqueda import guardar_tokens_nombre
+from auditoria import establecer_contexto_auditoria
 
 # Nombres y apellidos para generar datos aleatorios
 NOMBRES = [
@@ -25,6 +26,10 @@ APELLIDOS = [
     "Mendoza", "Castillo", "Vargas", "Romero", "Álvarez", "Medina", "Rojas"
 ]
 
+# Usuario de sistema con el que el trigger audita los datos generados
+USUARIO_CARGA = 'carga_masiva'
+DETALLES_CARGA = 'Datos de prueba generados por insert_massive_data.py'
+
 def generar_nombre_completo():
     """Genera un nombre completo aleatorio"""
     nombre = random.choice(NOMBRES)
@@ -53,8 +58,8 @@ class MassiveDataInserter:
         self.cursor = None
         
     def conectar(self):
-        """Establecer conexión directa sin pool"""
-        self.conn = psycopg2.connect(**DB_CONFIG)
+        """Tomar una conexión del pool compartido para toda la sesión de carga"""
+        self.conn = self.db.get_connection()
         self.cursor = self.conn.cursor()
         print("✓ Conexión establecida")
     
@@ -63,7 +68,7 @@ class MassiveDataInserter:
         if self.cursor:
             self.cursor.close()
         if self.conn:
-            self.conn.close()
+            self.db.release_connection(self.conn)
         print("✓ Conexión cerrada")
     
     def limpiar_datos(self):
@@ -72,6 +77,7 @@ class MassiveDataInserter:
         try:
             self.cursor.execute("TRUNCATE TABLE auditoria_accesos RESTART IDENTITY CASCADE;")
             self.cursor.execute("TRUNCATE TABLE resultados RESTART IDENTITY CASCADE;")
+            self.cursor.execute("TRUNCATE TABLE estadisticas_diarias, sketches_diarios;")
             self.cursor.execute("TRUNCATE TABLE ordenes RESTART IDENTITY CASCADE;")
             self.cursor.execute("TRUNCATE TABLE pacientes RESTART IDENTITY CASCADE;")
             self.conn.commit()
@@ -91,39 +97,46 @@ class MassiveDataInserter:
         insertados = 0
         errores = 0
         
-        # Usar transacciones por lotes de 100
-        lote_size = 100
+        # Usar transacciones por lotes de 1000 (la encriptación del lote
+        # completo se reparte entre varios procesos)
+        lote_size = 1000
         
         for i in range(0, cantidad, lote_size):
             try:
                 self.cursor.execute("BEGIN")
+                establecer_contexto_auditoria(self.cursor, USUARIO_CARGA, tabla='pacientes',
+                                              detalles=DETALLES_CARGA)
                 
                 lote_actual = min(lote_size, cantidad - i)
                 
+                nombres = [generar_nombre_completo() for _ in range(lote_actual)]
+                dnis = [generar_dni() for _ in range(lote_actual)]
+                telefonos = [generar_telefono() for _ in range(lote_actual)]
+                
+                # Encriptar datos sensibles del lote en una sola llamada
+                cifrados = self.db.encriptar_lote(nombres + dnis + telefonos)
+                nombres_enc = cifrados[:lote_actual]
+                dnis_enc = cifrados[lote_actual:2 * lote_actual]
+                telefonos_enc = cifrados[2 * lote_actual:]
+                
                 for j in range(lote_actual):
-                    nombre = generar_nombre_completo()
-                    dni = generar_dni()
-                    fecha_nac = generar_fecha_nacimiento()
-                    telefono = generar_telefono()
+                    dni_hash = self.db.indice_ciego(dnis[j])
                     
-                    # Encriptar datos sensibles
-                    nombre_enc = self.db.encriptar(nombre)
-                    dni_enc = self.db.encriptar(dni)
-                    tel_enc = self.db.encriptar(telefono)
+                    # DNI duplicado (mismo índice ciego): se omite sin abortar el lote
+                    self.cursor.execute("""
+                        INSERT INTO pacientes (nombre_enc, dni_enc, dni_hash, fecha_nacimiento, telefono_enc, created_at)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (dni_hash) DO NOTHING
+                        RETURNING id
+                    """, (nombres_enc[j], dnis_enc[j], dni_hash, generar_fecha_nacimiento(),
+                          telefonos_enc[j], datetime.now() - timedelta(days=random.randint(0, 730))))
                     
-                    try:
-                        self.cursor.execute("""
-                            INSERT INTO pacientes (nombre_enc, dni_enc, fecha_nacimiento, telefono_enc, created_at)
-                            VALUES (%s, %s, %s, %s, %s)
-                        """, (nombre_enc, dni_enc, fecha_nac, tel_enc, 
-                              datetime.now() - timedelta(days=random.randint(0, 730))))
-                        
+                    fila = self.cursor.fetchone()
+                    if fila:
+                        guardar_tokens_nombre(self.cursor, fila[0], nombres[j])
                         insertados += 1
-                        
-                    except psycopg2.IntegrityError:
-                        # DNI duplicado, continuar
+                    else:
                         errores += 1
-                        continue
                 
                 self.cursor.execute("COMMIT")
                 
@@ -173,6 +186,8 @@ class MassiveDataInserter:
         for i in range(0, cantidad, lote_size):
             try:
                 self.cursor.execute("BEGIN")
+                establecer_contexto_auditoria(self.cursor, USUARIO_CARGA, tabla='ordenes',
+                                              detalles=DETALLES_CARGA)
                 
                 lote_actual = min(lote_size, cantidad - i)
                 
@@ -235,6 +250,14 @@ class MassiveDataInserter:
         
         cantidad_a_completar = int(total_pendientes * porcentaje_completado / 100)
         
+        # La auditoría histórica (hasta 300 días atrás) va a particiones
+        # mensuales propias, no a la partición por defecto. Se confirman
+        # aparte: si un lote de la carga falla, su ROLLBACK no las deshace
+        self.cursor.execute("""
+            SELECT crear_particiones_auditoria((CURRENT_DATE - INTERVAL '300 days')::date, CURRENT_DATE)
+        """)
+        self.conn.commit()
+        
         print(f"  Resultados pendientes: {total_pendientes}")
         print(f"  Se completarán: {cantidad_a_completar}")
         
@@ -246,25 +269,29 @@ class MassiveDataInserter:
         completados = 0
         fuera_rango = 0
         
-        # Obtener IDs de resultados pendientes
-        self.cursor.execute("""
+        usuarios = ["laboratorista1", "laboratorista2", "laboratorista3"]
+        
+        lote_size = 1000
+        
+        # IDs de resultados pendientes: se leen por lotes con un cursor del
+        # servidor (otra conexión del pool) en lugar de cargarlos todos
+        resultados_pendientes = self.db.iterar_consulta("""
             SELECT id, tipo_analisis_id 
             FROM resultados 
             WHERE valor IS NULL 
             LIMIT %s
-        """, (cantidad_a_completar,))
-        
-        resultados_pendientes = self.cursor.fetchall()
+        """, (cantidad_a_completar,), itersize=lote_size, nombre='resultados_pendientes',
+            con_nombres=False)
         
-        usuarios = ["laboratorista1", "laboratorista2", "laboratorista3"]
-        
-        lote_size = 1000
-        
-        for i in range(0, len(resultados_pendientes), lote_size):
+        for i in range(0, cantidad_a_completar, lote_size):
+            lote = list(islice(resultados_pendientes, lote_size))
+            if not lote:
+                break
             try:
                 self.cursor.execute("BEGIN")
-                
-                lote = resultados_pendientes[i:i+lote_size]
+                # Esta carga escribe su propia auditoría (con fechas
+                # históricas): el trigger no debe duplicarla
+                establecer_contexto_auditoria(self.cursor, USUARIO_CARGA, estrategia='aplicacion')
                 
                 for resultado_id, tipo_id in lote:
                     valor_min, valor_max = rangos.get(tipo_id, (0, 100))
@@ -311,14 +338,20 @@ class MassiveDataInserter:
                 self.cursor.execute("COMMIT")
                 
                 if (i + len(lote)) % 5000 == 0:
-                    print(f"  Progreso: {i + len(lote)}/{len(resultados_pendientes)} resultados")
+                    print(f"  Progreso: {i + len(lote)}/{cantidad_a_completar} resultados")
                     
             except Exception as e:
                 self.cursor.execute("ROLLBACK")
                 print(f"Error en lote {i}: {e}")
         
+        # Devolver al pool la conexión del cursor aunque quedaran filas
+        resultados_pendientes.close()
+        
         # Actualizar estados de órdenes
         print("  Actualizando estados de órdenes...")
+        self.cursor.execute("BEGIN")
+        establecer_contexto_auditoria(self.cursor, USUARIO_CARGA, tabla='ordenes',
+                                      detalles='Orden completada por la carga masiva')
         self.cursor.execute("""
             UPDATE ordenes
             SET estado = 'COMPLETADO'
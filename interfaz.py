@@ -1,9 +1,11 @@
+import uuid
 import tkinter as tk
 from tkinter import ttk, messagebox
 from tkinter import filedialog
 from datetime import datetime, timedelta
 from transacciones import *
 from estadisticas import *
+from database import Database
 
 class ClinicalLabManager:
     def __init__(self):
@@ -12,9 +14,23 @@ class ClinicalLabManager:
         self.root.geometry("1000x700")
         
         self.usuario_actual = "admin"  # En producción: sistema de login
+        self.db = Database()  # Pool compartido por toda la aplicación
+        # Claves de idempotencia de los envíos pendientes por formulario
+        self.solicitudes_pendientes = {}
         
         self.crear_interfaz()
     
+    def clave_solicitud(self, formulario, contenido):
+        """
+        Misma clave mientras se reintenta el mismo envío (doble clic, error
+        de red); una nueva si cambian los datos o tras un envío exitoso
+        """
+        pendiente = self.solicitudes_pendientes.get(formulario)
+        if pendiente is None or pendiente[0] != contenido:
+            pendiente = (contenido, uuid.uuid4().hex)
+            self.solicitudes_pendientes[formulario] = pendiente
+        return pendiente[1]
+    
     def crear_interfaz(self):
         # Tabs principales
         notebook = ttk.Notebook(self.root)
@@ -145,56 +161,34 @@ class ClinicalLabManager:
     
     def buscar_paciente(self):
         """Buscar y mostrar datos de un paciente"""
+        from funcionalidades_extra import FuncionalidadesExtra
+        extra = FuncionalidadesExtra()
+        
         try:
             paciente_id = int(self.entry_buscar_id.get())
             
-            from database import Database
-            db = Database()
-            conn = db.get_connection()
+            # REQUISITO 3: Datos desencriptados (con caché por sesión)
+            paciente = extra.obtener_paciente(paciente_id, usuario=self.usuario_actual)
             
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute("""
-                        SELECT id, nombre_enc, dni_enc, fecha_nacimiento, telefono_enc, created_at
-                        FROM pacientes
-                        WHERE id = %s
-                    """, (paciente_id,))
-                    
-                    resultado = cursor.fetchone()
-                    
-                    if resultado:
-                        # REQUISITO 3: Desencriptar datos sensibles
-                        id_pac, nombre_enc, dni_enc, fecha_nac, tel_enc, created = resultado
-                        
-                        # Convertir memoryview a bytes si es necesario
-                        nombre_enc = bytes(nombre_enc) if isinstance(nombre_enc, memoryview) else nombre_enc
-                        dni_enc = bytes(dni_enc) if isinstance(dni_enc, memoryview) else dni_enc
-                        tel_enc = bytes(tel_enc) if tel_enc and isinstance(tel_enc, memoryview) else tel_enc
-                        
-                        nombre = db.desencriptar(nombre_enc)
-                        dni = db.desencriptar(dni_enc)
-                        telefono = db.desencriptar(tel_enc) if tel_enc else "N/A"
-                        
-                        texto = f"""
+            if paciente:
+                texto = f"""
     PACIENTE ENCONTRADO
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-    ID: {id_pac}
-    Nombre: {nombre}
-    DNI: {dni}
-    Fecha de Nacimiento: {fecha_nac}
-    Teléfono: {telefono}
-    Registrado: {created}
+    ID: {paciente['id']}
+    Nombre: {paciente['nombre']}
+    DNI: {paciente['dni']}
+    Fecha de Nacimiento: {paciente['fecha_nacimiento']}
+    Teléfono: {paciente['telefono'] or "N/A"}
+    Registrado: {paciente['created_at']}
     ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-                        """
-                        
-                        self.text_resultado_paciente.config(state='normal')
-                        self.text_resultado_paciente.delete(1.0, tk.END)
-                        self.text_resultado_paciente.insert(1.0, texto)
-                        self.text_resultado_paciente.config(state='disabled')
-                    else:
-                        messagebox.showinfo("No encontrado", f"No existe paciente con ID {paciente_id}")
-            finally:
-                db.release_connection(conn)
+                """
+                
+                self.text_resultado_paciente.config(state='normal')
+                self.text_resultado_paciente.delete(1.0, tk.END)
+                self.text_resultado_paciente.insert(1.0, texto)
+                self.text_resultado_paciente.config(state='disabled')
+            else:
+                messagebox.showinfo("No encontrado", f"No existe paciente con ID {paciente_id}")
                 
         except ValueError:
             messagebox.showerror("Error", "ID debe ser un número")
@@ -292,11 +286,14 @@ class ClinicalLabManager:
                 return
             
             # REQUISITO 1: Transacción para registrar orden
+            clave = self.clave_solicitud('orden', (paciente_id, tuple(sorted(analisis_seleccionados))))
             orden_id, mensaje, ids_resultados = registrar_orden_con_analisis(
-                paciente_id, analisis_seleccionados, self.usuario_actual
+                paciente_id, analisis_seleccionados, self.usuario_actual,
+                clave_idempotencia=clave
             )
             
             if orden_id:
+                self.solicitudes_pendientes.pop('orden', None)
                 # Mostrar IDs de resultados creados
                 texto_ids = f"Orden #{orden_id} - IDs de Resultados creados:\n"
                 texto_ids += ", ".join(str(id_res) for id_res in ids_resultados)
@@ -327,8 +324,7 @@ class ClinicalLabManager:
     
     def actualizar_ordenes_recientes(self):
         """Mostrar las últimas órdenes registradas"""
-        from database import Database
-        db = Database()
+        db = self.db
         conn = db.get_connection()
         
         try:
@@ -429,8 +425,7 @@ class ClinicalLabManager:
         try:
             resultado_id = int(self.entry_resultado_id.get())
             
-            from database import Database
-            db = Database()
+            db = self.db
             conn = db.get_connection()
             
             try:
@@ -465,11 +460,13 @@ class ClinicalLabManager:
             valor = float(self.entry_valor.get())
             
             # REQUISITO 1 y 5: Transacción con validación transaccional
+            clave = self.clave_solicitud('resultado', (resultado_id, valor))
             success, fuera_rango, mensaje = cargar_resultado_con_validacion(
-                resultado_id, valor, self.usuario_actual
+                resultado_id, valor, self.usuario_actual, clave_idempotencia=clave
             )
             
             if success:
+                self.solicitudes_pendientes.pop('resultado', None)
                 if fuera_rango:
                     self.label_alerta.config(
                         text="ALERTA: VALOR FUERA DE RANGO NORMAL",
@@ -508,8 +505,7 @@ class ClinicalLabManager:
         for item in self.tree_pendientes.get_children():
             self.tree_pendientes.delete(item)
         
-        from database import Database
-        db = Database()
+        db = self.db
         conn = db.get_connection()
         
         try:
@@ -557,6 +553,13 @@ class ClinicalLabManager:
         self.combo_tipo_analisis = ttk.Combobox(frame_filtros, width=40, state='readonly')
         self.combo_tipo_analisis.grid(row=1, column=1, columnspan=3, padx=5, pady=5, sticky='ew')
         
+        # Intervalo de la serie temporal del gráfico
+        ttk.Label(frame_filtros, text="Intervalo:").grid(row=2, column=0, padx=5, pady=5)
+        self.combo_intervalo = ttk.Combobox(frame_filtros, width=12, state='readonly',
+                                            values=['dia', 'semana', 'mes', 'hora'])
+        self.combo_intervalo.current(0)
+        self.combo_intervalo.grid(row=2, column=1, padx=5, pady=5, sticky='w')
+        
         ttk.Button(
             frame_filtros,
             text="Generar Estadísticas",
@@ -566,13 +569,21 @@ class ClinicalLabManager:
         # Cargar tipos de análisis en el combo
         self.cargar_tipos_analisis_combo()
         
+        # Gráfico de tendencia: barras = cantidad, línea = % fuera de rango
+        self.canvas_tendencia = tk.Canvas(frame, height=180, bg='white', highlightthickness=1,
+                                          highlightbackground='#cccccc')
+        self.canvas_tendencia.pack(fill='x', pady=5)
+        self.canvas_tendencia.bind('<Configure>', lambda e: self.dibujar_tendencia())
+        self.serie_tendencia = []
+        
         # Treeview para estadísticas
-        columns = ('Análisis', 'Total', 'Promedio', 'Mínimo', 'Máximo', 'Fuera Rango', '% Fuera')
-        self.tree_stats = ttk.Treeview(frame, columns=columns, show='headings', height=15)
+        columns = ('Análisis', 'Total', 'Promedio', 'Mínimo', 'Máximo', 'Fuera Rango', '% Fuera',
+                   'P5', 'Mediana', 'P95')
+        self.tree_stats = ttk.Treeview(frame, columns=columns, show='headings', height=10)
         
         for col in columns:
             self.tree_stats.heading(col, text=col)
-            self.tree_stats.column(col, width=130)
+            self.tree_stats.column(col, width=100)
         
         scrollbar = ttk.Scrollbar(frame, orient='vertical', command=self.tree_stats.yview)
         self.tree_stats.configure(yscrollcommand=scrollbar.set)
@@ -608,11 +619,63 @@ class ClinicalLabManager:
         except Exception as e:
             messagebox.showerror("Error", f"Error al cargar tipos de análisis: {str(e)}")
 
+    def dibujar_tendencia(self):
+        """Dibujar self.serie_tendencia en el canvas (sin consultar la base)"""
+        canvas = self.canvas_tendencia
+        canvas.delete('all')
+        serie = self.serie_tendencia
+        if not serie:
+            return
+        
+        ancho = max(canvas.winfo_width(), 200)
+        alto = max(canvas.winfo_height(), 100)
+        izquierda, derecha, arriba, abajo = 50, 50, 20, 25
+        area_ancho = ancho - izquierda - derecha
+        area_alto = alto - arriba - abajo
+        base = arriba + area_alto
+        
+        maximo = max(cantidad for _, cantidad, _, _ in serie) or 1
+        paso = area_ancho / len(serie)
+        
+        # Ejes: cantidad a la izquierda, % fuera de rango a la derecha
+        canvas.create_line(izquierda, base, ancho - derecha, base, fill='#888888')
+        canvas.create_text(izquierda - 5, arriba, text=str(maximo), anchor='e', font=('Arial', 8))
+        canvas.create_text(izquierda - 5, base, text='0', anchor='e', font=('Arial', 8))
+        canvas.create_text(ancho - derecha + 5, arriba, text='100%', anchor='w',
+                           font=('Arial', 8), fill='#c0392b')
+        canvas.create_text(ancho - derecha + 5, base, text='0%', anchor='w',
+                           font=('Arial', 8), fill='#c0392b')
+        
+        puntos = []
+        for i, (momento, cantidad, _, porcentaje) in enumerate(serie):
+            x = izquierda + i * paso
+            if cantidad:
+                canvas.create_rectangle(x + paso * 0.1, base - area_alto * cantidad / maximo,
+                                        x + paso * 0.9, base, fill='#5b8def', outline='')
+            if porcentaje is not None:
+                puntos.extend((x + paso / 2, base - area_alto * porcentaje / 100))
+        
+        if len(puntos) >= 4:
+            canvas.create_line(*puntos, fill='#c0392b', width=2)
+        elif puntos:
+            canvas.create_oval(puntos[0] - 2, puntos[1] - 2, puntos[0] + 2, puntos[1] + 2,
+                               fill='#c0392b', outline='')
+        
+        formato = '%Y-%m-%d %H:00' if self.combo_intervalo.get() == 'hora' else '%Y-%m-%d'
+        canvas.create_text(izquierda, base + 12, text=serie[0][0].strftime(formato),
+                           anchor='w', font=('Arial', 8))
+        canvas.create_text(ancho - derecha, base + 12, text=serie[-1][0].strftime(formato),
+                           anchor='e', font=('Arial', 8))
+        canvas.create_text(ancho / 2, base + 12, anchor='center', font=('Arial', 8),
+                           text="Cantidad (barras) · % fuera de rango (línea)")
+    
     def mostrar_estadisticas(self, mostrar_mensaje=True):
         """REQUISITO 6: Mostrar estadísticas optimizadas por período y tipo"""
-        # Limpiar tabla
+        # Limpiar tabla y gráfico
         for item in self.tree_stats.get_children():
             self.tree_stats.delete(item)
+        self.serie_tendencia = []
+        self.dibujar_tendencia()
         
         try:
             fecha_desde = self.entry_fecha_desde.get()
@@ -639,10 +702,17 @@ class ClinicalLabManager:
             tipo_analisis_id = self.tipos_analisis_map.get(seleccion)
             
             # REQUISITO 6: Consulta optimizada de estadísticas
-            from estadisticas import obtener_estadisticas_periodo_filtradas
+            from estadisticas import (obtener_estadisticas_periodo_filtradas, obtener_percentiles_periodo,
+                                      obtener_serie_temporal)
             estadisticas = obtener_estadisticas_periodo_filtradas(
                 fecha_desde, fecha_hasta, tipo_analisis_id
             )
+            # Percentiles aproximados (error relativo <= 1 %)
+            percentiles = {
+                nombre: valores for nombre, _, *valores in obtener_percentiles_periodo(
+                    fecha_desde, fecha_hasta, tipo_analisis_id
+                )
+            }
             
             if not estadisticas:
                 if mostrar_mensaje:
@@ -650,7 +720,14 @@ class ClinicalLabManager:
                 return
             
             for row in estadisticas:
-                self.tree_stats.insert('', 'end', values=row)
+                valores = percentiles.get(row[0], ())
+                self.tree_stats.insert('', 'end', values=tuple(row) + tuple(f"~{v:.2f}" for v in valores))
+            
+            # Serie temporal del gráfico: una sola consulta para todo el período
+            self.serie_tendencia = obtener_serie_temporal(
+                fecha_desde, fecha_hasta, tipo_analisis_id, self.combo_intervalo.get()
+            )
+            self.dibujar_tendencia()
             
             # Mostrar mensaje de éxito solo si se solicita
             if mostrar_mensaje:
@@ -670,31 +747,67 @@ class ClinicalLabManager:
         
         ttk.Label(frame, text="AUDITORÍA DE ACCESOS", font=('Arial', 14, 'bold')).pack(pady=10)
         
-        # Frame de búsqueda
+        # Frame de búsqueda (todos los filtros son opcionales)
         frame_buscar = ttk.Frame(frame)
         frame_buscar.pack(pady=10)
         
         ttk.Label(frame_buscar, text="Tabla:").grid(row=0, column=0, padx=5)
         self.combo_tabla_audit = ttk.Combobox(frame_buscar, width=15, state='readonly',
-                                            values=['pacientes', 'ordenes', 'resultados'])
-        self.combo_tabla_audit.current(2)  # Por defecto 'resultados'
+                                            values=['', 'pacientes', 'ordenes', 'resultados'])
+        self.combo_tabla_audit.current(3)  # Por defecto 'resultados'
         self.combo_tabla_audit.grid(row=0, column=1, padx=5)
         
         ttk.Label(frame_buscar, text="ID de Registro:").grid(row=0, column=2, padx=5)
-        self.entry_audit_id = ttk.Entry(frame_buscar, width=20)
+        self.entry_audit_id = ttk.Entry(frame_buscar, width=12)
         self.entry_audit_id.grid(row=0, column=3, padx=5)
         
+        ttk.Label(frame_buscar, text="Usuario:").grid(row=0, column=4, padx=5)
+        self.entry_audit_usuario = ttk.Entry(frame_buscar, width=15)
+        self.entry_audit_usuario.grid(row=0, column=5, padx=5)
+        
+        ttk.Label(frame_buscar, text="Acción:").grid(row=1, column=0, padx=5, pady=5)
+        self.combo_accion_audit = ttk.Combobox(frame_buscar, width=15,
+                                             values=['', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'CANCEL', 'READ'])
+        self.combo_accion_audit.grid(row=1, column=1, padx=5, pady=5)
+        
+        # Un rango de fechas limita la consulta a esas particiones mensuales
+        ttk.Label(frame_buscar, text="Desde (AAAA-MM-DD):").grid(row=1, column=2, padx=5, pady=5)
+        self.entry_audit_desde = ttk.Entry(frame_buscar, width=12)
+        self.entry_audit_desde.grid(row=1, column=3, padx=5, pady=5)
+        
+        ttk.Label(frame_buscar, text="Hasta (AAAA-MM-DD):").grid(row=1, column=4, padx=5, pady=5)
+        self.entry_audit_hasta = ttk.Entry(frame_buscar, width=12)
+        self.entry_audit_hasta.grid(row=1, column=5, padx=5, pady=5)
+        
         ttk.Button(
             frame_buscar,
             text="Consultar Auditoría",
             command=self.consultar_auditoria
-        ).grid(row=0, column=4, padx=10)
+        ).grid(row=0, column=6, rowspan=2, padx=10)
+        
+        # Paginación por clave: solo se carga una página a la vez
+        frame_paginas = ttk.Frame(frame)
+        frame_paginas.pack(side='bottom', fill='x')
+        
+        self.label_audit_total = ttk.Label(frame_paginas, text="")
+        self.label_audit_total.pack(side='left', padx=5)
+        
+        self.btn_audit_mas = ttk.Button(
+            frame_paginas,
+            text="Cargar más",
+            command=self.cargar_mas_auditoria,
+            state='disabled'
+        )
+        self.btn_audit_mas.pack(side='right', padx=5)
+        
+        self.filtros_audit = {}
+        self.cursor_audit = None
         
         # Treeview para auditoría
-        columns = ('Fecha', 'Acción', 'Usuario', 'Detalles', 'IP')
+        columns = ('Fecha', 'Tabla', 'ID', 'Acción', 'Usuario', 'Detalles', 'IP')
         self.tree_audit = ttk.Treeview(frame, columns=columns, show='headings', height=20)
         
-        anchos = [180, 80, 120, 300, 120]
+        anchos = [180, 90, 70, 80, 120, 300, 120]
         for col, ancho in zip(columns, anchos):
             self.tree_audit.heading(col, text=col)
             self.tree_audit.column(col, width=ancho)
@@ -708,30 +821,55 @@ class ClinicalLabManager:
     def consultar_auditoria(self):
         """REQUISITO 4: Consultar trazabilidad completa de accesos"""
         try:
-            tabla = self.combo_tabla_audit.get()
-            registro_id = int(self.entry_audit_id.get())
+            texto_id = self.entry_audit_id.get().strip()
+            texto_desde = self.entry_audit_desde.get().strip()
+            texto_hasta = self.entry_audit_hasta.get().strip()
+            
+            self.filtros_audit = {
+                'tabla': self.combo_tabla_audit.get() or None,
+                'registro_id': int(texto_id) if texto_id else None,
+                'usuario': self.entry_audit_usuario.get().strip() or None,
+                'accion': self.combo_accion_audit.get().strip().upper() or None,
+                'desde': datetime.strptime(texto_desde, '%Y-%m-%d') if texto_desde else None,
+                # Hasta inclusive para el usuario: la consulta usa fecha < hasta
+                'hasta': (datetime.strptime(texto_hasta, '%Y-%m-%d') + timedelta(days=1))
+                         if texto_hasta else None
+            }
+            self.cursor_audit = None
             
             # Limpiar tabla
             for item in self.tree_audit.get_children():
                 self.tree_audit.delete(item)
             
-            from auditoria import consultar_auditoria_tabla
-            registros = consultar_auditoria_tabla(tabla, registro_id)
-            
-            if not registros:
+            if self.cargar_mas_auditoria() == 0:
                 messagebox.showinfo("Sin registros", 
-                    f"No hay auditoría para {tabla} ID {registro_id}")
-                return
-            
-            for row in registros:
-                self.tree_audit.insert('', 'end', values=row)
-                
-            messagebox.showinfo("Éxito", f"Se encontraron {len(registros)} registros de auditoría")
+                    "No hay auditoría con los filtros indicados")
                 
         except ValueError:
-            messagebox.showerror("Error", "ID debe ser un número")
+            messagebox.showerror("Error", "ID debe ser un número y las fechas AAAA-MM-DD")
         except Exception as e:
             messagebox.showerror("Error", f"Error: {str(e)}")
+    
+    def cargar_mas_auditoria(self):
+        """Agregar la página siguiente de auditoría; retorna las filas agregadas"""
+        from auditoria import consultar_auditoria_pagina
+        try:
+            filas, self.cursor_audit = consultar_auditoria_pagina(
+                limite=200, despues=self.cursor_audit, **self.filtros_audit
+            )
+        except Exception as e:
+            messagebox.showerror("Error", f"Error: {str(e)}")
+            return 0
+        
+        for _, fecha, tabla, registro_id, accion, usuario, detalles, ip in filas:
+            self.tree_audit.insert('', 'end',
+                values=(fecha, tabla, registro_id, accion, usuario, detalles, ip))
+        
+        total = len(self.tree_audit.get_children())
+        sufijo = " (hay más)" if self.cursor_audit else ""
+        self.label_audit_total.config(text=f"{total} registros mostrados{sufijo}")
+        self.btn_audit_mas.config(state='normal' if self.cursor_audit else 'disabled')
+        return len(filas)
 
     def crear_tab_administracion(self, parent):
         """TAB EXTRA: Administración del sistema"""
@@ -883,6 +1021,10 @@ class ClinicalLabManager:
         self.entry_buscar_nombre = ttk.Entry(frame_nombre, width=30)
         self.entry_buscar_nombre.pack(side='left', padx=5)
         ttk.Button(frame_nombre, text="Buscar", command=self.buscar_por_nombre).pack(side='left', padx=5)
+        ttk.Button(frame_nombre, text="Siguiente página",
+                command=lambda: self.buscar_por_nombre(siguiente=True)).pack(side='left', padx=5)
+        self.ultimo_id_nombre = 0
+        self.consulta_nombre = None
         
         # Resultados
         self.text_busqueda = tk.Text(frame, height=20, width=80, state='disabled')
@@ -906,7 +1048,7 @@ class ClinicalLabManager:
             messagebox.showwarning("Advertencia", "Ingrese un DNI")
             return
         
-        resultado = extra.buscar_paciente_por_dni(dni)
+        resultado = extra.buscar_paciente_por_dni(dni, usuario=self.usuario_actual)
         
         self.text_busqueda.config(state='normal')
         self.text_busqueda.delete(1.0, tk.END)
@@ -927,8 +1069,8 @@ class ClinicalLabManager:
             self.text_busqueda.insert(1.0, "No se encontró paciente con ese DNI")
         
         self.text_busqueda.config(state='disabled')
-    def buscar_por_nombre(self):
-        """Buscar pacientes por nombre"""
+    def buscar_por_nombre(self, siguiente=False):
+        """Buscar pacientes por nombre (resultados paginados)"""
         from funcionalidades_extra import FuncionalidadesExtra
         extra = FuncionalidadesExtra()
         
@@ -937,21 +1079,41 @@ class ClinicalLabManager:
             messagebox.showwarning("Advertencia", "Ingrese un nombre")
             return
         
-        resultados = extra.buscar_paciente_por_nombre(nombre)
+        # Texto nuevo: la página siguiente no sigue el cursor de otra búsqueda
+        if not siguiente or nombre != self.consulta_nombre:
+            self.ultimo_id_nombre = 0
+            siguiente = False
+        elif self.ultimo_id_nombre is None:
+            messagebox.showinfo("Búsqueda", "No hay más pacientes con ese nombre")
+            return
+        self.consulta_nombre = nombre
+        
+        try:
+            resultados, self.ultimo_id_nombre = extra.buscar_paciente_por_nombre(
+                nombre, desde_id=self.ultimo_id_nombre, usuario=self.usuario_actual
+            )
+        except ValueError as e:
+            messagebox.showwarning("Advertencia", str(e))
+            return
         
         self.text_busqueda.config(state='normal')
         self.text_busqueda.delete(1.0, tk.END)
         
         if resultados:
-            texto = f"RESULTADOS ENCONTRADOS: {len(resultados)}\n"
-            texto += "="*60 + "\n\n"
+            texto = f"RESULTADOS ENCONTRADOS: {len(resultados)}"
+            if siguiente:
+                texto += " (página siguiente)"
+            texto += "\n" + "="*60 + "\n\n"
             
             for pac in resultados:
                 texto += f"ID: {pac['id']} | {pac['nombre']} | DNI: {pac['dni']}\n"
             
             self.text_busqueda.insert(1.0, texto)
         else:
-            self.text_busqueda.insert(1.0, "No se encontraron pacientes con ese nombre")
+            mensaje = "No se encontraron (más) pacientes con ese nombre"
+            if self.ultimo_id_nombre is not None:
+                mensaje += " en este tramo; pulse \"Siguiente página\" para seguir buscando"
+            self.text_busqueda.insert(1.0, mensaje)
         
         self.text_busqueda.config(state='disabled')
 
@@ -962,7 +1124,7 @@ class ClinicalLabManager:
         
         try:
             paciente_id = int(self.entry_historial_id.get())
-            historial = extra.obtener_historial_paciente(paciente_id)
+            historial = extra.obtener_historial_paciente(paciente_id, usuario=self.usuario_actual)
             
             self.text_busqueda.config(state='normal')
             self.text_busqueda.delete(1.0, tk.END)
@@ -1054,7 +1216,8 @@ class ClinicalLabManager:
             if not archivo:  # Usuario canceló
                 return
             
-            success, mensaje = extra.generar_reporte_paciente(paciente_id, archivo)
+            success, mensaje = extra.generar_reporte_paciente(paciente_id, archivo,
+                                                              usuario=self.usuario_actual)
             
             if success:
                 messagebox.showinfo("Éxito", mensaje)
@@ -1245,7 +1408,8 @@ class ClinicalLabManager:
             success, mensaje = extra.modificar_paciente(
                 paciente_id, 
                 nombre if nombre else None, 
-                telefono if telefono else None
+                telefono if telefono else None,
+                usuario=self.usuario_actual
             )
             
             if success:
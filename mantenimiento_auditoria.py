@@ -0,0 +1,156 @@
+"""
+Mantenimiento de las particiones mensuales de auditoria_accesos.
+
+- Crea por adelantado las particiones de los próximos meses (las filas sin
+  partición caen en auditoria_accesos_default y se reubican al crearla).
+- Aplica la retención: los meses anteriores a la ventana se separan de la
+  tabla (DETACH), se exportan a CSV comprimido, se verifica el número de
+  filas del archivo y recién entonces se borra la tabla.
+
+Si se interrumpe, al volver a ejecutarlo retoma las particiones ya
+separadas. Programar una vez al día (cron):
+
+    python mantenimiento_auditoria.py
+"""
+
+import os
+import re
+import csv
+import gzip
+import hashlib
+from datetime import date
+from config import AUDITORIA_CONFIG
+from database import Database
+
+db = Database()
+
+PATRON_PARTICION = re.compile(r'^auditoria_accesos_(\d{4})_(\d{2})$')
+
+
+def _mes_inicio_retencion(meses, hoy=None):
+    """Primer día del mes más antiguo que se conserva"""
+    hoy = hoy or date.today()
+    indice = hoy.year * 12 + hoy.month - 1 - meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def asegurar_particiones(meses_adelante=None):
+    """Crear las particiones del mes actual y los siguientes; retorna cuántas creó"""
+    meses_adelante = AUDITORIA_CONFIG['meses_adelante'] if meses_adelante is None else meses_adelante
+    conn = db.get_connection()
+    try:
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT crear_particiones_auditoria(
+                        CURRENT_DATE, (CURRENT_DATE + %s * INTERVAL '1 month')::date
+                    )
+                """, (meses_adelante,))
+                return cursor.fetchone()[0]
+    finally:
+        db.release_connection(conn)
+
+
+def _particiones_vencidas(cursor, limite):
+    """
+    (nombre, adjunta) de las particiones mensuales anteriores a limite,
+    incluidas las ya separadas por una ejecución interrumpida
+    """
+    cursor.execute("""
+        SELECT c.relname, i.inhparent IS NOT NULL
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        WHERE c.relkind = 'r'
+          AND c.relnamespace = 'public'::regnamespace
+          AND c.relname ~ '^auditoria_accesos_[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+    """)
+    vencidas = []
+    for nombre, adjunta in cursor.fetchall():
+        anio, mes = PATRON_PARTICION.match(nombre).groups()
+        if date(int(anio), int(mes), 1) < limite:
+            vencidas.append((nombre, adjunta))
+    return vencidas
+
+
+def _exportar(conn, nombre, destino):
+    """
+    Exportar la tabla a destino/nombre.csv.gz y verificar el archivo.
+
+    Returns:
+        tuple: (ruta, filas, sha256 del archivo)
+    """
+    os.makedirs(destino, exist_ok=True)
+    ruta = os.path.join(destino, f"{nombre}.csv.gz")
+    temporal = ruta + '.tmp'
+
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM "{nombre}"')
+            filas = cursor.fetchone()[0]
+            with gzip.open(temporal, 'wb') as archivo:
+                cursor.copy_expert(
+                    f'COPY (SELECT * FROM "{nombre}" ORDER BY fecha, id) '
+                    f'TO STDOUT WITH (FORMAT csv, HEADER)',
+                    archivo
+                )
+
+    # Releer el archivo: solo se borra la tabla si el archivo está completo
+    with gzip.open(temporal, 'rt', newline='', encoding='utf-8') as archivo:
+        exportadas = sum(1 for _ in csv.reader(archivo)) - 1
+    if exportadas != filas:
+        os.remove(temporal)
+        raise RuntimeError(f"{nombre}: {exportadas} filas exportadas de {filas}")
+
+    with open(temporal, 'rb') as archivo:
+        huella = hashlib.sha256(archivo.read()).hexdigest()
+        os.fsync(archivo.fileno())
+    os.replace(temporal, ruta)
+    return ruta, filas, huella
+
+
+def aplicar_retencion(meses=None, destino=None, lock_timeout_ms=5000):
+    """
+    Separar, archivar y borrar las particiones fuera de la ventana de retención.
+
+    Returns:
+        list: (particion, ruta, filas, sha256) por cada mes archivado
+    """
+    meses = AUDITORIA_CONFIG['retencion_meses'] if meses is None else meses
+    destino = destino or AUDITORIA_CONFIG['archivo']
+    limite = _mes_inicio_retencion(meses)
+    archivadas = []
+
+    conn = db.get_connection()
+    try:
+        with conn:
+            with conn.cursor() as cursor:
+                vencidas = _particiones_vencidas(cursor, limite)
+
+        for nombre, adjunta in vencidas:
+            if adjunta:
+                # DETACH bloquea brevemente la tabla padre: no esperar
+                # indefinidamente detrás de escrituras largas
+                with conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+                        cursor.execute(f'ALTER TABLE auditoria_accesos DETACH PARTITION "{nombre}"')
+
+            ruta, filas, huella = _exportar(conn, nombre, destino)
+
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE "{nombre}"')
+
+            archivadas.append((nombre, ruta, filas, huella))
+            print(f"  {nombre}: {filas:,} filas archivadas en {ruta}")
+    finally:
+        db.release_connection(conn)
+
+    return archivadas
+
+
+if __name__ == "__main__":
+    print(f"Particiones nuevas de auditoría: {asegurar_particiones()}")
+    archivadas = aplicar_retencion()
+    print(f"Particiones archivadas: {len(archivadas)}")
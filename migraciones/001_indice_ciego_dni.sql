@@ -0,0 +1,10 @@
+-- ============================================
+-- MIGRACIÓN 001: ÍNDICE CIEGO PARA DNI
+-- ============================================
+-- Agrega el HMAC determinista del DNI junto a dni_enc. Después de aplicar
+-- este script ejecutar `python indices_busqueda.py` para completar los
+-- pacientes existentes.
+
+ALTER TABLE pacientes ADD COLUMN IF NOT EXISTS dni_hash BYTEA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_pacientes_dni_hash ON pacientes(dni_hash);
@@ -0,0 +1,14 @@
+-- ============================================
+-- MIGRACIÓN 002: ÍNDICE DE BÚSQUEDA POR NOMBRE
+-- ============================================
+-- Tabla de tokens (HMAC de trigramas) para búsquedas parciales por nombre.
+-- Después de aplicar este script ejecutar `python indices_busqueda.py`.
+
+CREATE TABLE IF NOT EXISTS pacientes_nombre_tokens (
+    paciente_id INTEGER NOT NULL REFERENCES pacientes(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    token_hash BYTEA NOT NULL,
+    PRIMARY KEY (token_hash, paciente_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_nombre_tokens_paciente ON pacientes_nombre_tokens(paciente_id);
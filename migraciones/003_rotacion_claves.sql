@@ -0,0 +1,12 @@
+-- ============================================
+-- MIGRACIÓN 003: PROGRESO DE ROTACIÓN DE CLAVES
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS rotacion_claves_progreso (
+    trabajo VARCHAR(64) PRIMARY KEY,
+    ultimo_id INTEGER NOT NULL DEFAULT 0,
+    filas_rotadas INTEGER NOT NULL DEFAULT 0,
+    completado BOOLEAN NOT NULL DEFAULT FALSE,
+    iniciado TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
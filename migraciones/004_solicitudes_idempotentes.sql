@@ -0,0 +1,16 @@
+-- ============================================
+-- MIGRACIÓN 004: CLAVES DE IDEMPOTENCIA
+-- ============================================
+-- Respuesta de cada solicitud con clave del cliente: un reintento
+-- devuelve los IDs originales en lugar de duplicar órdenes o resultados
+
+CREATE TABLE IF NOT EXISTS solicitudes_idempotentes (
+    clave VARCHAR(100) PRIMARY KEY,
+    operacion VARCHAR(50) NOT NULL,
+    huella BYTEA NOT NULL,
+    respuesta JSONB,
+    creada TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expira TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_solicitudes_expira ON solicitudes_idempotentes(expira);
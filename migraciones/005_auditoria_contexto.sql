@@ -0,0 +1,39 @@
+-- ============================================
+-- MIGRACIÓN 005: AUDITORÍA POR TRIGGER CON CONTEXTO DE LA APLICACIÓN
+-- ============================================
+-- El trigger toma usuario, IP, acción y detalles de ajustes locales a la
+-- transacción (set_config(..., true)) que fija la aplicación. Sin ellos
+-- (psql, scripts) registra CURRENT_USER como antes.
+
+CREATE OR REPLACE FUNCTION registrar_auditoria()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_id INTEGER;
+BEGIN
+    -- Con la estrategia 'aplicacion' la auditoría la escribe la aplicación
+    IF current_setting('clinica.estrategia', true) = 'aplicacion' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        v_id := OLD.id;
+    ELSE
+        v_id := NEW.id;
+    END IF;
+
+    INSERT INTO auditoria_accesos(tabla, registro_id, accion, usuario, detalles, ip_address)
+    VALUES (
+        TG_TABLE_NAME,
+        v_id,
+        COALESCE(NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_accion', true), ''), TG_OP),
+        COALESCE(NULLIF(current_setting('clinica.usuario', true), ''), CURRENT_USER),
+        COALESCE(
+            NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles_por_id', true), '')::jsonb ->> v_id::text,
+            NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles', true), ''),
+            'Cambio automático por trigger'
+        ),
+        NULLIF(current_setting('clinica.ip', true), '')
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
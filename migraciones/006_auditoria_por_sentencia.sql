@@ -0,0 +1,95 @@
+-- ============================================
+-- MIGRACIÓN 006: TRIGGERS DE AUDITORÍA POR SENTENCIA
+-- ============================================
+-- Un trigger por sentencia con tablas de transición escribe todas las
+-- filas de auditoría de un INSERT/UPDATE/DELETE en un solo INSERT ...
+-- SELECT, en lugar de una invocación plpgsql y un INSERT por fila.
+-- La función por fila registrar_auditoria() se conserva (benchmark).
+
+CREATE OR REPLACE FUNCTION registrar_auditoria_sentencia()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_accion TEXT;
+    v_usuario TEXT;
+    v_ip TEXT;
+    v_detalles TEXT;
+    v_detalles_por_id JSONB;
+BEGIN
+    -- Con la estrategia 'aplicacion' la auditoría la escribe la aplicación
+    IF current_setting('clinica.estrategia', true) = 'aplicacion' THEN
+        RETURN NULL;
+    END IF;
+
+    -- El contexto de la aplicación se lee una vez por sentencia
+    v_accion := COALESCE(NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_accion', true), ''), TG_OP);
+    v_usuario := COALESCE(NULLIF(current_setting('clinica.usuario', true), ''), CURRENT_USER);
+    v_ip := NULLIF(current_setting('clinica.ip', true), '');
+    v_detalles := COALESCE(NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles', true), ''),
+                           'Cambio automático por trigger');
+    v_detalles_por_id := NULLIF(current_setting('clinica.' || TG_TABLE_NAME || '_detalles_por_id', true), '')::jsonb;
+
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO auditoria_accesos(tabla, registro_id, accion, usuario, detalles, ip_address)
+        SELECT TG_TABLE_NAME, f.id, v_accion, v_usuario,
+               COALESCE(v_detalles_por_id ->> f.id::text, v_detalles), v_ip
+        FROM filas_viejas f;
+    ELSE
+        INSERT INTO auditoria_accesos(tabla, registro_id, accion, usuario, detalles, ip_address)
+        SELECT TG_TABLE_NAME, f.id, v_accion, v_usuario,
+               COALESCE(v_detalles_por_id ->> f.id::text, v_detalles), v_ip
+        FROM filas_nuevas f;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_auditar_pacientes ON pacientes;
+DROP TRIGGER IF EXISTS trg_auditar_ordenes ON ordenes;
+DROP TRIGGER IF EXISTS trg_auditar_resultados ON resultados;
+
+DROP TRIGGER IF EXISTS trg_auditar_pacientes_insert ON pacientes;
+DROP TRIGGER IF EXISTS trg_auditar_pacientes_update ON pacientes;
+DROP TRIGGER IF EXISTS trg_auditar_pacientes_delete ON pacientes;
+DROP TRIGGER IF EXISTS trg_auditar_ordenes_insert ON ordenes;
+DROP TRIGGER IF EXISTS trg_auditar_ordenes_update ON ordenes;
+DROP TRIGGER IF EXISTS trg_auditar_ordenes_delete ON ordenes;
+DROP TRIGGER IF EXISTS trg_auditar_resultados_insert ON resultados;
+DROP TRIGGER IF EXISTS trg_auditar_resultados_update ON resultados;
+DROP TRIGGER IF EXISTS trg_auditar_resultados_delete ON resultados;
+
+-- Las tablas de transición exigen un trigger por evento
+CREATE TRIGGER trg_auditar_pacientes_insert
+AFTER INSERT ON pacientes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_pacientes_update
+AFTER UPDATE ON pacientes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_pacientes_delete
+AFTER DELETE ON pacientes REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_ordenes_insert
+AFTER INSERT ON ordenes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_ordenes_update
+AFTER UPDATE ON ordenes REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_ordenes_delete
+AFTER DELETE ON ordenes REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_resultados_insert
+AFTER INSERT ON resultados REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_resultados_update
+AFTER UPDATE ON resultados REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
+
+CREATE TRIGGER trg_auditar_resultados_delete
+AFTER DELETE ON resultados REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION registrar_auditoria_sentencia();
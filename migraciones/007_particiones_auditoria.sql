@@ -0,0 +1,107 @@
+-- ============================================
+-- MIGRACIÓN 007: PARTICIONES MENSUALES DE AUDITORÍA
+-- ============================================
+-- Convierte auditoria_accesos en una tabla particionada por mes sobre
+-- fecha. Copia las filas existentes en una sola transacción: en tablas
+-- muy grandes, ejecutarla en una ventana de mantenimiento.
+
+BEGIN;
+
+ALTER TABLE auditoria_accesos RENAME TO auditoria_accesos_anterior;
+ALTER INDEX IF EXISTS auditoria_accesos_pkey RENAME TO auditoria_accesos_anterior_pkey;
+ALTER INDEX IF EXISTS idx_auditoria_fecha RENAME TO idx_auditoria_anterior_fecha;
+ALTER INDEX IF EXISTS idx_auditoria_usuario RENAME TO idx_auditoria_anterior_usuario;
+ALTER INDEX IF EXISTS idx_auditoria_tabla RENAME TO idx_auditoria_anterior_tabla;
+ALTER SEQUENCE IF EXISTS auditoria_accesos_id_seq RENAME TO auditoria_accesos_anterior_id_seq;
+
+CREATE TABLE auditoria_accesos (
+    id BIGSERIAL,
+    tabla VARCHAR(50) NOT NULL,
+    registro_id INTEGER NOT NULL,
+    accion VARCHAR(20) NOT NULL,
+    usuario VARCHAR(50) NOT NULL,
+    fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ip_address VARCHAR(45),
+    detalles TEXT,
+
+    PRIMARY KEY (id, fecha)
+) PARTITION BY RANGE (fecha);
+
+CREATE INDEX idx_auditoria_fecha ON auditoria_accesos(fecha DESC);
+CREATE INDEX idx_auditoria_usuario ON auditoria_accesos(usuario);
+CREATE INDEX idx_auditoria_tabla ON auditoria_accesos(tabla, registro_id);
+
+CREATE TABLE auditoria_accesos_default PARTITION OF auditoria_accesos DEFAULT;
+
+-- Crea (si falta) la partición mensual que contiene p_mes. Las filas de
+-- ese mes que hubieran caído en la partición por defecto se mueven a ella.
+CREATE OR REPLACE FUNCTION crear_particion_auditoria(p_mes DATE)
+RETURNS TEXT AS $$
+DECLARE
+    v_inicio DATE := date_trunc('month', p_mes)::date;
+    v_fin DATE := (date_trunc('month', p_mes) + INTERVAL '1 month')::date;
+    v_nombre TEXT := 'auditoria_accesos_' || to_char(date_trunc('month', p_mes), 'YYYY_MM');
+BEGIN
+    IF to_regclass(v_nombre) IS NOT NULL THEN
+        RETURN v_nombre;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE auditoria_accesos INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        v_nombre
+    );
+    -- El CHECK evita que ATTACH recorra la tabla para validar el rango
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I CHECK (fecha >= %L AND fecha < %L)',
+        v_nombre, v_nombre || '_rango', v_inicio, v_fin
+    );
+    EXECUTE format(
+        'WITH movidas AS (
+             DELETE FROM auditoria_accesos_default
+             WHERE fecha >= %L AND fecha < %L
+             RETURNING *
+         )
+         INSERT INTO %I SELECT * FROM movidas',
+        v_inicio, v_fin, v_nombre
+    );
+    EXECUTE format(
+        'ALTER TABLE auditoria_accesos ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_nombre, v_inicio, v_fin
+    );
+    RETURN v_nombre;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Particiones de todos los meses entre p_desde y p_hasta (inclusive)
+CREATE OR REPLACE FUNCTION crear_particiones_auditoria(p_desde DATE, p_hasta DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    v_mes DATE := date_trunc('month', p_desde)::date;
+    v_creadas INTEGER := 0;
+BEGIN
+    WHILE v_mes <= p_hasta LOOP
+        IF to_regclass('auditoria_accesos_' || to_char(v_mes, 'YYYY_MM')) IS NULL THEN
+            PERFORM crear_particion_auditoria(v_mes);
+            v_creadas := v_creadas + 1;
+        END IF;
+        v_mes := (v_mes + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN v_creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Meses con datos existentes, el actual y los tres siguientes
+SELECT crear_particiones_auditoria(
+    LEAST(COALESCE((SELECT MIN(fecha) FROM auditoria_accesos_anterior), CURRENT_DATE), CURRENT_DATE)::date,
+    (CURRENT_DATE + INTERVAL '3 months')::date
+);
+
+INSERT INTO auditoria_accesos (id, tabla, registro_id, accion, usuario, fecha, ip_address, detalles)
+SELECT id, tabla, registro_id, accion, usuario, COALESCE(fecha, CURRENT_TIMESTAMP), ip_address, detalles
+FROM auditoria_accesos_anterior;
+
+SELECT setval('auditoria_accesos_id_seq', COALESCE((SELECT MAX(id) FROM auditoria_accesos), 0) + 1, false);
+
+DROP TABLE auditoria_accesos_anterior;
+
+COMMIT;
@@ -0,0 +1,21 @@
+-- ============================================
+-- MIGRACIÓN 008: ÍNDICES PARA PAGINACIÓN DE AUDITORÍA
+-- ============================================
+-- Índices compuestos terminados en (fecha DESC, id DESC) para la paginación
+-- por clave y los filtros por usuario y acción. Sobre una tabla
+-- particionada CREATE INDEX no admite CONCURRENTLY y bloquea las
+-- escrituras mientras se construye: ejecutar en una ventana de
+-- mantenimiento.
+
+BEGIN;
+
+DROP INDEX IF EXISTS idx_auditoria_fecha;
+DROP INDEX IF EXISTS idx_auditoria_usuario;
+DROP INDEX IF EXISTS idx_auditoria_tabla;
+
+CREATE INDEX idx_auditoria_fecha ON auditoria_accesos(fecha DESC, id DESC);
+CREATE INDEX idx_auditoria_usuario ON auditoria_accesos(usuario, fecha DESC, id DESC);
+CREATE INDEX idx_auditoria_tabla ON auditoria_accesos(tabla, registro_id, fecha DESC, id DESC);
+CREATE INDEX idx_auditoria_accion ON auditoria_accesos(tabla, accion, fecha DESC, id DESC);
+
+COMMIT;
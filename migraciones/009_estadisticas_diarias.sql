@@ -0,0 +1,192 @@
+-- ============================================
+-- MIGRACIÓN 009: ROLLUP DIARIO DE ESTADÍSTICAS
+-- ============================================
+-- Crea estadisticas_diarias, los triggers que la mantienen y la carga
+-- inicial desde resultados. La carga bloquea las escrituras en
+-- resultados mientras dura (una agregación completa de la tabla).
+
+BEGIN;
+
+LOCK TABLE resultados IN SHARE MODE;
+
+-- Agregados por día y tipo de análisis de los resultados con valor. Los
+-- mantienen los triggers de resultados en la misma transacción; las
+-- estadísticas por período suman días completos desde aquí y solo leen
+-- resultados de los días parciales de los extremos.
+CREATE TABLE estadisticas_diarias (
+    dia DATE NOT NULL,
+    tipo_analisis_id INTEGER NOT NULL REFERENCES tipos_analisis(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    cantidad BIGINT NOT NULL DEFAULT 0,
+    suma NUMERIC NOT NULL DEFAULT 0,
+    suma_cuadrados NUMERIC NOT NULL DEFAULT 0,
+    minimo NUMERIC(10,2),
+    maximo NUMERIC(10,2),
+    fuera_rango BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (dia, tipo_analisis_id)
+);
+
+-- Un cambio en resultados: +1 por cada fila que entra en un (día, tipo)
+-- y -1 por cada fila que sale
+CREATE TYPE cambio_estadistica AS (
+    dia DATE,
+    tipo_analisis_id INTEGER,
+    valor NUMERIC,
+    fuera_rango BOOLEAN,
+    signo INTEGER
+);
+
+CREATE OR REPLACE FUNCTION aplicar_cambios_estadisticas(p_cambios cambio_estadistica[])
+RETURNS VOID AS $$
+DECLARE
+    v_clave RECORD;
+BEGIN
+    IF cardinality(p_cambios) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Un cerrojo por (día, tipo), siempre en el mismo orden para no caer
+    -- en deadlocks. Con READ COMMITTED cada sentencia siguiente toma una
+    -- foto nueva: el recálculo de mínimos y máximos ve lo que confirmó
+    -- la transacción que tenía el cerrojo.
+    FOR v_clave IN
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        ORDER BY 1, 2
+    LOOP
+        PERFORM pg_advisory_xact_lock(v_clave.tipo_analisis_id, v_clave.dia - DATE '2000-01-01');
+    END LOOP;
+
+    INSERT INTO estadisticas_diarias AS e
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        c.dia,
+        c.tipo_analisis_id,
+        SUM(c.signo),
+        SUM(c.signo * c.valor),
+        SUM(c.signo * c.valor * c.valor),
+        MIN(c.valor) FILTER (WHERE c.signo > 0),
+        MAX(c.valor) FILTER (WHERE c.signo > 0),
+        COALESCE(SUM(c.signo) FILTER (WHERE c.fuera_rango), 0)
+    FROM unnest(p_cambios) c
+    GROUP BY c.dia, c.tipo_analisis_id
+    ORDER BY c.dia, c.tipo_analisis_id
+    ON CONFLICT (dia, tipo_analisis_id) DO UPDATE
+    SET cantidad = e.cantidad + EXCLUDED.cantidad,
+        suma = e.suma + EXCLUDED.suma,
+        suma_cuadrados = e.suma_cuadrados + EXCLUDED.suma_cuadrados,
+        minimo = LEAST(e.minimo, EXCLUDED.minimo),
+        maximo = GREATEST(e.maximo, EXCLUDED.maximo),
+        fuera_rango = e.fuera_rango + EXCLUDED.fuera_rango;
+
+    -- Si salieron filas, el mínimo o el máximo pueden haber cambiado:
+    -- se recalculan desde los resultados de ese día
+    UPDATE estadisticas_diarias e
+    SET minimo = r.minimo,
+        maximo = r.maximo
+    FROM (
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        WHERE c.signo < 0
+    ) k
+    CROSS JOIN LATERAL (
+        SELECT MIN(valor) AS minimo, MAX(valor) AS maximo
+        FROM resultados
+        WHERE tipo_analisis_id = k.tipo_analisis_id
+          AND fecha_resultado >= k.dia
+          AND fecha_resultado < k.dia + 1
+          AND valor IS NOT NULL
+    ) r
+    WHERE e.dia = k.dia AND e.tipo_analisis_id = k.tipo_analisis_id;
+
+    DELETE FROM estadisticas_diarias
+    WHERE cantidad = 0
+      AND (dia, tipo_analisis_id) IN (
+          SELECT c.dia, c.tipo_analisis_id FROM unnest(p_cambios) c WHERE c.signo < 0
+      );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION actualizar_estadisticas_diarias()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_cambios cambio_estadistica[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        v_cambios := ARRAY(
+            SELECT ROW(n.fecha_resultado::date, n.tipo_analisis_id, n.valor, n.fuera_rango, 1)::cambio_estadistica
+            FROM filas_nuevas n
+            WHERE n.valor IS NOT NULL AND n.fecha_resultado IS NOT NULL
+        );
+    ELSIF TG_OP = 'DELETE' THEN
+        v_cambios := ARRAY(
+            SELECT ROW(v.fecha_resultado::date, v.tipo_analisis_id, v.valor, v.fuera_rango, -1)::cambio_estadistica
+            FROM filas_viejas v
+            WHERE v.valor IS NOT NULL AND v.fecha_resultado IS NOT NULL
+        );
+    ELSE
+        -- Solo las filas que cambian algo de lo agregado (la carga de un
+        -- resultado pendiente entra como +1 sin fila que salga)
+        v_cambios := ARRAY(
+            SELECT c
+            FROM filas_viejas v
+            JOIN filas_nuevas n ON n.id = v.id
+            CROSS JOIN LATERAL (VALUES
+                (ROW(v.fecha_resultado::date, v.tipo_analisis_id, v.valor, v.fuera_rango, -1)::cambio_estadistica),
+                (ROW(n.fecha_resultado::date, n.tipo_analisis_id, n.valor, n.fuera_rango, 1)::cambio_estadistica)
+            ) AS x(c)
+            WHERE (v.fecha_resultado::date, v.tipo_analisis_id, v.valor, v.fuera_rango)
+                  IS DISTINCT FROM
+                  (n.fecha_resultado::date, n.tipo_analisis_id, n.valor, n.fuera_rango)
+              AND (c).valor IS NOT NULL AND (c).dia IS NOT NULL
+        );
+    END IF;
+
+    PERFORM aplicar_cambios_estadisticas(v_cambios);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruir el rollup desde resultados (carga inicial o reparación)
+CREATE OR REPLACE FUNCTION recalcular_estadisticas_diarias()
+RETURNS BIGINT AS $$
+DECLARE
+    v_filas BIGINT;
+BEGIN
+    LOCK TABLE estadisticas_diarias IN EXCLUSIVE MODE;
+    DELETE FROM estadisticas_diarias;
+    INSERT INTO estadisticas_diarias
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        fecha_resultado::date,
+        tipo_analisis_id,
+        COUNT(*),
+        SUM(valor),
+        SUM(valor * valor),
+        MIN(valor),
+        MAX(valor),
+        COUNT(*) FILTER (WHERE fuera_rango)
+    FROM resultados
+    WHERE valor IS NOT NULL AND fecha_resultado IS NOT NULL
+    GROUP BY 1, 2;
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_estadisticas_resultados_insert
+AFTER INSERT ON resultados REFERENCING NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_diarias();
+
+CREATE TRIGGER trg_estadisticas_resultados_update
+AFTER UPDATE ON resultados REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_diarias();
+
+CREATE TRIGGER trg_estadisticas_resultados_delete
+AFTER DELETE ON resultados REFERENCING OLD TABLE AS filas_viejas
+FOR EACH STATEMENT EXECUTE FUNCTION actualizar_estadisticas_diarias();
+
+SELECT recalcular_estadisticas_diarias();
+
+COMMIT;
@@ -0,0 +1,114 @@
+-- ============================================
+-- MIGRACIÓN 010: AVISOS DE CAMBIOS EN ESTADÍSTICAS
+-- ============================================
+-- El rollup diario avisa por el canal 'estadisticas_cambios' qué días
+-- cambiaron, para invalidar las cachés de estadísticas de la aplicación.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION aplicar_cambios_estadisticas(p_cambios cambio_estadistica[])
+RETURNS VOID AS $$
+DECLARE
+    v_clave RECORD;
+BEGIN
+    IF cardinality(p_cambios) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Un cerrojo por (día, tipo), siempre en el mismo orden para no caer
+    -- en deadlocks. Con READ COMMITTED cada sentencia siguiente toma una
+    -- foto nueva: el recálculo de mínimos y máximos ve lo que confirmó
+    -- la transacción que tenía el cerrojo.
+    FOR v_clave IN
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        ORDER BY 1, 2
+    LOOP
+        PERFORM pg_advisory_xact_lock(v_clave.tipo_analisis_id, v_clave.dia - DATE '2000-01-01');
+    END LOOP;
+
+    INSERT INTO estadisticas_diarias AS e
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        c.dia,
+        c.tipo_analisis_id,
+        SUM(c.signo),
+        SUM(c.signo * c.valor),
+        SUM(c.signo * c.valor * c.valor),
+        MIN(c.valor) FILTER (WHERE c.signo > 0),
+        MAX(c.valor) FILTER (WHERE c.signo > 0),
+        COALESCE(SUM(c.signo) FILTER (WHERE c.fuera_rango), 0)
+    FROM unnest(p_cambios) c
+    GROUP BY c.dia, c.tipo_analisis_id
+    ORDER BY c.dia, c.tipo_analisis_id
+    ON CONFLICT (dia, tipo_analisis_id) DO UPDATE
+    SET cantidad = e.cantidad + EXCLUDED.cantidad,
+        suma = e.suma + EXCLUDED.suma,
+        suma_cuadrados = e.suma_cuadrados + EXCLUDED.suma_cuadrados,
+        minimo = LEAST(e.minimo, EXCLUDED.minimo),
+        maximo = GREATEST(e.maximo, EXCLUDED.maximo),
+        fuera_rango = e.fuera_rango + EXCLUDED.fuera_rango;
+
+    -- Si salieron filas, el mínimo o el máximo pueden haber cambiado:
+    -- se recalculan desde los resultados de ese día
+    UPDATE estadisticas_diarias e
+    SET minimo = r.minimo,
+        maximo = r.maximo
+    FROM (
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        WHERE c.signo < 0
+    ) k
+    CROSS JOIN LATERAL (
+        SELECT MIN(valor) AS minimo, MAX(valor) AS maximo
+        FROM resultados
+        WHERE tipo_analisis_id = k.tipo_analisis_id
+          AND fecha_resultado >= k.dia
+          AND fecha_resultado < k.dia + 1
+          AND valor IS NOT NULL
+    ) r
+    WHERE e.dia = k.dia AND e.tipo_analisis_id = k.tipo_analisis_id;
+
+    DELETE FROM estadisticas_diarias
+    WHERE cantidad = 0
+      AND (dia, tipo_analisis_id) IN (
+          SELECT c.dia, c.tipo_analisis_id FROM unnest(p_cambios) c WHERE c.signo < 0
+      );
+
+    -- Días afectados ('desde,hasta') para las cachés de estadísticas; se
+    -- entrega solo si la transacción confirma
+    PERFORM pg_notify('estadisticas_cambios', MIN(c.dia)::text || ',' || MAX(c.dia)::text)
+    FROM unnest(p_cambios) c;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruir el rollup desde resultados (carga inicial o reparación)
+CREATE OR REPLACE FUNCTION recalcular_estadisticas_diarias()
+RETURNS BIGINT AS $$
+DECLARE
+    v_filas BIGINT;
+BEGIN
+    LOCK TABLE estadisticas_diarias IN EXCLUSIVE MODE;
+    DELETE FROM estadisticas_diarias;
+    INSERT INTO estadisticas_diarias
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        fecha_resultado::date,
+        tipo_analisis_id,
+        COUNT(*),
+        SUM(valor),
+        SUM(valor * valor),
+        MIN(valor),
+        MAX(valor),
+        COUNT(*) FILTER (WHERE fuera_rango)
+    FROM resultados
+    WHERE valor IS NOT NULL AND fecha_resultado IS NOT NULL
+    GROUP BY 1, 2;
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+    -- Sin días: invalida todas las cachés de estadísticas
+    PERFORM pg_notify('estadisticas_cambios', '');
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,216 @@
+-- ============================================
+-- MIGRACIÓN 011: SKETCHES DIARIOS DE CUANTILES
+-- ============================================
+-- Crea sketches_diarios, la mantiene desde los triggers del rollup
+-- diario y la carga desde resultados (bloquea las escrituras en
+-- resultados mientras dura).
+
+BEGIN;
+
+LOCK TABLE resultados IN SHARE MODE;
+
+-- Distribución de valores por día y tipo de análisis en cubetas
+-- logarítmicas (ver sketches.py). Binario: cabecera de 3 bytes (versión,
+-- alfa en diezmilésimos) y un registro de 6 bytes por cubeta no vacía
+-- (índice int16, cantidad int32, big-endian) ordenado por índice.
+CREATE TABLE sketches_diarios (
+    dia DATE NOT NULL,
+    tipo_analisis_id INTEGER NOT NULL REFERENCES tipos_analisis(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    sketch BYTEA NOT NULL,
+
+    PRIMARY KEY (dia, tipo_analisis_id)
+);
+
+-- Cubeta de un valor con error relativo alfa = 0.01, gamma = 1.01 / 0.99.
+-- Positivos: ceil(log_gamma(v)); cero: -32768; negativos: -16384 - ceil(log_gamma(|v|)).
+-- Con NUMERIC(10,2) los índices van de -232 a 931 (sin solaparse entre signos).
+-- indice_sketch y sketch_cubetas no son STRICT para que el planificador
+-- pueda expandirlas dentro de la consulta (NULL da NULL / ninguna cubeta).
+CREATE OR REPLACE FUNCTION indice_sketch(p_valor NUMERIC)
+RETURNS SMALLINT AS $$
+    SELECT CASE
+        WHEN p_valor = 0 THEN -32768
+        WHEN p_valor > 0 THEN ceil(ln(p_valor::float8) / ln(1.01::float8 / 0.99))
+        ELSE -16384 - ceil(ln(-p_valor::float8) / ln(1.01::float8 / 0.99))
+    END::smallint
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION sketch_codificar(p_indices SMALLINT[], p_cantidades INTEGER[])
+RETURNS BYTEA AS $$
+    SELECT '\x010064'::bytea
+        || COALESCE(string_agg(int2send(i) || int4send(c), ''::bytea ORDER BY i), ''::bytea)
+    FROM unnest(p_indices, p_cantidades) AS t(i, c)
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION sketch_cubetas(p_sketch BYTEA)
+RETURNS TABLE(indice SMALLINT, cantidad INTEGER) AS $$
+    SELECT
+        (CASE WHEN x >= 32768 THEN x - 65536 ELSE x END)::smallint,
+        (get_byte(p_sketch, o + 2) << 24) | (get_byte(p_sketch, o + 3) << 16)
+            | (get_byte(p_sketch, o + 4) << 8) | get_byte(p_sketch, o + 5)
+    FROM generate_series(3, length(p_sketch) - 6, 6) AS o
+    CROSS JOIN LATERAL (SELECT (get_byte(p_sketch, o) << 8) | get_byte(p_sketch, o + 1) AS x) b
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION aplicar_cambios_estadisticas(p_cambios cambio_estadistica[])
+RETURNS VOID AS $$
+DECLARE
+    v_clave RECORD;
+BEGIN
+    IF cardinality(p_cambios) = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Un cerrojo por (día, tipo), siempre en el mismo orden para no caer
+    -- en deadlocks. Con READ COMMITTED cada sentencia siguiente toma una
+    -- foto nueva: el recálculo de mínimos y máximos ve lo que confirmó
+    -- la transacción que tenía el cerrojo.
+    FOR v_clave IN
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        ORDER BY 1, 2
+    LOOP
+        PERFORM pg_advisory_xact_lock(v_clave.tipo_analisis_id, v_clave.dia - DATE '2000-01-01');
+    END LOOP;
+
+    INSERT INTO estadisticas_diarias AS e
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        c.dia,
+        c.tipo_analisis_id,
+        SUM(c.signo),
+        SUM(c.signo * c.valor),
+        SUM(c.signo * c.valor * c.valor),
+        MIN(c.valor) FILTER (WHERE c.signo > 0),
+        MAX(c.valor) FILTER (WHERE c.signo > 0),
+        COALESCE(SUM(c.signo) FILTER (WHERE c.fuera_rango), 0)
+    FROM unnest(p_cambios) c
+    GROUP BY c.dia, c.tipo_analisis_id
+    ORDER BY c.dia, c.tipo_analisis_id
+    ON CONFLICT (dia, tipo_analisis_id) DO UPDATE
+    SET cantidad = e.cantidad + EXCLUDED.cantidad,
+        suma = e.suma + EXCLUDED.suma,
+        suma_cuadrados = e.suma_cuadrados + EXCLUDED.suma_cuadrados,
+        minimo = LEAST(e.minimo, EXCLUDED.minimo),
+        maximo = GREATEST(e.maximo, EXCLUDED.maximo),
+        fuera_rango = e.fuera_rango + EXCLUDED.fuera_rango;
+
+    -- Si salieron filas, el mínimo o el máximo pueden haber cambiado:
+    -- se recalculan desde los resultados de ese día
+    UPDATE estadisticas_diarias e
+    SET minimo = r.minimo,
+        maximo = r.maximo
+    FROM (
+        SELECT DISTINCT c.dia, c.tipo_analisis_id
+        FROM unnest(p_cambios) c
+        WHERE c.signo < 0
+    ) k
+    CROSS JOIN LATERAL (
+        SELECT MIN(valor) AS minimo, MAX(valor) AS maximo
+        FROM resultados
+        WHERE tipo_analisis_id = k.tipo_analisis_id
+          AND fecha_resultado >= k.dia
+          AND fecha_resultado < k.dia + 1
+          AND valor IS NOT NULL
+    ) r
+    WHERE e.dia = k.dia AND e.tipo_analisis_id = k.tipo_analisis_id;
+
+    DELETE FROM estadisticas_diarias
+    WHERE cantidad = 0
+      AND (dia, tipo_analisis_id) IN (
+          SELECT c.dia, c.tipo_analisis_id FROM unnest(p_cambios) c WHERE c.signo < 0
+      );
+
+    -- Sketch de cuantiles: cubetas guardadas más los cambios
+    WITH cambios AS (
+        SELECT c.dia, c.tipo_analisis_id, indice_sketch(c.valor) AS indice, SUM(c.signo) AS cantidad
+        FROM unnest(p_cambios) c
+        GROUP BY 1, 2, 3
+    ),
+    cubetas AS (
+        SELECT s.dia, s.tipo_analisis_id, b.indice, b.cantidad::bigint AS cantidad
+        FROM sketches_diarios s
+        JOIN (SELECT DISTINCT dia, tipo_analisis_id FROM cambios) k
+            ON k.dia = s.dia AND k.tipo_analisis_id = s.tipo_analisis_id
+        CROSS JOIN LATERAL sketch_cubetas(s.sketch) b
+        UNION ALL
+        SELECT dia, tipo_analisis_id, indice, cantidad FROM cambios
+    ),
+    nuevas AS (
+        SELECT dia, tipo_analisis_id, indice, SUM(cantidad)::int AS cantidad
+        FROM cubetas
+        GROUP BY 1, 2, 3
+        HAVING SUM(cantidad) <> 0
+    )
+    INSERT INTO sketches_diarios (dia, tipo_analisis_id, sketch)
+    SELECT dia, tipo_analisis_id,
+           sketch_codificar(array_agg(indice ORDER BY indice), array_agg(cantidad ORDER BY indice))
+    FROM nuevas
+    GROUP BY dia, tipo_analisis_id
+    ORDER BY dia, tipo_analisis_id
+    ON CONFLICT (dia, tipo_analisis_id) DO UPDATE
+    SET sketch = EXCLUDED.sketch;
+
+    DELETE FROM sketches_diarios s
+    WHERE (s.dia, s.tipo_analisis_id) IN (
+          SELECT c.dia, c.tipo_analisis_id FROM unnest(p_cambios) c WHERE c.signo < 0
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM estadisticas_diarias e
+          WHERE e.dia = s.dia AND e.tipo_analisis_id = s.tipo_analisis_id
+      );
+
+    -- Días afectados ('desde,hasta') para las cachés de estadísticas; se
+    -- entrega solo si la transacción confirma
+    PERFORM pg_notify('estadisticas_cambios', MIN(c.dia)::text || ',' || MAX(c.dia)::text)
+    FROM unnest(p_cambios) c;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruir el rollup y los sketches desde resultados (carga inicial o reparación)
+CREATE OR REPLACE FUNCTION recalcular_estadisticas_diarias()
+RETURNS BIGINT AS $$
+DECLARE
+    v_filas BIGINT;
+BEGIN
+    LOCK TABLE estadisticas_diarias, sketches_diarios IN EXCLUSIVE MODE;
+    DELETE FROM estadisticas_diarias;
+    INSERT INTO estadisticas_diarias
+        (dia, tipo_analisis_id, cantidad, suma, suma_cuadrados, minimo, maximo, fuera_rango)
+    SELECT
+        fecha_resultado::date,
+        tipo_analisis_id,
+        COUNT(*),
+        SUM(valor),
+        SUM(valor * valor),
+        MIN(valor),
+        MAX(valor),
+        COUNT(*) FILTER (WHERE fuera_rango)
+    FROM resultados
+    WHERE valor IS NOT NULL AND fecha_resultado IS NOT NULL
+    GROUP BY 1, 2;
+    GET DIAGNOSTICS v_filas = ROW_COUNT;
+
+    DELETE FROM sketches_diarios;
+    INSERT INTO sketches_diarios (dia, tipo_analisis_id, sketch)
+    SELECT dia, tipo_analisis_id,
+           sketch_codificar(array_agg(indice ORDER BY indice), array_agg(cantidad ORDER BY indice))
+    FROM (
+        SELECT fecha_resultado::date AS dia, tipo_analisis_id,
+               indice_sketch(valor) AS indice, COUNT(*)::int AS cantidad
+        FROM resultados
+        WHERE valor IS NOT NULL AND fecha_resultado IS NOT NULL
+        GROUP BY 1, 2, 3
+    ) c
+    GROUP BY dia, tipo_analisis_id;
+
+    -- Sin días: invalida todas las cachés de estadísticas
+    PERFORM pg_notify('estadisticas_cambios', '');
+    RETURN v_filas;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT recalcular_estadisticas_diarias();
+
+COMMIT;
@@ -0,0 +1,122 @@
+"""
+Notificaciones entre procesos con LISTEN/NOTIFY de PostgreSQL
+"""
+
+import os
+import select
+import atexit
+import threading
+import psycopg2
+from config import DB_CONFIG
+
+
+def notificar(cursor, canal, payload=''):
+    """
+    Encolar una notificación dentro de la transacción del cursor.
+    PostgreSQL solo la entrega si la transacción confirma (COMMIT).
+    """
+    cursor.execute("SELECT pg_notify(%s, %s)", (canal, str(payload)))
+
+
+class EscuchaNotificaciones:
+    """
+    Hilo que escucha canales en una conexión dedicada (fuera del pool,
+    porque LISTEN la ocupa de forma permanente) y llama a los callbacks
+    suscritos con el payload recibido.
+
+    Tras conectar o reconectar, los callbacks reciben payload None: las
+    notificaciones emitidas mientras no se escuchaba se perdieron.
+    """
+
+    def __init__(self, config=None, espera=1.0, reintento=5.0):
+        self._config = config or DB_CONFIG
+        self._espera = espera
+        self._reintento = reintento
+        self._suscripciones = {}
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def suscribir(self, canal, callback):
+        """Registrar un callback(payload) para el canal e iniciar el hilo si hace falta"""
+        with self._lock:
+            self._suscripciones.setdefault(canal, []).append(callback)
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._hilo = threading.Thread(
+                    target=self._bucle, name='escucha-notificaciones', daemon=True
+                )
+                self._hilo.start()
+
+    def detener(self):
+        """Detener el hilo y cerrar la conexión dedicada"""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self._espera * 2)
+
+    def _despachar(self, canal, payload):
+        with self._lock:
+            callbacks = list(self._suscripciones.get(canal, []))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"Error en callback de notificación '{canal}': {e}")
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._config)
+                conn.autocommit = True
+                escuchando = set()
+
+                while not self._detener.is_set():
+                    # Canales suscritos después de conectar
+                    with self._lock:
+                        nuevos = [c for c in self._suscripciones if c not in escuchando]
+                    for canal in nuevos:
+                        with conn.cursor() as cursor:
+                            cursor.execute(f'LISTEN "{canal}"')
+                        escuchando.add(canal)
+                        self._despachar(canal, None)
+
+                    if select.select([conn], [], [], self._espera) == ([], [], []):
+                        continue
+
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        self._despachar(aviso.channel, aviso.payload)
+
+            except (psycopg2.Error, OSError) as e:
+                print(f"Conexión de notificaciones perdida: {e}. Reintentando...")
+                self._detener.wait(self._reintento)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+# Una escucha por proceso (los hilos no sobreviven a un fork)
+_escuchas = {}
+_escuchas_lock = threading.Lock()
+
+
+def obtener_escucha():
+    """Devuelve la escucha de notificaciones del proceso actual"""
+    with _escuchas_lock:
+        escucha = _escuchas.get(os.getpid())
+        if escucha is None:
+            escucha = _escuchas[os.getpid()] = EscuchaNotificaciones()
+        return escucha
+
+
+def cerrar_escucha():
+    """Detener la escucha del proceso actual"""
+    with _escuchas_lock:
+        escucha = _escuchas.pop(os.getpid(), None)
+    if escucha is not None:
+        escucha.detener()
+
+
+atexit.register(cerrar_escucha)
@@ -0,0 +1,234 @@
+"""
+Rotación de la clave de encriptación sin detener el sistema.
+También migra los datos al formato configurado en FORMATO_CIFRADO
+(por ejemplo de Fernet a AES-GCM) con el mismo mecanismo.
+
+Procedimiento:
+1. Agregar la clave actual a ENCRYPTION_KEYS_ANTERIORES (o al archivo
+   'encryption.key.anteriores')
+2. Configurar la nueva ENCRYPTION_KEY: las escrituras nuevas ya la usan
+   y las lecturas aceptan ambas claves
+3. Ejecutar este script: re-encripta pacientes por lotes ordenados por ID,
+   con pausas entre lotes y un checkpoint en la base de datos. Si se
+   interrumpe, al volver a ejecutarlo continúa desde el último lote.
+4. Los procesos que siguen corriendo con la configuración anterior
+   escriben con la clave vieja hasta reiniciarse, también en filas que la
+   rotación ya pasó. Con todos los procesos reiniciados, ejecutar
+   `python rotacion_claves.py --repasar`: recorre de nuevo la tabla desde
+   el principio y re-encripta solo lo que quedó con otra clave o formato.
+5. Al terminar el repaso, las claves anteriores pueden retirarse
+
+Cada lote se audita con el usuario de sistema 'rotacion_claves' y la
+acción ROTACION_CLAVE, distinguible de las modificaciones de datos.
+"""
+
+import time
+import argparse
+import hashlib
+import threading
+from psycopg2 import errors
+from psycopg2.extras import execute_values
+from config import ENCRYPTION_KEY, FORMATO_CIFRADO, ROTACION_CONFIG
+from database import Database
+from auditoria import establecer_contexto_auditoria, registrar_auditoria_lote
+
+db = Database()
+
+USUARIO_ROTACION = 'rotacion_claves'
+ACCION_ROTACION = 'ROTACION_CLAVE'
+DETALLES_ROTACION = 'Re-encriptación con la clave actual (datos sin cambios)'
+
+
+def identificador_trabajo():
+    """El checkpoint se asocia a la clave y formato destino (huella, no la clave)"""
+    huella = hashlib.sha256(ENCRYPTION_KEY).hexdigest()[:16]
+    return f"{FORMATO_CIFRADO}-{huella}"
+
+
+def _leer_checkpoint(cursor, trabajo):
+    cursor.execute("""
+        INSERT INTO rotacion_claves_progreso (trabajo)
+        VALUES (%s)
+        ON CONFLICT (trabajo) DO NOTHING
+    """, (trabajo,))
+    cursor.execute("""
+        SELECT ultimo_id, filas_rotadas, completado
+        FROM rotacion_claves_progreso
+        WHERE trabajo = %s
+    """, (trabajo,))
+    return cursor.fetchone()
+
+
+def _rotar_lote(cursor, trabajo, ultimo_id, tamano_lote, lock_timeout_ms):
+    """
+    Re-encriptar un lote y avanzar el checkpoint en la misma transacción.
+    
+    Returns:
+        tuple: (nuevo_ultimo_id o None si no quedan filas, filas_rotadas)
+    """
+    # No esperar indefinidamente por filas que está editando recepción
+    cursor.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+    cursor.execute("""
+        SELECT id, nombre_enc, dni_enc, telefono_enc
+        FROM pacientes
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE
+    """, (ultimo_id, tamano_lote))
+    
+    filas = cursor.fetchall()
+    if not filas:
+        return None, 0
+    
+    cambios = []
+    for paciente_id, nombre_enc, dni_enc, tel_enc in filas:
+        nuevos = [db.rotar(nombre_enc), db.rotar(dni_enc), db.rotar(tel_enc)]
+        if any(nuevos):
+            # COALESCE en el UPDATE conserva los campos que no cambiaron
+            cambios.append((paciente_id, *nuevos))
+    
+    if cambios:
+        establecer_contexto_auditoria(cursor, USUARIO_ROTACION, tabla='pacientes',
+                                      accion=ACCION_ROTACION, detalles=DETALLES_ROTACION)
+        execute_values(cursor, """
+            UPDATE pacientes p
+            SET nombre_enc = COALESCE(v.nombre_enc, p.nombre_enc),
+                dni_enc = COALESCE(v.dni_enc, p.dni_enc),
+                telefono_enc = COALESCE(v.telefono_enc, p.telefono_enc)
+            FROM (VALUES %s) AS v(id, nombre_enc, dni_enc, telefono_enc)
+            WHERE p.id = v.id
+        """, cambios, template="(%s, %s::bytea, %s::bytea, %s::bytea)")
+        registrar_auditoria_lote(cursor, [
+            ('pacientes', cambio[0], ACCION_ROTACION, USUARIO_ROTACION, DETALLES_ROTACION, None)
+            for cambio in cambios
+        ])
+    
+    nuevo_ultimo_id = filas[-1][0]
+    cursor.execute("""
+        UPDATE rotacion_claves_progreso
+        SET ultimo_id = %s,
+            filas_rotadas = filas_rotadas + %s,
+            actualizado = CURRENT_TIMESTAMP
+        WHERE trabajo = %s
+    """, (nuevo_ultimo_id, len(cambios), trabajo))
+    
+    return nuevo_ultimo_id, len(cambios)
+
+
+def _reiniciar_checkpoint(cursor, trabajo):
+    """Volver a recorrer la tabla desde el principio (repaso)"""
+    cursor.execute("""
+        UPDATE rotacion_claves_progreso
+        SET ultimo_id = 0, completado = FALSE, actualizado = CURRENT_TIMESTAMP
+        WHERE trabajo = %s
+    """, (trabajo,))
+
+
+def rotar_claves(tamano_lote=None, pausa=None, detener=None, progreso=None, repasar=False):
+    """
+    Re-encriptar todos los pacientes con la clave actual (reanudable).
+    
+    Args:
+        tamano_lote: Filas por transacción
+        pausa: Segundos de espera entre lotes (limita la carga)
+        detener: threading.Event opcional para detener tras el lote en curso
+        progreso: Función opcional progreso(ultimo_id, filas_rotadas)
+        repasar: Recorrer de nuevo la tabla aunque el trabajo esté
+                 completado (filas escritas con la clave vieja por procesos
+                 aún no reiniciados)
+    
+    Returns:
+        tuple: (completado, filas_rotadas)
+    """
+    tamano_lote = tamano_lote or ROTACION_CONFIG['tamano_lote']
+    pausa = ROTACION_CONFIG['pausa'] if pausa is None else pausa
+    lock_timeout_ms = ROTACION_CONFIG['lock_timeout_ms']
+    trabajo = identificador_trabajo()
+    
+    conn = db.get_connection()
+    try:
+        with conn:
+            with conn.cursor() as cursor:
+                _leer_checkpoint(cursor, trabajo)
+                if repasar:
+                    _reiniciar_checkpoint(cursor, trabajo)
+                ultimo_id, filas_rotadas, completado = _leer_checkpoint(cursor, trabajo)
+        
+        while not completado:
+            if detener is not None and detener.is_set():
+                return False, filas_rotadas
+            
+            try:
+                with conn:
+                    with conn.cursor() as cursor:
+                        nuevo_id, rotadas = _rotar_lote(
+                            cursor, trabajo, ultimo_id, tamano_lote, lock_timeout_ms
+                        )
+                        if nuevo_id is None:
+                            cursor.execute("""
+                                UPDATE rotacion_claves_progreso
+                                SET completado = TRUE, actualizado = CURRENT_TIMESTAMP
+                                WHERE trabajo = %s
+                            """, (trabajo,))
+                            completado = True
+                            break
+            except errors.LockNotAvailable:
+                # Lote bloqueado por otra transacción: reintentar más tarde
+                time.sleep(max(pausa, 1.0))
+                continue
+            
+            ultimo_id = nuevo_id
+            filas_rotadas += rotadas
+            if progreso:
+                progreso(ultimo_id, filas_rotadas)
+            
+            time.sleep(pausa)
+        
+        return True, filas_rotadas
+    finally:
+        db.release_connection(conn)
+
+
+def iniciar_en_segundo_plano(**kwargs):
+    """
+    Ejecutar la rotación en un hilo daemon.
+    
+    Returns:
+        tuple: (hilo, evento_detener)
+    """
+    detener = threading.Event()
+    hilo = threading.Thread(
+        target=rotar_claves, kwargs={**kwargs, 'detener': detener},
+        name='rotacion-claves', daemon=True
+    )
+    hilo.start()
+    return hilo, detener
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rotar la clave de encriptación de pacientes")
+    parser.add_argument('--repasar', action='store_true',
+                        help="Recorrer de nuevo la tabla tras reiniciar todos los procesos")
+    args = parser.parse_args()
+    
+    print("="*70)
+    print("ROTACIÓN DE CLAVE DE ENCRIPTACIÓN")
+    print("="*70)
+    print(f"Trabajo: {identificador_trabajo()} (formato destino: {FORMATO_CIFRADO})")
+    
+    def mostrar(ultimo_id, filas):
+        print(f"  Checkpoint: ID {ultimo_id} | filas re-encriptadas: {filas}")
+    
+    try:
+        completado, filas = rotar_claves(progreso=mostrar, repasar=args.repasar)
+    except KeyboardInterrupt:
+        print("\nInterrumpido: el próximo inicio continuará desde el último checkpoint")
+    else:
+        if completado:
+            print(f"\n✓ Rotación completada ({filas} filas re-encriptadas)")
+            if args.repasar:
+                print("  Las claves anteriores ya pueden retirarse")
+            else:
+                print("  Reiniciar los procesos con la clave nueva y ejecutar --repasar")
+                print("  antes de retirar las claves anteriores")
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Sketch de cuantiles con cubetas logarítmicas (tipo DDSketch).
+
+Cada valor v != 0 cae en la cubeta i = ceil(log_gamma(|v|)) con
+gamma = (1 + ALFA) / (1 - ALFA); la cubeta cubre (gamma^(i-1), gamma^i] y
+se representa por 2 * gamma^i / (gamma + 1). El cero tiene cubeta propia
+y los negativos usan índices desplazados. El sketch solo guarda cuántos
+valores hay en cada cubeta, así que:
+
+- Combinar sketches (días, tipos) es sumar cantidades: el resultado es
+  idéntico al sketch de todos los valores juntos, sin error acumulado.
+- Cuantiles: el valor devuelto para el rango k difiere del k-ésimo valor
+  real en como mucho ALFA * |valor| (1 % con ALFA = 0.01), sea cual sea
+  la cantidad de valores o la forma de la distribución.
+- Histogramas: cada cubeta se asigna entera al intervalo de su valor
+  representativo; un valor a menos de ALFA * |valor| de un borde puede
+  contarse en el intervalo vecino. Los totales son exactos.
+
+Los índices se calculan en PostgreSQL (indice_sketch en clinica_lab.sql)
+y deben coincidir con indice_valor(). Formato binario: cabecera de 3
+bytes (versión, ALFA en diezmilésimos) y un registro de 6 bytes por
+cubeta no vacía (índice int16, cantidad int32, big-endian).
+"""
+
+import math
+import struct
+
+ALFA = 0.01
+GAMMA = (1 + ALFA) / (1 - ALFA)
+VERSION = 1
+
+INDICE_CERO = -32768
+# Índice de un negativo: DESPLAZAMIENTO_NEGATIVOS - indice(|v|)
+DESPLAZAMIENTO_NEGATIVOS = -16384
+
+_CABECERA = struct.Struct('>Bh')
+_CUBETA = struct.Struct('>hi')
+_LOG_GAMMA = math.log(GAMMA)
+
+
+def indice_valor(valor):
+    """Cubeta de un valor (misma regla que indice_sketch en la base)"""
+    valor = float(valor)
+    if valor == 0:
+        return INDICE_CERO
+    indice = math.ceil(math.log(abs(valor)) / _LOG_GAMMA)
+    return indice if valor > 0 else DESPLAZAMIENTO_NEGATIVOS - indice
+
+
+def valor_indice(indice):
+    """Valor representativo de una cubeta (error relativo <= ALFA)"""
+    if indice == INDICE_CERO:
+        return 0.0
+    # Positivos: -232..931; negativos: por debajo de -16000
+    if indice > DESPLAZAMIENTO_NEGATIVOS // 2:
+        return 2 * GAMMA ** indice / (GAMMA + 1)
+    return -2 * GAMMA ** (DESPLAZAMIENTO_NEGATIVOS - indice) / (GAMMA + 1)
+
+
+class SketchCuantiles:
+    """Cantidades por cubeta de un conjunto de valores"""
+
+    __slots__ = ('cubetas',)
+
+    def __init__(self, cubetas=None):
+        # índice -> cantidad
+        self.cubetas = {}
+        for indice, cantidad in (cubetas or ()):
+            self.cubetas[indice] = self.cubetas.get(indice, 0) + cantidad
+
+    @classmethod
+    def desde_bytes(cls, datos):
+        """Leer el formato binario de sketches_diarios.sketch"""
+        datos = bytes(datos)
+        version, alfa = _CABECERA.unpack_from(datos)
+        if version != VERSION or alfa != round(ALFA * 10000):
+            raise ValueError(f"Sketch no compatible (versión {version}, alfa {alfa / 10000})")
+        return cls(_CUBETA.iter_unpack(datos[_CABECERA.size:]))
+
+    def a_bytes(self):
+        partes = [_CABECERA.pack(VERSION, round(ALFA * 10000))]
+        partes.extend(
+            _CUBETA.pack(indice, cantidad)
+            for indice, cantidad in sorted(self.cubetas.items()) if cantidad
+        )
+        return b''.join(partes)
+
+    def agregar(self, valor, cantidad=1):
+        indice = indice_valor(valor)
+        self.cubetas[indice] = self.cubetas.get(indice, 0) + cantidad
+
+    def combinar(self, otro):
+        """Sumar otro sketch a este (in-place); retorna self"""
+        for indice, cantidad in otro.cubetas.items():
+            self.cubetas[indice] = self.cubetas.get(indice, 0) + cantidad
+        return self
+
+    @property
+    def cantidad(self):
+        return sum(self.cubetas.values())
+
+    def _acumulado(self):
+        """(valor representativo, cantidad) ordenado por valor"""
+        return sorted(
+            (valor_indice(indice), cantidad)
+            for indice, cantidad in self.cubetas.items() if cantidad > 0
+        )
+
+    def cuantiles(self, qs):
+        """
+        Valores aproximados de los cuantiles qs (0..1), en el mismo orden.
+
+        Misma definición que percentile_disc de PostgreSQL: el menor valor
+        con al menos q * n valores menores o iguales (n = cantidad total).
+        Retorna None por cada q si el sketch está vacío.
+        """
+        total = self.cantidad
+        if total <= 0:
+            return [None] * len(qs)
+
+        cubetas = self._acumulado()
+        resultado = {}
+        acumulado = 0
+        # Rango (base 0) de cada cuantil en los valores ordenados
+        pendientes = sorted((max(math.ceil(q * total) - 1, 0), q) for q in set(qs))
+        for valor, cantidad in cubetas:
+            acumulado += cantidad
+            while pendientes and pendientes[0][0] < acumulado:
+                resultado[pendientes.pop(0)[1]] = valor
+        # q >= 1 por redondeo: el máximo
+        for _, q in pendientes:
+            resultado[q] = cubetas[-1][0]
+        return [resultado[q] for q in qs]
+
+    def cuantil(self, q):
+        return self.cuantiles([q])[0]
+
+    def histograma(self, minimo, maximo, intervalos=10):
+        """
+        Histograma de intervalos iguales entre minimo y maximo.
+
+        Returns:
+            tuple: (lista de (desde, hasta, cantidad), debajo, encima) donde
+                   debajo/encima cuentan los valores fuera de [minimo, maximo]
+        """
+        ancho = (maximo - minimo) / intervalos if maximo > minimo else 0
+        cantidades = [0] * intervalos
+        debajo = encima = 0
+        for valor, cantidad in self._acumulado():
+            if valor < minimo:
+                debajo += cantidad
+            elif valor > maximo:
+                encima += cantidad
+            elif ancho == 0:
+                cantidades[0] += cantidad
+            else:
+                cantidades[min(int((valor - minimo) / ancho), intervalos - 1)] += cantidad
+
+        bordes = [minimo + ancho * i for i in range(intervalos)] + [maximo]
+        return [
+            (bordes[i], bordes[i + 1], cantidades[i]) for i in range(intervalos)
+        ], debajo, encima
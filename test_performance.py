@@ -2,8 +2,9 @@
 Script para testear el rendimiento de las consultas optimizadas
 """
 
+import os
 import time
-from database import Database
+from database import Database, crear_cipher, CLAVES_VIGENTES
 from datetime import datetime, timedelta
 
 def medir_tiempo(func):
@@ -138,6 +139,389 @@ class PerformanceTester:
         finally:
             self.db.release_connection(conn)
     
+    def test_encriptacion_lote(self, cantidad=20000):
+        """REQUISITO 3: Encriptación fila por fila vs. por lotes en paralelo"""
+        textos = [f"Paciente de prueba {i:08d}" for i in range(cantidad)]
+        
+        inicio = time.time()
+        cifrados = [self.db.encriptar(t) for t in textos]
+        t_enc_secuencial = time.time() - inicio
+        
+        inicio = time.time()
+        cifrados_lote = self.db.encriptar_lote(textos)
+        t_enc_lote = time.time() - inicio
+        
+        inicio = time.time()
+        planos = [self.db.desencriptar(c) for c in cifrados]
+        t_dec_secuencial = time.time() - inicio
+        
+        inicio = time.time()
+        planos_lote = self.db.desencriptar_lote(cifrados_lote)
+        t_dec_lote = time.time() - inicio
+        
+        assert planos == textos and planos_lote == textos
+        
+        return {
+            'encriptar': (cantidad / t_enc_secuencial, cantidad / t_enc_lote),
+            'desencriptar': (cantidad / t_dec_secuencial, cantidad / t_dec_lote)
+        }
+    
+    def test_formatos_cifrado(self, cantidad=20000):
+        """REQUISITO 3: Tamaño y velocidad de Fernet vs. AES-GCM versionado"""
+        muestras = {
+            'dni': [f"{i:08d}" for i in range(cantidad)],
+            'telefono': [f"+519{i:08d}" for i in range(cantidad)],
+            'nombre': [f"Paciente de prueba {i:08d}" for i in range(cantidad)]
+        }
+        resultados = {}
+        
+        for formato in ('fernet', 'aesgcm'):
+            cipher = crear_cipher(CLAVES_VIGENTES, formato)
+            tamanos = {}
+            t_enc = t_dec = 0
+            
+            for campo, textos in muestras.items():
+                inicio = time.time()
+                cifrados = [cipher.encrypt(t.encode()) for t in textos]
+                t_enc += time.time() - inicio
+                
+                inicio = time.time()
+                planos = [cipher.decrypt(c).decode() for c in cifrados]
+                t_dec += time.time() - inicio
+                
+                assert planos == textos
+                tamanos[campo] = sum(len(c) for c in cifrados) / cantidad
+            
+            total = cantidad * len(muestras)
+            resultados[formato] = {
+                'tamanos': tamanos,
+                'encriptar': total / t_enc,
+                'desencriptar': total / t_dec
+            }
+        
+        # Distribución real en la tabla (primer byte 0x01 = AES-GCM)
+        conn = self.db.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT 
+                        CASE WHEN get_byte(dni_enc, 0) = 1 THEN 'aesgcm' ELSE 'fernet' END,
+                        COUNT(*),
+                        AVG(octet_length(nombre_enc) + octet_length(dni_enc) 
+                            + COALESCE(octet_length(telefono_enc), 0))
+                    FROM pacientes
+                    GROUP BY 1
+                """)
+                resultados['tabla'] = cursor.fetchall()
+        finally:
+            self.db.release_connection(conn)
+        
+        return resultados
+    
+    def test_triggers_auditoria(self, filas=20000):
+        """
+        REQUISITO 4: Trigger de auditoría por fila vs. por sentencia en un
+        UPDATE masivo de resultados. Todo ocurre en una transacción que se
+        revierte (bloquea la tabla mientras dura el test).
+        """
+        conn = self.db.get_connection()
+        tiempos = {}
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT id FROM resultados ORDER BY id LIMIT %s", (filas,))
+                ids = [fila[0] for fila in cursor.fetchall()]
+                
+                def medir(nombre, preparar):
+                    cursor.execute("SAVEPOINT benchmark")
+                    for sentencia in preparar:
+                        cursor.execute(sentencia)
+                    inicio = time.time()
+                    cursor.execute("""
+                        UPDATE resultados SET usuario_carga = usuario_carga
+                        WHERE id = ANY(%s)
+                    """, (ids,))
+                    tiempos[nombre] = time.time() - inicio
+                    cursor.execute("ROLLBACK TO SAVEPOINT benchmark")
+                
+                medir('sin trigger', [
+                    "ALTER TABLE resultados DISABLE TRIGGER trg_auditar_resultados_update"
+                ])
+                medir('por fila', [
+                    "ALTER TABLE resultados DISABLE TRIGGER trg_auditar_resultados_update",
+                    """CREATE TRIGGER trg_benchmark_por_fila
+                       AFTER UPDATE ON resultados
+                       FOR EACH ROW EXECUTE FUNCTION registrar_auditoria()"""
+                ])
+                medir('por sentencia', [])
+        finally:
+            conn.rollback()
+            self.db.release_connection(conn)
+        
+        return len(ids), tiempos
+    
+    def test_auditoria_lecturas(self, lecturas=2000, pacientes=100):
+        """
+        REQUISITO 4: Costo por lectura de auditar con un INSERT síncrono
+        (con su COMMIT) vs. la cola asíncrona con agrupamiento. El INSERT
+        síncrono va a una copia de auditoria_accesos (mismos índices) que
+        se borra al terminar; la cola escribe en la auditoría real con un
+        usuario propio del test y sus filas se cuentan, no se borran.
+        """
+        from auditoria import registrar_lectura, vaciar_lecturas, vaciar_auditoria
+        usuario = f"test_performance_{os.getpid()}_{int(time.time())}"
+        tiempos = {}
+        
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        CREATE TABLE auditoria_benchmark
+                        (LIKE auditoria_accesos INCLUDING DEFAULTS INCLUDING INDEXES)
+                    """)
+            try:
+                inicio = time.time()
+                for i in range(lecturas):
+                    with conn:
+                        with conn.cursor() as cursor:
+                            cursor.execute("""
+                                INSERT INTO auditoria_benchmark (tabla, registro_id, accion, usuario, detalles)
+                                VALUES ('pacientes', %s, 'READ', %s, 'Consulta de paciente')
+                            """, (i % pacientes + 1, usuario))
+                tiempos['síncrono'] = (time.time() - inicio) / lecturas
+            finally:
+                with conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("DROP TABLE auditoria_benchmark")
+            
+            inicio = time.time()
+            for i in range(lecturas):
+                registrar_lectura('pacientes', i % pacientes + 1, usuario, 'Consulta de paciente')
+            tiempos['asíncrono'] = (time.time() - inicio) / lecturas
+            
+            vaciar_lecturas()
+            vaciar_auditoria()
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        SELECT COUNT(*) FROM auditoria_accesos
+                        WHERE usuario = %s AND accion = 'READ'
+                    """, (usuario,))
+                    filas_asincrono = cursor.fetchone()[0]
+        finally:
+            self.db.release_connection(conn)
+        
+        return tiempos, filas_asincrono
+    
+    def test_estadisticas_rollup(self, dias=365):
+        """
+        REQUISITO 6: Estadísticas de un período largo agregando todas las
+        filas de resultados vs. rollup diario + días parciales. Verifica
+        que ambos resultados sean idénticos.
+        """
+        from estadisticas import obtener_estadisticas_periodo
+        fecha_fin = datetime.now()
+        fecha_inicio = fecha_fin - timedelta(days=dias)
+        
+        conn = self.db.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                inicio = time.time()
+                cursor.execute("""
+                    SELECT 
+                        ta.nombre,
+                        COUNT(*),
+                        ROUND(AVG(r.valor), 2),
+                        MIN(r.valor),
+                        MAX(r.valor),
+                        SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END),
+                        ROUND(SUM(CASE WHEN r.fuera_rango = TRUE THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2)
+                    FROM resultados r
+                    JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
+                    WHERE r.fecha_resultado BETWEEN %s AND %s
+                    AND r.valor IS NOT NULL
+                    GROUP BY ta.id, ta.nombre
+                """, (fecha_inicio, fecha_fin))
+                filas = cursor.fetchall()
+                tiempo_filas = time.time() - inicio
+        finally:
+            self.db.release_connection(conn)
+        
+        inicio = time.time()
+        rollup = obtener_estadisticas_periodo(fecha_inicio, fecha_fin, usar_cache=False)
+        tiempo_rollup = time.time() - inicio
+        
+        return {
+            'filas': tiempo_filas,
+            'rollup': tiempo_rollup,
+            'identicos': sorted(filas) == sorted(rollup)
+        }
+    
+    def test_percentiles_sketch(self, dias=365, cuantiles=(0.05, 0.5, 0.95)):
+        """
+        REQUISITO 6: Percentiles de un período largo con percentile_disc
+        sobre todas las filas vs. sketches diarios combinados. Retorna los
+        tiempos y el mayor error relativo del sketch.
+        """
+        from estadisticas import obtener_percentiles_periodo
+        fecha_fin = datetime.now()
+        fecha_inicio = fecha_fin - timedelta(days=dias)
+        
+        conn = self.db.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                inicio = time.time()
+                cursor.execute("""
+                    SELECT 
+                        ta.nombre,
+                        percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY r.valor)
+                    FROM resultados r
+                    JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
+                    WHERE r.fecha_resultado BETWEEN %s AND %s
+                    AND r.valor IS NOT NULL
+                    GROUP BY ta.id, ta.nombre
+                """, (list(cuantiles), fecha_inicio, fecha_fin))
+                exactos = dict(cursor.fetchall())
+                tiempo_exacto = time.time() - inicio
+        finally:
+            self.db.release_connection(conn)
+        
+        inicio = time.time()
+        aproximados = obtener_percentiles_periodo(fecha_inicio, fecha_fin,
+                                                  cuantiles=cuantiles, usar_cache=False)
+        tiempo_sketch = time.time() - inicio
+        
+        error_maximo = 0
+        for nombre, _, *valores in aproximados:
+            for exacto, aproximado in zip(exactos[nombre], valores):
+                exacto = float(exacto)
+                error = abs(aproximado - exacto) / abs(exacto) if exacto else abs(aproximado)
+                error_maximo = max(error_maximo, error)
+        
+        return {
+            'exacto': tiempo_exacto,
+            'sketch': tiempo_sketch,
+            'error_maximo': error_maximo
+        }
+    
+    def test_serie_temporal(self, dias=365, intervalo='semana'):
+        """
+        REQUISITO 6: Serie temporal de un período largo desde las filas de
+        resultados vs. desde el rollup diario. Verifica que sean idénticas.
+        """
+        from estadisticas import obtener_serie_temporal
+        fecha_fin = datetime.now()
+        fecha_inicio = fecha_fin - timedelta(days=dias)
+        
+        inicio = time.time()
+        filas = obtener_serie_temporal(fecha_inicio, fecha_fin, intervalo=intervalo,
+                                       usar_rollup=False, usar_cache=False)
+        tiempo_filas = time.time() - inicio
+        
+        inicio = time.time()
+        rollup = obtener_serie_temporal(fecha_inicio, fecha_fin, intervalo=intervalo,
+                                        usar_cache=False)
+        tiempo_rollup = time.time() - inicio
+        
+        return {
+            'filas': tiempo_filas,
+            'rollup': tiempo_rollup,
+            'intervalos': len(rollup),
+            'identicos': filas == rollup
+        }
+    
+    def test_niveles_alerta(self, cantidad=1000000):
+        """
+        REQUISITO 5: Nivel de alerta de muchos valores con obtener_nivel_alerta
+        (uno por uno, con Decimal como llegan de la base) vs.
+        clasificar_niveles_alerta sobre arrays. Verifica que coincidan, y que
+        con valores que no son centésimos exactos coincidan también con
+        obtener_nivel_alerta en float y con validar_rangos_normales.
+        """
+        import numpy as np
+        from decimal import Decimal
+        from validaciones import (obtener_nivel_alerta, clasificar_niveles_alerta,
+                                  validar_rangos_normales, NIVELES_ALERTA, NORMAL)
+        
+        # Centésimos: rangos de 0 a 100 unidades, valores dentro y fuera
+        generador = np.random.default_rng(0)
+        minimos = generador.integers(0, 20000, cantidad)
+        maximos = minimos + generador.integers(0, 10000, cantidad)
+        valores = minimos + generador.integers(-10000, 20000, cantidad)
+        
+        decimales = [
+            tuple(Decimal(int(x)).scaleb(-2) for x in fila)
+            for fila in zip(valores, minimos, maximos)
+        ]
+        inicio = time.time()
+        escalares = [obtener_nivel_alerta(v, vmin, vmax) for v, vmin, vmax in decimales]
+        tiempo_escalar = time.time() - inicio
+        
+        inicio = time.time()
+        codigos = clasificar_niveles_alerta(valores / 100, minimos / 100, maximos / 100)
+        tiempo_vectorizado = time.time() - inicio
+        
+        # Milésimos (por ejemplo 5.504 con máximo 5.50): sin redondear
+        milesimos = (valores * 10 + generador.integers(-9, 10, cantidad))[:100000] / 1000
+        minimos_f, maximos_f = minimos[:100000] / 100, maximos[:100000] / 100
+        codigos_f = clasificar_niveles_alerta(milesimos, minimos_f, maximos_f)
+        escalares_f = [
+            obtener_nivel_alerta(float(v), float(vmin), float(vmax))
+            for v, vmin, vmax in zip(milesimos, minimos_f, maximos_f)
+        ]
+        fuera = validar_rangos_normales(milesimos, minimos_f, maximos_f) != 0
+        
+        return {
+            'escalar': tiempo_escalar,
+            'vectorizado': tiempo_vectorizado,
+            'identicos': escalares == np.asarray(NIVELES_ALERTA)[codigos].tolist(),
+            'identicos_no_exactos': (
+                escalares_f == np.asarray(NIVELES_ALERTA)[codigos_f].tolist()
+                and bool(np.array_equal(fuera, codigos_f != NORMAL))
+            )
+        }
+    
+    def test_lectura_streaming(self, limite=500000):
+        """
+        Lectura de muchas filas de resultados con fetchall() vs. cursor del
+        servidor (Database.iterar_consulta). Mide tiempo y pico de memoria
+        de Python (tracemalloc; no incluye el buffer de libpq de fetchall).
+        """
+        import tracemalloc
+        sql = """
+            SELECT r.id, r.tipo_analisis_id, r.valor, r.fecha_resultado, r.fuera_rango
+            FROM resultados r
+            WHERE r.valor IS NOT NULL
+            ORDER BY r.id
+            LIMIT %s
+        """
+        
+        conn = self.db.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                tracemalloc.start()
+                inicio = time.time()
+                cursor.execute(sql, (limite,))
+                suma_filas = sum(fila[2] for fila in cursor.fetchall())
+                tiempo_fetchall = time.time() - inicio
+                pico_fetchall = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            self.db.release_connection(conn)
+        
+        tracemalloc.start()
+        inicio = time.time()
+        suma_cursor = sum(fila.valor for fila in self.db.iterar_consulta(sql, (limite,)))
+        tiempo_cursor = time.time() - inicio
+        pico_cursor = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        
+        return {
+            'fetchall': (tiempo_fetchall, pico_fetchall),
+            'cursor': (tiempo_cursor, pico_cursor),
+            'identicos': suma_filas == suma_cursor
+        }
+    
     def ejecutar_todos_los_tests(self):
         """Ejecutar batería completa de tests"""
         print("\n" + "="*80)
@@ -184,6 +568,74 @@ class PerformanceTester:
         if resultado:
             print(f"   ✓ Paciente con más análisis: ID {resultado[0][0]} ({resultado[0][1]} análisis)")
         
+        # Test 7: Encriptación por lotes
+        print("\nTest 7: Encriptación por lotes en paralelo (20.000 valores)")
+        velocidades = self.test_encriptacion_lote(20000)
+        for operacion, (secuencial, lote) in velocidades.items():
+            print(f"   {operacion}: {secuencial:,.0f} filas/s secuencial | "
+                  f"{lote:,.0f} filas/s por lotes (x{lote/secuencial:.1f})")
+        
+        # Test 8: Formatos de cifrado
+        print("\nTest 8: Formato de cifrado Fernet vs. AES-GCM (20.000 valores por campo)")
+        formatos = self.test_formatos_cifrado(20000)
+        for formato in ('fernet', 'aesgcm'):
+            datos = formatos[formato]
+            tamanos = ", ".join(f"{campo} {media:.0f} B" for campo, media in datos['tamanos'].items())
+            print(f"   {formato}: {tamanos} | "
+                  f"{datos['encriptar']:,.0f} enc/s | {datos['desencriptar']:,.0f} dec/s")
+        for formato, filas, bytes_fila in formatos['tabla']:
+            print(f"   Tabla pacientes ({formato}): {filas:,} filas, {bytes_fila:.0f} B cifrados por fila")
+        
+        # Test 9: Triggers de auditoría
+        print("\nTest 9: Trigger de auditoría por fila vs. por sentencia (UPDATE de 20.000 resultados)")
+        filas, tiempos = self.test_triggers_auditoria(20000)
+        for nombre, tiempo in tiempos.items():
+            print(f"   {nombre}: {tiempo*1000:.0f} ms ({filas/tiempo:,.0f} filas/s)")
+        
+        # Test 10: Auditoría de lecturas
+        print("\nTest 10: Auditoría de lecturas síncrona vs. asíncrona (2.000 lecturas de 100 pacientes)")
+        tiempos, filas_asincrono = self.test_auditoria_lecturas(2000, 100)
+        for nombre, tiempo in tiempos.items():
+            print(f"   {nombre}: {tiempo*1e6:,.1f} µs por lectura")
+        print(f"   ✓ Filas de auditoría: 2,000 síncronas | {filas_asincrono:,} asíncronas (agrupadas)")
+        
+        # Test 11: Rollup de estadísticas
+        print("\nTest 11: Estadísticas de 365 días, agregando resultados vs. rollup diario (REQUISITO 6)")
+        datos = self.test_estadisticas_rollup(365)
+        print(f"   Agregando resultados: {datos['filas']*1000:.2f} ms")
+        print(f"   Rollup diario: {datos['rollup']*1000:.2f} ms (x{datos['filas']/datos['rollup']:.1f})")
+        print(f"   ✓ Resultados idénticos: {'Sí' if datos['identicos'] else 'NO'}")
+        
+        # Test 12: Percentiles con sketches
+        print("\nTest 12: Percentiles p5/p50/p95 de 365 días, percentile_disc vs. sketches diarios (REQUISITO 6)")
+        datos = self.test_percentiles_sketch(365)
+        print(f"   percentile_disc: {datos['exacto']*1000:.2f} ms")
+        print(f"   Sketches: {datos['sketch']*1000:.2f} ms (x{datos['exacto']/datos['sketch']:.1f})")
+        print(f"   ✓ Error relativo máximo: {datos['error_maximo']*100:.2f} % (cota: 1 %)")
+        
+        # Test 13: Serie temporal
+        print("\nTest 13: Serie semanal de 365 días, filas de resultados vs. rollup diario (REQUISITO 6)")
+        datos = self.test_serie_temporal(365, 'semana')
+        print(f"   Filas de resultados: {datos['filas']*1000:.2f} ms")
+        print(f"   Rollup diario: {datos['rollup']*1000:.2f} ms (x{datos['filas']/datos['rollup']:.1f})")
+        print(f"   ✓ Intervalos: {datos['intervalos']}, idénticos: {'Sí' if datos['identicos'] else 'NO'}")
+        
+        # Test 14: Niveles de alerta por lotes
+        print("\nTest 14: Nivel de alerta de 1.000.000 valores, uno por uno vs. vectorizado (REQUISITO 5)")
+        datos = self.test_niveles_alerta(1000000)
+        print(f"   Uno por uno: {datos['escalar']*1000:.2f} ms")
+        print(f"   Vectorizado: {datos['vectorizado']*1000:.2f} ms (x{datos['escalar']/datos['vectorizado']:.1f})")
+        print(f"   ✓ Resultados idénticos: {'Sí' if datos['identicos'] else 'NO'}")
+        print(f"   ✓ Valores no exactos (milésimos) idénticos: {'Sí' if datos['identicos_no_exactos'] else 'NO'}")
+        
+        # Test 15: Lectura con cursor del servidor
+        print("\nTest 15: Lectura de 500.000 resultados, fetchall() vs. cursor del servidor")
+        datos = self.test_lectura_streaming(500000)
+        for etiqueta, clave in (('fetchall()', 'fetchall'), ('Cursor del servidor', 'cursor')):
+            tiempo, pico = datos[clave]
+            print(f"   {etiqueta}: {tiempo*1000:.2f} ms, pico de memoria {pico / 1024 / 1024:.1f} MB")
+        print(f"   ✓ Resultados idénticos: {'Sí' if datos['identicos'] else 'NO'}")
+        
     print("\n" + "="*80)
     print("TESTS DE RENDIMIENTO COMPLETADOS")
     print("="*80)
@@ -1,172 +1,534 @@
+import time
+import random
+import threading
 import psycopg2
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from psycopg2.extensions import TransactionRollbackError
+from psycopg2.extras import execute_values
+from config import TRANSACCIONES_CONFIG, AUDITORIA_CONFIG
 from database import Database
-from auditoria import registrar_auditoria
+from auditoria import (registrar_auditoria, registrar_auditoria_lote, establecer_contexto_auditoria,
+                       iniciar_captura, confirmar_captura, descartar_captura)
+from indices_busqueda import guardar_tokens_nombre
+from catalogo import catalogo_analisis
+from idempotencia import reclamar_clave, guardar_respuesta, huella_solicitud
 
 db = Database()
 
-# REQUISITO 1: Implementar transacciones para registro de órdenes
-def registrar_orden_con_analisis(paciente_id, lista_analisis_ids, usuario):
+NIVELES_AISLAMIENTO = ('READ COMMITTED', 'REPEATABLE READ', 'SERIALIZABLE')
+
+# Contadores del proceso: transacciones confirmadas, reintentos por causa
+# (SerializationFailure, DeadlockDetected) y transacciones que agotaron
+# los reintentos
+_estadisticas_reintentos = {'transacciones': 0, 'reintentos': 0, 'agotadas': 0, 'por_causa': {}}
+_estadisticas_lock = threading.Lock()
+
+
+def estadisticas_reintentos():
+    """Copia de los contadores de reintentos del proceso"""
+    with _estadisticas_lock:
+        copia = dict(_estadisticas_reintentos)
+        copia['por_causa'] = dict(_estadisticas_reintentos['por_causa'])
+        return copia
+
+
+def _espera_reintento(intento):
+    """Backoff exponencial con jitter completo"""
+    tope = min(TRANSACCIONES_CONFIG['espera_maxima'],
+               TRANSACCIONES_CONFIG['espera_base'] * 2 ** (intento - 1))
+    return random.uniform(0, tope)
+
+
+# REQUISITO 1: Ejecutor común de transacciones
+def ejecutar_transaccion(unidad_trabajo, aislamiento=None, max_reintentos=None, solo_lectura=False):
     """
-    Transacción ACID para registrar una orden con múltiples análisis
-    Retorna también los IDs de los resultados creados
+    Ejecutar unidad_trabajo(cursor) en una transacción y confirmarla.
+    
+    Ante fallos de serialización o deadlocks (SQLSTATE 40001 / 40P01) hace
+    ROLLBACK, espera un tiempo aleatorio creciente y repite la unidad
+    completa, hasta max_reintentos veces. Por eso la unidad de trabajo solo
+    debe tener efectos en la base de datos.
+    Retorna lo que retorne unidad_trabajo; cualquier otro error se propaga
+    después del ROLLBACK.
     """
+    aislamiento = (aislamiento or TRANSACCIONES_CONFIG['aislamiento']).upper()
+    if aislamiento not in NIVELES_AISLAMIENTO:
+        raise ValueError(f"Nivel de aislamiento no válido: {aislamiento}")
+    if max_reintentos is None:
+        max_reintentos = TRANSACCIONES_CONFIG['max_reintentos']
+    
     conn = db.get_connection()
     try:
-        with conn:
-            with conn.cursor() as cursor:
-                # Iniciar transacción explícita
-                cursor.execute("BEGIN")
-                
-                # 1. Crear la orden
-                cursor.execute("""
-                    INSERT INTO ordenes (paciente_id, usuario_crea)
-                    VALUES (%s, %s)
-                    RETURNING id
-                """, (paciente_id, usuario))
-                
-                orden_id = cursor.fetchone()[0]
-                
-                # 2. Insertar todos los análisis solicitados y guardar IDs
-                ids_resultados = []
-                for analisis_id in lista_analisis_ids:
-                    cursor.execute("""
-                        INSERT INTO resultados 
-                        (orden_id, tipo_analisis_id, usuario_carga)
-                        VALUES (%s, %s, %s)
-                        RETURNING id
-                    """, (orden_id, analisis_id, usuario))
-                    
-                    resultado_id = cursor.fetchone()[0]
-                    ids_resultados.append(resultado_id)
-                
-                # REQUISITO 4: Registrar en auditoría
-                registrar_auditoria(
-                    cursor, 'ordenes', orden_id, 'CREATE', 
-                    usuario, f'Orden con {len(lista_analisis_ids)} análisis'
-                )
+        intento = 0
+        while True:
+            # La auditoría diferida solo se emite si la transacción confirma
+            iniciar_captura()
+            try:
+                with conn:
+                    with conn.cursor() as cursor:
+                        # La estrategia de auditoría llega al trigger en toda
+                        # transacción, aunque la unidad no fije el contexto
+                        cursor.execute(
+                            f"SET TRANSACTION ISOLATION LEVEL {aislamiento}"
+                            + (" READ ONLY" if solo_lectura else "")
+                            + "; SELECT set_config('clinica.estrategia', %s, true)",
+                            (AUDITORIA_CONFIG['estrategia'],)
+                        )
+                        resultado = unidad_trabajo(cursor)
                 
-                # Commit de la transacción
-                cursor.execute("COMMIT")
-                
-                return orden_id, "Orden registrada exitosamente", ids_resultados
+                confirmar_captura()
+                with _estadisticas_lock:
+                    _estadisticas_reintentos['transacciones'] += 1
+                return resultado
                 
+            except TransactionRollbackError as e:
+                descartar_captura()
+                causa = type(e).__name__
+                with _estadisticas_lock:
+                    if intento >= max_reintentos:
+                        _estadisticas_reintentos['agotadas'] += 1
+                    else:
+                        _estadisticas_reintentos['reintentos'] += 1
+                        por_causa = _estadisticas_reintentos['por_causa']
+                        por_causa[causa] = por_causa.get(causa, 0) + 1
+                if intento >= max_reintentos:
+                    raise
+                intento += 1
+                time.sleep(_espera_reintento(intento))
+            except BaseException:
+                descartar_captura()
+                raise
+    finally:
+        db.release_connection(conn)
+
+
+def _bloquear_ordenes(cursor, ordenes_ids):
+    """
+    Bloquear las órdenes en orden de ID antes de tocar sus resultados.
+    Dos cargas sobre la misma orden se serializan: la segunda ve los
+    valores confirmados por la primera y puede completar la orden.
+    """
+    cursor.execute("""
+        SELECT id FROM ordenes
+        WHERE id = ANY(%s)
+        ORDER BY id
+        FOR UPDATE
+    """, (sorted(set(ordenes_ids)),))
+
+# REQUISITO 1: Implementar transacciones para registro de órdenes
+def registrar_orden_con_analisis(paciente_id, lista_analisis_ids, usuario, clave_idempotencia=None):
+    """
+    Transacción ACID para registrar una orden con múltiples análisis
+    Retorna también los IDs de los resultados creados.
+    Con clave_idempotencia, un reintento devuelve la orden original.
+    """
+    def unidad_trabajo(cursor):
+        if clave_idempotencia:
+            previa = reclamar_clave(
+                cursor, clave_idempotencia, 'registrar_orden',
+                huella_solicitud(paciente_id, list(lista_analisis_ids), usuario)
+            )
+            if previa is not None:
+                return previa['orden_id'], "Orden ya registrada (solicitud repetida)", previa['ids_resultados']
+        
+        establecer_contexto_auditoria(
+            cursor, usuario, tabla='ordenes', accion='CREATE',
+            detalles=f'Orden con {len(lista_analisis_ids)} análisis'
+        )
+        
+        # 1. Crear la orden
+        cursor.execute("""
+            INSERT INTO ordenes (paciente_id, usuario_crea)
+            VALUES (%s, %s)
+            RETURNING id
+        """, (paciente_id, usuario))
+        
+        orden_id = cursor.fetchone()[0]
+        
+        # 2. Insertar todos los análisis solicitados y guardar IDs
+        ids_resultados = []
+        for analisis_id in lista_analisis_ids:
+            cursor.execute("""
+                INSERT INTO resultados 
+                (orden_id, tipo_analisis_id, usuario_carga)
+                VALUES (%s, %s, %s)
+                RETURNING id
+            """, (orden_id, analisis_id, usuario))
+            
+            resultado_id = cursor.fetchone()[0]
+            ids_resultados.append(resultado_id)
+        
+        # REQUISITO 4: Registrar en auditoría
+        registrar_auditoria(
+            cursor, 'ordenes', orden_id, 'CREATE', 
+            usuario, f'Orden con {len(lista_analisis_ids)} análisis'
+        )
+        
+        if clave_idempotencia:
+            guardar_respuesta(cursor, clave_idempotencia, {
+                'orden_id': orden_id, 'ids_resultados': ids_resultados
+            })
+        
+        return orden_id, "Orden registrada exitosamente", ids_resultados
+    
+    try:
+        return ejecutar_transaccion(unidad_trabajo)
     except Exception as e:
-        conn.rollback()
         return None, f"Error en transacción: {str(e)}", []
+
+
+def _reservar_ids(cursor, tabla, cantidad):
+    """Reservar IDs del SERIAL de la tabla en una sola consulta"""
+    if cantidad == 0:
+        return []
+    cursor.execute("""
+        SELECT nextval(pg_get_serial_sequence(%s, 'id'))
+        FROM generate_series(1, %s)
+    """, (tabla, cantidad))
+    return [fila[0] for fila in cursor.fetchall()]
+
+
+# REQUISITO 1: Registro masivo de órdenes en una sola transacción
+def registrar_ordenes_lote(ordenes, usuario, ip_address=None, clave_idempotencia=None):
+    """
+    Registrar muchas órdenes (paciente_id, [tipo_analisis_id, ...]) con
+    inserciones multi-fila. Los IDs se reservan antes de insertar, así la
+    correspondencia orden -> resultados no depende del orden de RETURNING.
+    Todo o nada: si una orden falla no se registra ninguna.
+    Con clave_idempotencia, un reintento devuelve las órdenes originales.
+    Retorna ([(orden_id, ids_resultados), ...], mensaje)
+    """
+    ordenes = [(paciente_id, list(analisis_ids)) for paciente_id, analisis_ids in ordenes]
+    if not ordenes:
+        return [], "No hay órdenes para registrar"
     
-    finally:
-        db.release_connection(conn)
+    def unidad_trabajo(cursor):
+        if clave_idempotencia:
+            previa = reclamar_clave(
+                cursor, clave_idempotencia, 'registrar_ordenes_lote',
+                huella_solicitud(ordenes, usuario)
+            )
+            if previa is not None:
+                registradas = [(orden_id, ids) for orden_id, ids in previa]
+                return registradas, f"{len(registradas)} órdenes ya registradas (solicitud repetida)"
+        
+        total_analisis = sum(len(analisis_ids) for _, analisis_ids in ordenes)
+        ids_ordenes = _reservar_ids(cursor, 'ordenes', len(ordenes))
+        ids_resultados = iter(_reservar_ids(cursor, 'resultados', total_analisis))
+        
+        filas_resultados = []
+        registradas = []
+        for orden_id, (paciente_id, analisis_ids) in zip(ids_ordenes, ordenes):
+            ids_orden = []
+            for analisis_id in analisis_ids:
+                resultado_id = next(ids_resultados)
+                filas_resultados.append((resultado_id, orden_id, analisis_id, usuario))
+                ids_orden.append(resultado_id)
+            registradas.append((orden_id, ids_orden))
+        
+        establecer_contexto_auditoria(
+            cursor, usuario, ip_address, tabla='ordenes', accion='CREATE',
+            detalles_por_id={orden_id: f'Orden con {len(ids_orden)} análisis (lote)'
+                             for orden_id, ids_orden in registradas}
+        )
+        
+        execute_values(cursor, """
+            INSERT INTO ordenes (id, paciente_id, usuario_crea)
+            VALUES %s
+        """, [(orden_id, paciente_id, usuario)
+              for orden_id, (paciente_id, _) in zip(ids_ordenes, ordenes)],
+            page_size=1000)
+        
+        if filas_resultados:
+            execute_values(cursor, """
+                INSERT INTO resultados 
+                (id, orden_id, tipo_analisis_id, usuario_carga)
+                VALUES %s
+            """, filas_resultados, page_size=1000)
+        
+        # REQUISITO 4: Auditoría de todas las órdenes en un solo INSERT
+        registrar_auditoria_lote(cursor, [
+            ('ordenes', orden_id, 'CREATE', usuario,
+             f'Orden con {len(ids_orden)} análisis (lote)', ip_address)
+            for orden_id, ids_orden in registradas
+        ])
+        
+        if clave_idempotencia:
+            guardar_respuesta(cursor, clave_idempotencia, registradas)
+        
+        return registradas, f"{len(registradas)} órdenes registradas exitosamente"
+    
+    try:
+        return ejecutar_transaccion(unidad_trabajo)
+    except Exception as e:
+        return None, f"Error en transacción: {str(e)}"
 
 
 # REQUISITO 1: Implementar transacciones para carga de resultados
-def cargar_resultado_con_validacion(resultado_id, valor, usuario, ip_address=None):
+def cargar_resultado_con_validacion(resultado_id, valor, usuario, ip_address=None,
+                                    clave_idempotencia=None):
     """
-    Transacción ACID para cargar resultado con validación de rango
+    Transacción ACID para cargar resultado con validación de rango.
+    Con clave_idempotencia, un reintento no repite la carga ni la auditoría.
     """
-    conn = db.get_connection()
+    def unidad_trabajo(cursor):
+        if clave_idempotencia:
+            previa = reclamar_clave(
+                cursor, clave_idempotencia, 'cargar_resultado',
+                huella_solicitud(resultado_id, valor, usuario)
+            )
+            if previa is not None:
+                return True, previa['fuera_rango'], "Resultado ya cargado (solicitud repetida)"
+        
+        # Orden y tipo de análisis del resultado (el rango sale del catálogo)
+        cursor.execute("""
+            SELECT orden_id, tipo_analisis_id
+            FROM resultados
+            WHERE id = %s
+        """, (resultado_id,))
+        
+        fila = cursor.fetchone()
+        if not fila:
+            raise Exception("Resultado no encontrado")
+        
+        orden_id, tipo_analisis_id = fila
+        _bloquear_ordenes(cursor, [orden_id])
+        nombre_analisis = catalogo_analisis.obtener(tipo_analisis_id)[2]
+        
+        # REQUISITO 5: Validación transaccional de rangos normales
+        fuera_rango = catalogo_analisis.fuera_de_rango(tipo_analisis_id, valor)
+        
+        establecer_contexto_auditoria(
+            cursor, usuario, ip_address, tabla='resultados', accion='UPDATE',
+            detalles=f'{nombre_analisis}: {valor} {"[FUERA DE RANGO]" if fuera_rango else ""}'
+        )
+        
+        # Actualizar resultado
+        cursor.execute("""
+            UPDATE resultados
+            SET valor = %s,
+                fecha_resultado = %s,
+                fuera_rango = %s,
+                usuario_carga = %s
+            WHERE id = %s
+        """, (valor, datetime.now(), fuera_rango, usuario, resultado_id))
+        
+        # Actualizar estado de la orden si todos los resultados están completos
+        establecer_contexto_auditoria(cursor, usuario, ip_address, tabla='ordenes',
+                                      detalles='Orden completada')
+        cursor.execute("""
+            UPDATE ordenes
+            SET estado = 'COMPLETADO'
+            WHERE id = %s
+            AND NOT EXISTS (
+                SELECT 1 FROM resultados 
+                WHERE orden_id = ordenes.id AND valor IS NULL
+            )
+        """, (orden_id,))
+        
+        # REQUISITO 4: Auditoría de acceso
+        registrar_auditoria(
+            cursor, 'resultados', resultado_id, 'UPDATE',
+            usuario, f'{nombre_analisis}: {valor} {"[FUERA DE RANGO]" if fuera_rango else ""}',
+            ip_address
+        )
+        
+        if clave_idempotencia:
+            guardar_respuesta(cursor, clave_idempotencia, {'fuera_rango': fuera_rango})
+        
+        return True, fuera_rango, "Resultado cargado exitosamente"
+    
     try:
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("BEGIN")
-                
-                # Obtener rango normal del tipo de análisis
-                cursor.execute("""
-                    SELECT ta.valor_min, ta.valor_max, ta.nombre
-                    FROM resultados r
-                    JOIN tipos_analisis ta ON r.tipo_analisis_id = ta.id
-                    WHERE r.id = %s
-                """, (resultado_id,))
-                
-                rango = cursor.fetchone()
-                if not rango:
-                    raise Exception("Resultado no encontrado")
-                
-                valor_min, valor_max, nombre_analisis = rango
-                
-                # REQUISITO 5: Validación transaccional de rangos normales
-                fuera_rango = False
-                if valor_min is not None and valor_max is not None:
-                    if valor < valor_min or valor > valor_max:
-                        fuera_rango = True
-                
-                # Actualizar resultado
-                cursor.execute("""
-                    UPDATE resultados
-                    SET valor = %s,
-                        fecha_resultado = %s,
-                        fuera_rango = %s,
-                        usuario_carga = %s
-                    WHERE id = %s
-                """, (valor, datetime.now(), fuera_rango, usuario, resultado_id))
-                
-                # Actualizar estado de la orden si todos los resultados están completos
-                cursor.execute("""
-                    UPDATE ordenes
-                    SET estado = 'COMPLETADO'
-                    WHERE id = (SELECT orden_id FROM resultados WHERE id = %s)
-                    AND NOT EXISTS (
-                        SELECT 1 FROM resultados 
-                        WHERE orden_id = ordenes.id AND valor IS NULL
-                    )
-                """, (resultado_id,))
-                
-                # REQUISITO 4: Auditoría de acceso
-                registrar_auditoria(
-                    cursor, 'resultados', resultado_id, 'UPDATE',
-                    usuario, f'{nombre_analisis}: {valor} {"[FUERA DE RANGO]" if fuera_rango else ""}',
-                    ip_address
-                )
-                
-                cursor.execute("COMMIT")
-                
-                return True, fuera_rango, "Resultado cargado exitosamente"
-                
+        return ejecutar_transaccion(unidad_trabajo)
     except Exception as e:
-        conn.rollback()
         return False, False, f"Error: {str(e)}"
+
+
+# Límite de la columna resultados.valor NUMERIC(10,2)
+VALOR_MAXIMO_RESULTADO = Decimal('99999999.99')
+
+
+def _validar_valor(valor):
+    """Convertir a Decimal y verificar que entra en NUMERIC(10,2)"""
+    try:
+        valor = Decimal(str(valor))
+    except (InvalidOperation, ValueError):
+        return None, "Valor no numérico"
+    if not valor.is_finite():
+        return None, "Valor no numérico"
+    if abs(valor.quantize(Decimal('0.01'))) > VALOR_MAXIMO_RESULTADO:
+        return None, "Valor fuera del rango admitido por la columna"
+    return valor, None
+
+
+# REQUISITO 1 y 5: Carga masiva de resultados con validación por conjuntos
+def cargar_resultados_lote(items, usuario, ip_address=None, clave_idempotencia=None):
+    """
+    Cargar muchos pares (resultado_id, valor) en una transacción con pocas
+    sentencias: un SELECT FOR UPDATE de los resultados, un UPDATE multi-fila
+    (fuera_rango se calcula con el catálogo en memoria), un UPDATE que
+    completa las órdenes afectadas y un INSERT de auditoría.
+    Los elementos inválidos se reportan sin abortar el resto del lote.
+    Retorna ([(resultado_id, exito, fuera_rango, mensaje), ...], mensaje)
+    en el mismo orden de items. Con clave_idempotencia, un reintento
+    devuelve el informe original sin volver a cargar.
+    """
+    items = list(items)
+    informe = [None] * len(items)
     
-    finally:
-        db.release_connection(conn)
+    # Validación local: valor y duplicados (prevalece la última aparición)
+    validos = {}
+    for posicion, (resultado_id, valor) in enumerate(items):
+        if not isinstance(resultado_id, int) or isinstance(resultado_id, bool):
+            informe[posicion] = (resultado_id, False, False, "ID de resultado inválido")
+            continue
+        valor_decimal, error = _validar_valor(valor)
+        if error:
+            informe[posicion] = (resultado_id, False, False, error)
+            continue
+        if resultado_id in validos:
+            anterior = validos[resultado_id][0]
+            informe[anterior] = (resultado_id, False, False, "Resultado repetido en el lote")
+        validos[resultado_id] = (posicion, valor_decimal)
+    
+    if not validos:
+        return informe, "Ningún resultado válido en el lote"
+    
+    fecha = datetime.now()
+    
+    def unidad_trabajo(cursor):
+        if clave_idempotencia:
+            previa = reclamar_clave(
+                cursor, clave_idempotencia, 'cargar_resultados_lote',
+                huella_solicitud(items, usuario)
+            )
+            if previa is not None:
+                return [tuple(item) for item in previa['informe']], previa['mensaje']
+        
+        cursor.execute("""
+            SELECT id, orden_id, tipo_analisis_id
+            FROM resultados
+            WHERE id = ANY(%s)
+        """, (sorted(validos),))
+        existentes = cursor.fetchall()
+        
+        # Mismo orden de bloqueo que la carga individual: órdenes por ID
+        _bloquear_ordenes(cursor, [orden_id for _, orden_id, _ in existentes])
+        
+        # REQUISITO 5: validación de rangos contra el catálogo en memoria
+        actualizados = []
+        for resultado_id, orden_id, tipo_analisis_id in existentes:
+            valor = validos[resultado_id][1]
+            fuera_rango = catalogo_analisis.fuera_de_rango(tipo_analisis_id, valor)
+            nombre_analisis = catalogo_analisis.obtener(tipo_analisis_id)[2]
+            actualizados.append((resultado_id, orden_id, fuera_rango, nombre_analisis, valor))
+        
+        establecer_contexto_auditoria(
+            cursor, usuario, ip_address, tabla='resultados', accion='UPDATE',
+            detalles_por_id={
+                resultado_id: f'{nombre_analisis}: {valor} {"[FUERA DE RANGO]" if fuera_rango else ""}'
+                for resultado_id, _, fuera_rango, nombre_analisis, valor in actualizados
+            }
+        )
+        
+        if actualizados:
+            execute_values(cursor, """
+                UPDATE resultados r
+                SET valor = v.valor,
+                    fecha_resultado = v.fecha,
+                    fuera_rango = v.fuera_rango,
+                    usuario_carga = v.usuario
+                FROM (VALUES %s) AS v(id, valor, fuera_rango, fecha, usuario)
+                WHERE r.id = v.id
+            """, [(resultado_id, valor, fuera_rango, fecha, usuario)
+                  for resultado_id, _, fuera_rango, _, valor in actualizados],
+                template='(%s::integer, %s::numeric, %s::boolean, %s::timestamp, %s)',
+                page_size=1000)
+        
+        # Completar las órdenes afectadas que ya no tienen pendientes
+        establecer_contexto_auditoria(cursor, usuario, ip_address, tabla='ordenes',
+                                      detalles='Orden completada')
+        ordenes_afectadas = sorted({orden_id for _, orden_id, _, _, _ in actualizados})
+        cursor.execute("""
+            UPDATE ordenes
+            SET estado = 'COMPLETADO'
+            WHERE id = ANY(%s)
+            AND NOT EXISTS (
+                SELECT 1 FROM resultados 
+                WHERE orden_id = ordenes.id AND valor IS NULL
+            )
+        """, (ordenes_afectadas,))
+        
+        # REQUISITO 4: Auditoría de todo el lote en un solo INSERT
+        registrar_auditoria_lote(cursor, [
+            ('resultados', resultado_id, 'UPDATE', usuario,
+             f'{nombre_analisis}: {valor} {"[FUERA DE RANGO]" if fuera_rango else ""}',
+             ip_address)
+            for resultado_id, _, fuera_rango, nombre_analisis, valor in actualizados
+        ])
+        
+        cargados = {resultado_id: fuera_rango for resultado_id, _, fuera_rango, _, _ in actualizados}
+        for resultado_id, (posicion, _) in validos.items():
+            if resultado_id in cargados:
+                informe[posicion] = (resultado_id, True, cargados[resultado_id], "Resultado cargado exitosamente")
+            else:
+                informe[posicion] = (resultado_id, False, False, "Resultado no encontrado")
+        mensaje = f"{len(cargados)} de {len(items)} resultados cargados"
+        
+        if clave_idempotencia:
+            guardar_respuesta(cursor, clave_idempotencia, {'informe': informe, 'mensaje': mensaje})
+        
+        return informe, mensaje
+    
+    try:
+        return ejecutar_transaccion(unidad_trabajo)
+    except Exception as e:
+        for resultado_id, (posicion, _) in validos.items():
+            informe[posicion] = (resultado_id, False, False, f"Error: {str(e)}")
+        return informe, f"Error en transacción: {str(e)}"
 
 
 def registrar_paciente(nombre, dni, fecha_nac, telefono, usuario):
     """
     Transacción para registrar paciente con datos encriptados
     """
-    conn = db.get_connection()
+    # REQUISITO 3: Encriptar datos sensibles (fuera de la transacción:
+    # no se repite si hay que reintentarla)
+    nombre_enc = db.encriptar(nombre)
+    dni_enc = db.encriptar(dni)
+    telefono_enc = db.encriptar(telefono) if telefono else None
+    # Índice ciego: el UNIQUE sobre dni_hash detecta DNIs duplicados
+    dni_hash = db.indice_ciego(dni)
+    
+    def unidad_trabajo(cursor):
+        establecer_contexto_auditoria(
+            cursor, usuario, tabla='pacientes', accion='CREATE',
+            detalles='Nuevo paciente registrado'
+        )
+        
+        cursor.execute("""
+            INSERT INTO pacientes 
+            (nombre_enc, dni_enc, dni_hash, fecha_nacimiento, telefono_enc)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id
+        """, (nombre_enc, dni_enc, dni_hash, fecha_nac, telefono_enc))
+        
+        paciente_id = cursor.fetchone()[0]
+        
+        # Índice de búsqueda parcial por nombre
+        guardar_tokens_nombre(cursor, paciente_id, nombre)
+        
+        registrar_auditoria(
+            cursor, 'pacientes', paciente_id, 'CREATE',
+            usuario, f'Nuevo paciente registrado'
+        )
+        
+        return paciente_id, "Paciente registrado"
+    
     try:
-        with conn:
-            with conn.cursor() as cursor:
-                cursor.execute("BEGIN")
-                
-                # REQUISITO 3: Encriptar datos sensibles
-                nombre_enc = db.encriptar(nombre)
-                dni_enc = db.encriptar(dni)
-                telefono_enc = db.encriptar(telefono) if telefono else None
-                
-                cursor.execute("""
-                    INSERT INTO pacientes 
-                    (nombre_enc, dni_enc, fecha_nacimiento, telefono_enc)
-                    VALUES (%s, %s, %s, %s)
-                    RETURNING id
-                """, (nombre_enc, dni_enc, fecha_nac, telefono_enc))
-                
-                paciente_id = cursor.fetchone()[0]
-                
-                registrar_auditoria(
-                    cursor, 'pacientes', paciente_id, 'CREATE',
-                    usuario, f'Nuevo paciente registrado'
-                )
-                
-                cursor.execute("COMMIT")
-                return paciente_id, "Paciente registrado"
-                
+        return ejecutar_transaccion(unidad_trabajo)
     except psycopg2.IntegrityError:
-        conn.rollback()
         return None, "DNI ya existe en el sistema"
     except Exception as e:
-        conn.rollback()
         return None, f"Error: {str(e)}"
-    finally:
-        db.release_connection(conn)
\ No newline at end of file
@@ -2,6 +2,12 @@
 REQUISITO 5: Validaciones transaccionales para rangos normales
 """
 
+import numpy as np
+
+# Códigos de clasificar_niveles_alerta: posición en NIVELES_ALERTA
+NIVELES_ALERTA = ('NORMAL', 'LEVE', 'MODERADO', 'CRITICO')
+NORMAL, LEVE, MODERADO, CRITICO = range(4)
+
 def validar_rango_normal(valor, valor_min, valor_max):
     """
     Valida si un valor está dentro del rango normal
@@ -40,6 +46,10 @@ def obtener_nivel_alerta(valor, valor_min, valor_max):
     if valor >= valor_min and valor <= valor_max:
         return 'NORMAL'
     
+    # Rango de un solo valor: cualquier desvío es proporcionalmente infinito
+    if rango == 0 and (valor < valor_min or valor > valor_max):
+        return 'CRITICO'
+    
     if valor < valor_min:
         diferencia = valor_min - valor
         porcentaje = (diferencia / rango) * 100
@@ -62,4 +72,90 @@ def obtener_nivel_alerta(valor, valor_min, valor_max):
         else:
             return 'CRITICO'
     
-    return 'NORMAL'
\ No newline at end of file
+    return 'NORMAL'
+
+
+def _arrays_rango(valores, valores_min, valores_max):
+    """Arrays float64 de igual forma; None -> NaN (sin rango / sin valor)"""
+    valores = np.asarray(valores, dtype=np.float64)
+    minimos = np.broadcast_to(np.asarray(valores_min, dtype=np.float64), valores.shape)
+    maximos = np.broadcast_to(np.asarray(valores_max, dtype=np.float64), valores.shape)
+    return valores, minimos, maximos
+
+
+def validar_rangos_normales(valores, valores_min, valores_max):
+    """
+    Versión por lotes de validar_rango_normal.
+    
+    Args:
+        valores: array (o lista) de valores
+        valores_min, valores_max: array por fila o un escalar para todas;
+            None/NaN = sin rango de referencia
+    
+    Returns:
+        np.ndarray (int8): -1 por debajo, 0 dentro o sin rango, 1 por encima
+        (es_valido = codigos == 0)
+    """
+    valores, minimos, maximos = _arrays_rango(valores, valores_min, valores_max)
+    codigos = (valores > maximos).astype(np.int8) - (valores < minimos).astype(np.int8)
+    # Falta uno de los límites: sin rango de referencia
+    codigos[np.isnan(minimos) | np.isnan(maximos)] = 0
+    return codigos
+
+
+def clasificar_niveles_alerta(valores, valores_min, valores_max, decimales=2):
+    """
+    Versión por lotes de obtener_nivel_alerta: misma clasificación, en una
+    pasada sobre arrays NumPy.
+    
+    Los valores no se redondean: dentro/fuera del rango se decide con los
+    valores tal cual, como validar_rangos_normales. Para los umbrales, las
+    filas cuyos tres valores son múltiplos exactos de 10^-decimales (los de
+    la base son NUMERIC(10,2)) se comparan como enteros y sin dividir
+    (diferencia * 10 < rango equivale a porcentaje < 10): el resultado es
+    el de obtener_nivel_alerta con Decimal. El resto usa la misma cuenta en
+    float que obtener_nivel_alerta.
+    
+    Args:
+        valores: array (o lista) de valores
+        valores_min, valores_max: array por fila o un escalar para todas;
+            None/NaN = sin rango de referencia (NORMAL)
+    
+    Returns:
+        np.ndarray (int8) de códigos; np.asarray(NIVELES_ALERTA)[codigos]
+        da los nombres
+    """
+    valores, minimos, maximos = _arrays_rango(valores, valores_min, valores_max)
+    escala = 10 ** decimales
+    
+    # Sin valor o sin rango: NORMAL
+    completos = ~(np.isnan(valores) | np.isnan(minimos) | np.isnan(maximos))
+    
+    exactos = completos.copy()
+    enteros = []
+    for array in (valores, minimos, maximos):
+        entero = np.rint(np.where(completos, array, 0) * escala)
+        # El float más cercano a un múltiplo de 10^-decimales
+        exactos &= entero / escala == array
+        enteros.append(entero.astype(np.int64))
+    
+    valor, minimo, maximo = enteros
+    rango = maximo - minimo
+    # Distancia al rango en enteros (solo vale en las filas exactas)
+    diferencia = np.maximum(minimo - valor, valor - maximo)
+    leve = diferencia * 10 < rango
+    moderado = diferencia * 10 < rango * 3
+    
+    inexactos = completos & ~exactos
+    if inexactos.any():
+        v, vmin, vmax = valores[inexactos], minimos[inexactos], maximos[inexactos]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            porcentaje = np.where(v < vmin, vmin - v, v - vmax) / (vmax - vmin) * 100
+        leve[inexactos] = porcentaje < 10
+        moderado[inexactos] = porcentaje < 30
+    
+    codigos = np.full(valores.shape, CRITICO, dtype=np.int8)
+    codigos[moderado] = MODERADO
+    codigos[leve] = LEVE
+    codigos[((valores >= minimos) & (valores <= maximos)) | ~completos] = NORMAL
+    return codigos
\ No newline at end of file
@@ -3,9 +3,9 @@ Script para verificar el estado de la encriptación
 """
 
 import os
-from config import ENCRYPTION_KEY, DB_CONFIG
+from config import ENCRYPTION_KEY
 from database import Database
-import psycopg2
+from funcionalidades_extra import FuncionalidadesExtra
 
 def verify_encryption():
     print("="*70)
@@ -25,8 +25,9 @@ def verify_encryption():
     
     # 2. Verificar conexión a BD
     print("\n2. Conexión a base de datos:")
+    db = Database()
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = db.get_connection()
         print("   ✓ Conexión exitosa")
         
         # 3. Verificar datos encriptados
@@ -37,21 +38,17 @@ def verify_encryption():
         
         if total > 0:
             # Intentar desencriptar un paciente
-            cursor.execute("SELECT id, nombre_enc, dni_enc FROM pacientes LIMIT 1")
-            pac = cursor.fetchone()
+            cursor.execute("SELECT id FROM pacientes LIMIT 1")
+            paciente_id = cursor.fetchone()[0]
             
-            db = Database()
             try:
-                nombre_enc = bytes(pac[1]) if isinstance(pac[1], memoryview) else pac[1]
-                dni_enc = bytes(pac[2]) if isinstance(pac[2], memoryview) else pac[2]
-                
-                nombre = db.desencriptar(nombre_enc)
-                dni = db.desencriptar(dni_enc)
+                # Sin caché: la verificación siempre desencripta desde la BD
+                paciente = FuncionalidadesExtra().obtener_paciente(paciente_id, usar_cache=False)
                 
                 print(f"\n4. Prueba de desencriptación:")
-                print(f"   ✓ Paciente ID {pac[0]} desencriptado correctamente")
-                print(f"   Nombre: {nombre}")
-                print(f"   DNI: {dni}")
+                print(f"   ✓ Paciente ID {paciente_id} desencriptado correctamente")
+                print(f"   Nombre: {paciente['nombre']}")
+                print(f"   DNI: {paciente['dni']}")
                 print("\n" + "="*70)
                 print("✓ SISTEMA DE ENCRIPTACIÓN FUNCIONANDO CORRECTAMENTE")
                 print("="*70)
@@ -68,7 +65,7 @@ def verify_encryption():
                 print("3. Restaure la variable de entorno ENCRYPTION_KEY correcta")
         
         cursor.close()
-        conn.close()
+        db.release_connection(conn)
         
     except Exception as e:
         print(f"   Error de conexión: {e}")